@@ -1,13 +1,18 @@
 # estimation/admin.py
 
 from django.contrib import admin
+from django.http import Http404
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
 from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
 from .models import (
     Projet, Client, Categorie, Discipline,
-    Unite, Element, DemandeElement, EstimationElement, EstimationSummary
+    Unite, Element, DemandeElement, EstimationElement, EstimationSummary, Tache
 )
+from .profilage import journal
+from .recalcul import recalculs_groupes
 
 
 @admin.register(Projet)
@@ -66,6 +71,11 @@ class ElementAdmin(admin.ModelAdmin):
         ('Statut',                 {'fields': ('actif',)}),
     )
 
+    def changelist_view(self, request, extra_context=None):
+        # list_editable : plusieurs prix modifiés d'un coup -> un recalcul par projet
+        with recalculs_groupes():
+            return super().changelist_view(request, extra_context)
+
 
 @admin.register(DemandeElement)
 class DemandeElementAdmin(admin.ModelAdmin):
@@ -103,23 +113,25 @@ class DemandeElementAdmin(admin.ModelAdmin):
 
     def approuver_demandes(self, request, queryset):
         count = 0
-        for demande in queryset:
-            if demande.statut == 'en_attente':
-                demande.statut = 'approuve'
-                demande.date_validation = timezone.now()
-                demande.save()
-                count += 1
+        with recalculs_groupes():
+            for demande in queryset:
+                if demande.statut == 'en_attente':
+                    demande.statut = 'approuve'
+                    demande.date_validation = timezone.now()
+                    demande.save()
+                    count += 1
         self.message_user(request, f"{count} demande(s) approuvée(s).")
     approuver_demandes.short_description = "Approuver les demandes sélectionnées"
 
     def rejeter_demandes(self, request, queryset):
         count = 0
-        for demande in queryset:
-            if demande.statut == 'en_attente':
-                demande.statut = 'rejete'
-                demande.date_validation = timezone.now()
-                demande.save()
-                count += 1
+        with recalculs_groupes():
+            for demande in queryset:
+                if demande.statut == 'en_attente':
+                    demande.statut = 'rejete'
+                    demande.date_validation = timezone.now()
+                    demande.save()
+                    count += 1
         self.message_user(request, f"{count} demande(s) rejetée(s).")
     rejeter_demandes.short_description = "Rejeter les demandes sélectionnées"
 
@@ -168,6 +180,54 @@ class EstimationSummaryAdmin(admin.ModelAdmin):
     cout_total_ttc_display.short_description = "Total TTC"
 
 
+@admin.register(Tache)
+class TacheAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'type_tache', 'statut', 'progression_display', 'date_creation', 'date_fin']
+    list_filter = ['type_tache', 'statut']
+    readonly_fields = [
+        'type_tache', 'statut', 'parametres', 'progression', 'total', 'message',
+        'date_creation', 'date_debut', 'date_fin',
+    ]
+
+    def progression_display(self, obj):
+        return format_html(
+            '<div style="width: 120px; background: #eee;">'
+            '<div style="width: {}%; background: #667eea; color: #fff; text-align: center;">{}%</div>'
+            '</div> {} / {}',
+            obj.pourcentage, obj.pourcentage, obj.progression, obj.total
+        )
+    progression_display.short_description = "Progression"
+
+    def has_add_permission(self, request):
+        return False
+
+
+# --- Profilage des requêtes (estimation/profilage.py) ---
+# Pages branchées dans estimation_project/urls.py via admin.site.admin_view (staff seulement)
+
+def profilage_liste(request):
+    if request.method == 'POST' and 'vider' in request.POST:
+        journal.vider()
+        return redirect('admin_profilage')
+    return TemplateResponse(request, 'admin/profilage.html', {
+        **admin.site.each_context(request),
+        'title': "Requêtes les plus lentes",
+        'profils': journal.profils(),
+        'taille': journal.taille,
+    })
+
+
+def profilage_detail(request, profil_id):
+    profil = journal.profil(profil_id)
+    if profil is None:
+        raise Http404("Profil introuvable (journal vidé ou requête sortie du classement)")
+    return TemplateResponse(request, 'admin/profilage_detail.html', {
+        **admin.site.each_context(request),
+        'title': str(profil),
+        'profil': profil,
+    })
+
+
 # Titres du site admin
 admin.site.site_header = "Administration - Système d'Estimation"
 admin.site.site_title = "Estimation Admin"
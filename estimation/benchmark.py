@@ -0,0 +1,267 @@
+# estimation/benchmark.py
+"""Mesure des vues principales à travers le client de test Django.
+
+Chaque scénario est joué une fois pour chauffer les caches (index en
+mémoire, référentiel, gabarits), puis ``repetitions`` fois chronométré. On
+relève ensuite, sur deux passages à part :
+
+- le nombre de requêtes SQL (``connection.execute_wrapper`` : le journal
+  ``connection.queries`` est vidé au début de chaque requête HTTP) ;
+- le pic de mémoire Python alloué (``tracemalloc``, qui ralentit l'exécution
+  et fausserait les temps).
+
+Le résultat est un dictionnaire sérialisable en JSON, à comparer d'une
+exécution à l'autre (commande ``benchmark_vues``). Les scénarios AJAX
+d'écriture renvoient les quantités existantes : les données ne changent pas.
+
+``comparer_excel`` (commande ``benchmark_excel``) compare les deux modes de
+l'export Excel sur des rapports synthétiques de taille croissante. Chaque
+mesure tourne dans un processus neuf, pour que le pic de mémoire résidente
+(RSS) d'une mesure ne se reporte pas sur la suivante.
+"""
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client as ClientHttp
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import processus
+from .models import Client, Element, EstimationElement, EstimationSummary, Projet
+
+REPETITIONS = 5
+TEXTE_RECHERCHE = 'coude inox'
+NB_QUANTITES_AJAX = 50
+TAILLES_EXCEL = (1_000, 10_000, 100_000)
+MODES_EXCEL = ('classeur', 'flux')
+
+
+def projet_par_defaut():
+    """Projet qui a le plus de lignes d'estimation."""
+    return (Projet.objects.annotate(nb_lignes=Count('estimationelement'))
+            .order_by('-nb_lignes', 'id').first())
+
+
+def categorie_par_defaut():
+    """Catégorie qui a le plus d'éléments actifs (la plus lourde à parcourir)."""
+    ligne = (Element.objects.filter(actif=True).values('categorie')
+             .annotate(nb=Count('id')).order_by('-nb', 'categorie').first())
+    return ligne and ligne['categorie']
+
+
+def scenarios(projet, categorie_id):
+    """``{nom: fonction(client_http)}`` ; chaque fonction renvoie la réponse HTTP (ou ``None``)."""
+    lignes = list(EstimationElement.objects.filter(projet=projet, element__isnull=False)
+                  .order_by('id').values_list('element_id', 'quantite')[:NB_QUANTITES_AJAX])
+    changements = json.dumps({'changements': [{'element_id': element_id, 'quantite': str(quantite)}
+                                              for element_id, quantite in lignes]})
+
+    def calculer_totaux(_):
+        EstimationSummary.objects.get(projet=projet).calculer_totaux()
+
+    liste = {
+        'item_selection': lambda c: c.get(reverse('item_selection', args=[categorie_id])),
+        'item_selection_recherche': lambda c: c.get(reverse('item_selection', args=[categorie_id]),
+                                                    {'search': TEXTE_RECHERCHE}),
+        'recherche_globale': lambda c: c.get(reverse('recherche_globale'), {'q': TEXTE_RECHERCHE}),
+        'rapport_projet': lambda c: c.get(reverse('rapport_projet', args=[projet.id])),
+        'export_pdf_reportlab': lambda c: c.get(reverse('export_pdf', args=[projet.id])),
+        'export_excel_advanced': lambda c: c.get(reverse('export_excel', args=[projet.id])),
+        'calculer_totaux': calculer_totaux,
+        'ajax_scenarios_tva': lambda c: c.get(reverse('ajax_scenarios_tva', args=[projet.id]),
+                                              {'tva': '0,10,18', 'marge': '0,5,10', 'remise': '0,5'}),
+        'ajax_update_quantities': lambda c: c.post(reverse('ajax_update_quantities'), changements,
+                                                   content_type='application/json'),
+        'ajax_elements_similaires': lambda c: c.get(reverse('ajax_elements_similaires'),
+                                                    {'q': 'coude inoz dn50', 'categorie': categorie_id}),
+        'ajax_elements_suggest': lambda c: c.get(reverse('ajax_elements_suggest'),
+                                                 {'q': 'cou in', 'categorie': categorie_id}),
+    }
+    if lignes:
+        element_id, quantite = lignes[0]
+        liste['ajax_update_quantity'] = lambda c: c.post(
+            reverse('ajax_update_quantity'), json.dumps({'element_id': element_id, 'quantite': str(quantite)}),
+            content_type='application/json')
+    return liste
+
+
+def _consommer(reponse):
+    """Lit tout le corps (réponses en flux comprises) ; renvoie (statut, octets)."""
+    if reponse is None:
+        return None, 0
+    # Pas de reponse.close() : le client de test l'a déjà fait (un second appel
+    # émettrait request_finished, qui ferme la connexion à la base)
+    if reponse.streaming:
+        taille = sum(len(morceau) for morceau in reponse.streaming_content)
+    else:
+        taille = len(reponse.content)
+    return reponse.status_code, taille
+
+
+class CompteurRequetes:
+    """Enveloppe d'exécution SQL qui compte les requêtes."""
+
+    def __init__(self):
+        self.nombre = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.nombre += 1
+        return execute(sql, params, many, context)
+
+
+def mesurer(fonction, client_http, repetitions=REPETITIONS):
+    statut, taille = _consommer(fonction(client_http))  # échauffement
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        _consommer(fonction(client_http))
+        durees.append((time.perf_counter() - debut) * 1000)
+
+    requetes = CompteurRequetes()
+    with connection.execute_wrapper(requetes):
+        _consommer(fonction(client_http))
+
+    tracemalloc.start()
+    try:
+        _consommer(fonction(client_http))
+        _, pic = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'statut': statut,
+        'octets': taille,
+        'duree_ms': {
+            'mediane': round(statistics.median(durees), 2),
+            'min': round(min(durees), 2),
+            'max': round(max(durees), 2),
+        },
+        'requetes': requetes.nombre,
+        'memoire_pic_ko': round(pic / 1024, 1),
+    }
+
+
+def executer(projet=None, categorie_id=None, repetitions=REPETITIONS, selection=None):
+    """Joue les scénarios (tous, ou ceux de ``selection``) ; renvoie le rapport JSON sous forme de dict."""
+    projet = projet or projet_par_defaut()
+    if projet is None:
+        raise ValueError("Aucun projet en base : lancer d'abord la commande generer_donnees.")
+    categorie_id = categorie_id or categorie_par_defaut()
+    a_jouer = scenarios(projet, categorie_id)
+    if selection:
+        inconnus = set(selection) - set(a_jouer)
+        if inconnus:
+            raise ValueError(f"Scénario(s) inconnu(s) : {', '.join(sorted(inconnus))}")
+        a_jouer = {nom: a_jouer[nom] for nom in selection}
+
+    client_http = ClientHttp()
+    session = client_http.session
+    session['client_id'] = projet.client_id
+    session['projet_id'] = projet.id
+    session.save()
+
+    resultats = {}
+    with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        try:
+            for nom, fonction in a_jouer.items():
+                resultats[nom] = mesurer(fonction, client_http, repetitions)
+        finally:
+            client_http.logout()
+
+    return {
+        'date': timezone.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'base': connection.vendor,
+        'repetitions': repetitions,
+        'projet': {
+            'id': projet.id,
+            'lignes': EstimationElement.objects.filter(projet=projet).count(),
+        },
+        'categorie': {
+            'id': categorie_id,
+            'elements': Element.objects.filter(categorie_id=categorie_id, actif=True).count(),
+        },
+        'catalogue': Element.objects.count(),
+        'scenarios': resultats,
+    }
+
+
+def rapport_synthetique(nb_lignes, graine=42):
+    """Rapport de ``nb_lignes`` lignes standards réparties sur les catégories synthétiques, sans base."""
+    from .donnees_synthetiques import ARTICLES, CATEGORIES, DIAMETRES, MATIERES, SERIES, UNITES
+    from .rapport import STANDARD, Ligne, Rapport, Section
+
+    alea = random.Random(graine)
+    sections = [Section(i, nom, type_categorie) for i, (_, nom, type_categorie) in enumerate(CATEGORIES, 1)]
+    totaux = {}
+    for i in range(nb_lignes):
+        section = sections[i % len(sections)]
+        dn = alea.choice(DIAMETRES)
+        prix = Decimal(alea.randint(100, 5_000_000)) / 100
+        quantite = Decimal(alea.randint(1, 2000)) / 4
+        total = (prix * quantite).quantize(Decimal('0.01'))
+        section.lignes.append(Ligne(
+            STANDARD, f'{alea.choice(ARTICLES)} {alea.choice(MATIERES)} DN{dn}',
+            f'{alea.choice(SERIES)}, Ø {dn} mm', prix, quantite, alea.choice(UNITES)[2], total,
+            reference=f'SYN-{i:06d}'))
+        section.total += total
+        totaux[section.type_categorie] = totaux.get(section.type_categorie, Decimal('0')) + total
+    return Rapport(None, 0, sections, totaux, Decimal('18'), timezone.now(), [])
+
+
+def mesurer_excel(mode, nb_lignes, repetitions=1):
+    """Dans un processus dédié : durée médiane et pic RSS de l'export Excel ``mode``."""
+    from .export_excel import ecrire_excel_flux
+    from .views import ecrire_excel_classeur
+
+    ecrire = {'classeur': ecrire_excel_classeur, 'flux': ecrire_excel_flux}[mode]
+    projet = Projet(nom=f'Benchmark {nb_lignes} lignes', client=Client(nom='Client benchmark'))
+    rapport = rapport_synthetique(nb_lignes)
+    rss_avant = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Ko sous Linux
+    durees = []
+    for _ in range(repetitions):
+        with tempfile.TemporaryFile() as sortie:
+            debut = time.perf_counter()
+            ecrire(projet, rapport, [], sortie)
+            durees.append((time.perf_counter() - debut) * 1000)
+            taille = sortie.tell()
+    rss_pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'duree_ms': round(statistics.median(durees), 1),
+        'rss_pic_mo': round(rss_pic / 1024, 1),
+        'rss_export_mo': round((rss_pic - rss_avant) / 1024, 1),
+        'octets': taille,
+    }
+
+
+def comparer_excel(tailles=TAILLES_EXCEL, modes=MODES_EXCEL, repetitions=1):
+    """``{taille: {mode: mesure}}`` ; une mesure par processus neuf (``spawn``)."""
+    contexte = multiprocessing.get_context('spawn')
+    resultats = {}
+    for taille in tailles:
+        for mode in modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=contexte, initializer=processus.initialiser,
+                                     initargs=(processus.configuration(),)) as pool:
+                mesure = pool.submit(mesurer_excel, mode, taille, repetitions).result()
+            resultats.setdefault(str(taille), {})[mode] = mesure
+    return {
+        'date': timezone.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'repetitions': repetitions,
+        'tailles': resultats,
+    }
@@ -0,0 +1,151 @@
+# estimation/cache_exports.py
+"""Cache sur disque des exports (PDF, Excel, CSV), adressé par leur contenu.
+
+Le nom de fichier est l'empreinte (SHA-256) de tout ce qui détermine le
+document : clé du rapport en cache (version du projet, qui avance aussi avec
+le taux de TVA du résumé, génération du catalogue, référentiel), nom et client
+du projet, date du jour (imprimée dans le document), sablage en cours inclus,
+version du gabarit de l'export et logo. Deux demandes identiques donnent donc le même fichier,
+servi tel quel (``FileResponse``) avec l'empreinte pour ``ETag`` : un
+navigateur qui renvoie ``If-None-Match`` reçoit un 304.
+
+Les fichiers sont rangés sous ``MEDIA_ROOT/exports/<2 caractères>/``, écrits
+dans un fichier temporaire puis renommés : un fichier partiel n'est jamais
+servi. La date de modification tient lieu de date de dernier accès (mise à
+jour à chaque service) ; après chaque écriture, les fichiers les moins
+récemment servis sont supprimés tant que le cache dépasse
+``ESTIMATION_EXPORTS_TAILLE_MAX`` octets ou ``ESTIMATION_EXPORTS_NOMBRE_MAX``
+fichiers.
+"""
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .rapport import cle_cache
+
+REPERTOIRE = 'exports'
+TAILLE_MAX_PAR_DEFAUT = 200 * 1024 * 1024
+NOMBRE_MAX_PAR_DEFAUT = 1000
+
+# Format : (extension, type MIME, version du gabarit). Incrémenter la version
+# quand le rendu du document change : les fichiers en cache sont alors ignorés.
+FORMATS = {
+    'pdf': ('pdf', 'application/pdf', 1),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 2),
+    'csv': ('csv', 'text/csv; charset=utf-8', 2),
+}
+
+
+def repertoire():
+    return Path(settings.MEDIA_ROOT) / REPERTOIRE
+
+
+def chemin_logo():
+    return os.path.join(settings.STATIC_ROOT or settings.BASE_DIR, 'static', 'img', 'logo.jpg')
+
+
+def empreinte(projet, format, elements_sablage=(), date=None):
+    """Empreinte du document ``format`` du projet (voir l'en-tête du module)."""
+    try:
+        logo = os.stat(chemin_logo())
+        logo = (logo.st_size, logo.st_mtime_ns)
+    except OSError:
+        logo = None
+    contenu = {
+        'format': format,
+        'gabarit': FORMATS[format][2],
+        'rapport': cle_cache(projet),
+        'projet': [projet.nom, str(projet.client)],
+        'date': (date or datetime.date.today()).isoformat(),
+        'sablage': list(elements_sablage or ()),
+        'logo': logo,
+    }
+    texte = json.dumps(contenu, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(texte.encode()).hexdigest()
+
+
+def chemin(cle, format):
+    return repertoire() / cle[:2] / f'{cle}.{FORMATS[format][0]}'
+
+
+def obtenir(cle, format, generer):
+    """Chemin du fichier en cache ; ``generer(fichier binaire)`` l'écrit s'il n'existe pas."""
+    fichier = chemin(cle, format)
+    try:
+        os.utime(fichier)  # dernier accès, pour l'éviction
+        return fichier
+    except FileNotFoundError:
+        pass
+
+    fichier.parent.mkdir(parents=True, exist_ok=True)
+    descripteur, temporaire = tempfile.mkstemp(dir=fichier.parent, suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'wb') as sortie:
+            generer(sortie)
+        os.replace(temporaire, fichier)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+    evincer(garder=fichier)
+    return fichier
+
+
+def evincer(garder=None):
+    """Supprime les fichiers les moins récemment servis au-delà des limites ; renvoie leur nombre."""
+    taille_max = getattr(settings, 'ESTIMATION_EXPORTS_TAILLE_MAX', TAILLE_MAX_PAR_DEFAUT)
+    nombre_max = getattr(settings, 'ESTIMATION_EXPORTS_NOMBRE_MAX', NOMBRE_MAX_PAR_DEFAUT)
+    fichiers = []
+    for fichier in repertoire().glob('*/*'):
+        if fichier.suffix == '.tmp':
+            continue  # en cours d'écriture
+        try:
+            infos = fichier.stat()
+        except FileNotFoundError:
+            continue  # supprimé entre-temps par un autre processus
+        fichiers.append((infos.st_mtime_ns, infos.st_size, fichier))
+
+    fichiers.sort()  # le moins récemment servi en tête
+    taille = sum(taille_fichier for _, taille_fichier, _ in fichiers)
+    supprimes = 0
+    for _, taille_fichier, fichier in fichiers:
+        if taille <= taille_max and len(fichiers) - supprimes <= nombre_max:
+            break
+        if fichier == garder:
+            continue
+        fichier.unlink(missing_ok=True)
+        taille -= taille_fichier
+        supprimes += 1
+    return supprimes
+
+
+def servir(request, projet, format, nom_fichier, generer, elements_sablage=()):
+    """Réponse d'export : 304 si le client a déjà ce document, sinon le fichier en cache (généré au besoin)."""
+    return servir_cle(request, empreinte(projet, format, elements_sablage), format, nom_fichier, generer)
+
+
+def servir_cle(request, cle, format, nom_fichier, generer=None):
+    """Comme ``servir`` pour une empreinte connue ; sans ``generer``, ``None`` si le fichier n'est plus en cache."""
+    etag = f'"{cle}"'
+    reponse = get_conditional_response(request, etag=etag)
+    if reponse is None:
+        if generer is not None:
+            fichier = obtenir(cle, format, generer)
+        else:
+            fichier = chemin(cle, format)
+            try:
+                os.utime(fichier)
+            except FileNotFoundError:
+                return None  # évincé
+        reponse = FileResponse(open(fichier, 'rb'), as_attachment=True, filename=nom_fichier,
+                               content_type=FORMATS[format][1])
+    reponse['ETag'] = etag
+    # Toujours revalider : le même lien donne un autre document dès que l'estimation change
+    patch_cache_control(reponse, private=True, no_cache=True)
+    return reponse
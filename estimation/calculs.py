@@ -0,0 +1,284 @@
+# estimation/calculs.py
+"""Calcul ensembliste des totaux d'un projet.
+
+Les totaux par type de catégorie sont obtenus par quelques requêtes SQL
+groupées au lieu de parcourir chaque ligne en Python : le nombre de requêtes
+ne dépend plus du nombre de lignes du projet.
+
+Le résumé est aussi maintenu de façon incrémentale : chaque ligne ajoutée,
+modifiée ou supprimée applique un delta signé à son compartiment
+``cout_total_<type>`` (voir ``appliquer_deltas``). Le coût de chaque ligne est
+arrondi au centime dans les deux cas, pour que la somme des deltas retombe
+exactement sur le calcul complet.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, IntegerField, Sum, Value
+from django.db.models.functions import Coalesce, NullIf, Round
+from django.utils import timezone
+
+TYPES_CATEGORIE = ('materiel', 'main_oeuvre', 'transport', 'etude')
+
+PRIX_FIELD = DecimalField(max_digits=15, decimal_places=2)
+MONTANT_FIELD = DecimalField(max_digits=20, decimal_places=2)
+ZERO = Decimal('0')
+CENTIME = Decimal('0.01')
+
+
+def prix_unitaire_expression():
+    """Équivalent SQL de ``EstimationElement.prix_unitaire_utilise``.
+
+    Même ordre de priorité : prix fixe, puis prix admin de la demande liée,
+    puis prix catalogue de l'élément. Une valeur nulle ou à 0 passe au suivant
+    (comme le test de vérité Python).
+    """
+    return Coalesce(
+        NullIf(F('prix_unitaire_fixe'), Value(ZERO)),
+        NullIf(F('demande_element__prix_unitaire_admin'), Value(ZERO)),
+        F('element__prix_unitaire'),
+        Value(ZERO),
+        output_field=PRIX_FIELD,
+    )
+
+
+def cout_ligne_expression():
+    """Équivalent SQL de ``EstimationElement.cout_total``, arrondi au centime."""
+    return Round(F('quantite') * prix_unitaire_expression(), 2, output_field=MONTANT_FIELD)
+
+
+def cout_demande_expression():
+    """Équivalent SQL de ``DemandeElement.cout_total`` (demande approuvée), arrondi au centime."""
+    return Round(F('quantite') * F('prix_unitaire_admin'), 2, output_field=MONTANT_FIELD)
+
+
+def au_centime(montant):
+    return Decimal(montant).quantize(CENTIME, rounding=ROUND_HALF_UP)
+
+
+def agreger_projet(projet_id):
+    """Totaux d'un projet en 3 requêtes groupées.
+
+    Retourne ``(totaux, sous_totaux)`` : ``{type_categorie: montant}`` et
+    ``{(categorie_id, discipline_id): (nb_lignes, montant)}``.
+
+    - éléments standards (avec élément catalogue) groupés par catégorie/discipline ;
+    - demandes personnalisées approuvées avec prix admin ;
+    - sessions de sablage validées (comptées en main d'œuvre, hors sous-totaux).
+    """
+    from .models import DemandeElement, EstimationElement, SessionSablage
+
+    totaux = dict.fromkeys(TYPES_CATEGORIE, ZERO)
+    sous_totaux = {}
+
+    lignes = (EstimationElement.objects
+              .filter(projet_id=projet_id, element__isnull=False)
+              .order_by()
+              .values_list('element__categorie__type_categorie',
+                           'element__categorie_id', 'element__discipline_id')
+              .annotate(nb=Count('id'),
+                        montant=Sum(cout_ligne_expression(), output_field=MONTANT_FIELD)))
+    demandes = (DemandeElement.objects
+                .filter(projet_id=projet_id, statut='approuve', prix_unitaire_admin__isnull=False)
+                .order_by()
+                .values_list('categorie__type_categorie', 'categorie_id', 'discipline_id')
+                .annotate(nb=Count('id'),
+                          montant=Sum(cout_demande_expression(), output_field=MONTANT_FIELD)))
+
+    for type_cat, categorie_id, discipline_id, nb, montant in list(lignes) + list(demandes):
+        if type_cat not in totaux or montant is None:
+            continue
+        montant = au_centime(montant)
+        totaux[type_cat] += montant
+        nb_avant, montant_avant = sous_totaux.get((categorie_id, discipline_id), (0, ZERO))
+        sous_totaux[(categorie_id, discipline_id)] = (nb_avant + nb, montant_avant + montant)
+
+    sablage = (SessionSablage.objects
+               .filter(projet_id=projet_id, valide=True)
+               .aggregate(montant=Sum('cout_total'))['montant'])
+    if sablage is not None:
+        totaux['main_oeuvre'] += sablage
+
+    # Au centime, comme les colonnes du résumé (SQLite agrège en flottants)
+    return {type_cat: au_centime(montant) for type_cat, montant in totaux.items()}, sous_totaux
+
+
+def totaux_par_type(projet_id):
+    """Retourne ``{type_categorie: montant}`` pour un projet (voir ``agreger_projet``)."""
+    return agreger_projet(projet_id)[0]
+
+
+def reconstruire_sous_totaux(projet_id, sous_totaux):
+    """Remplace les sous-totaux matérialisés d'un projet."""
+    from .models import EstimationSubtotal
+
+    EstimationSubtotal.objects.filter(projet_id=projet_id).delete()
+    EstimationSubtotal.objects.bulk_create([
+        EstimationSubtotal(projet_id=projet_id, categorie_id=categorie_id,
+                           discipline_id=discipline_id, nb_lignes=nb, montant=montant)
+        for (categorie_id, discipline_id), (nb, montant) in sous_totaux.items()
+    ])
+
+
+# -----------------------------
+# Scénarios (TVA, marge, remise) sans écriture
+# -----------------------------
+
+def calculer_scenario(totaux, tva_taux, marge_taux=ZERO, remise_taux=ZERO):
+    """HT/TVA/TTC pour un jeu de taux (en %), calcul pur à partir des compartiments.
+
+    La marge s'applique aux coûts, la remise au montant margé, la TVA au HT final.
+    """
+    tva_taux, marge_taux, remise_taux = (Decimal(str(t)) for t in (tva_taux, marge_taux, remise_taux))
+    cout_total = sum(totaux.values(), ZERO)
+    marge = au_centime(cout_total * marge_taux / 100)
+    remise = au_centime((cout_total + marge) * remise_taux / 100)
+    cout_total_ht = cout_total + marge - remise
+    tva_montant = au_centime(cout_total_ht * tva_taux / 100)
+    return {
+        'tva_taux': tva_taux,
+        'marge_taux': marge_taux,
+        'remise_taux': remise_taux,
+        'cout_total': cout_total,
+        'marge': marge,
+        'remise': remise,
+        'cout_total_ht': cout_total_ht,
+        'tva_montant': tva_montant,
+        'cout_total_ttc': cout_total_ht + tva_montant,
+    }
+
+
+# -----------------------------
+# Maintenance incrémentale
+# -----------------------------
+
+def _lignes_contributives(model):
+    """Queryset des lignes de ``model`` qui comptent dans le résumé, annotées
+    de leur compartiment (``type_cat``), de leur coût (``montant``) et de la clé
+    de leur sous-total (``cat_id``, ``disc_id``)."""
+    from .models import DemandeElement, EstimationElement, SessionSablage
+
+    if model is EstimationElement:
+        return (EstimationElement.objects
+                .filter(element__isnull=False)
+                .annotate(type_cat=F('element__categorie__type_categorie'),
+                          montant=cout_ligne_expression(),
+                          cat_id=F('element__categorie_id'),
+                          disc_id=F('element__discipline_id')))
+    if model is DemandeElement:
+        return (DemandeElement.objects
+                .filter(statut='approuve', prix_unitaire_admin__isnull=False)
+                .annotate(type_cat=F('categorie__type_categorie'),
+                          montant=cout_demande_expression(),
+                          cat_id=F('categorie_id'),
+                          disc_id=F('discipline_id')))
+    if model is SessionSablage:
+        return (SessionSablage.objects
+                .filter(valide=True)
+                .annotate(type_cat=Value('main_oeuvre'), montant=F('cout_total'),
+                          cat_id=Value(None, output_field=IntegerField()),
+                          disc_id=Value(None, output_field=IntegerField())))
+    raise ValueError(f"Modèle non suivi par le résumé : {model.__name__}")
+
+
+def contribution(model, pk):
+    """``(projet_id, type_cat, montant, sous_total)`` de la ligne telle qu'en base,
+    ou None si elle ne compte pas dans le résumé. Une seule requête.
+
+    ``sous_total`` est la clé ``(categorie_id, discipline_id)``, None pour le sablage.
+    """
+    if pk is None:
+        return None
+    ligne = (_lignes_contributives(model)
+             .filter(pk=pk)
+             .order_by()
+             .values_list('projet_id', 'type_cat', 'montant', 'cat_id', 'disc_id')
+             .first())
+    if ligne is None or ligne[1] not in TYPES_CATEGORIE or ligne[2] is None:
+        return None
+    projet_id, type_cat, montant, categorie_id, discipline_id = ligne
+    sous_total = (categorie_id, discipline_id) if categorie_id and discipline_id else None
+    return projet_id, type_cat, au_centime(montant), sous_total
+
+
+def appliquer_deltas(avant, apres, projets_ids=()):
+    """Applique ``apres - avant`` aux résumés et sous-totaux concernés par des
+    UPDATE atomiques.
+
+    ``avant``/``apres`` sont des contributions (voir ``contribution``) ;
+    ``projets_ids`` sont les projets dont le contenu a changé même sans effet
+    sur les montants (leur version est incrémentée).
+    Retourne les ids des projets sans résumé, à recalculer complètement.
+    """
+    deltas = {projet_id: {} for projet_id in projets_ids if projet_id}
+    deltas_sous_totaux = {}
+    for signe, ligne in ((-1, avant), (1, apres)):
+        if ligne:
+            projet_id, type_cat, montant, sous_total = ligne
+            par_type = deltas.setdefault(projet_id, {})
+            par_type[type_cat] = par_type.get(type_cat, ZERO) + signe * montant
+            if sous_total:
+                cle = (projet_id,) + sous_total
+                nb, total = deltas_sous_totaux.get(cle, (0, ZERO))
+                deltas_sous_totaux[cle] = (nb + signe, total + signe * montant)
+
+    sans_resume = []
+    for projet_id, par_type in deltas.items():
+        if not appliquer_delta(projet_id, par_type):
+            sans_resume.append(projet_id)
+    for (projet_id, categorie_id, discipline_id), (nb, montant) in deltas_sous_totaux.items():
+        # Le recalcul complet d'un projet sans résumé reconstruira ses sous-totaux
+        if projet_id not in sans_resume and (nb or montant):
+            appliquer_delta_sous_total(projet_id, categorie_id, discipline_id, nb, montant)
+    return sans_resume
+
+
+def appliquer_delta(projet_id, par_type):
+    """``UPDATE`` du résumé : compartiments et HT, puis TVA et TTC dérivés.
+
+    Les compartiments et le HT lisent les valeurs d'avant la mise à jour, le
+    résultat est donc cohérent même avec des écritures concurrentes. La TVA
+    est recalculée en ``Decimal`` à partir du HT mis à jour, dans la même
+    transaction (la ligne reste verrouillée par l'``UPDATE``) : une division
+    SQL serait entière sous SQLite avec des montants ronds.
+    La version du projet et celle du résumé avancent ensemble : un résumé à
+    jour le reste, un résumé périmé le reste aussi (il sera recalculé).
+    """
+    from .models import EstimationSummary, Projet
+
+    Projet.marquer_modifies([projet_id])
+    champs = {'version_calculee': F('version_calculee') + 1,
+              'derniere_mise_a_jour': timezone.now()}
+    montants_modifies = any(par_type.values())
+    if montants_modifies:
+        total = sum(par_type.values(), ZERO)
+        champs.update({
+            f'cout_total_{type_cat}': F(f'cout_total_{type_cat}') + Value(delta)
+            for type_cat, delta in par_type.items() if delta
+        })
+        champs['cout_total_ht'] = F('cout_total_ht') + Value(total)
+
+    resumes = EstimationSummary.objects.filter(projet_id=projet_id)
+    with transaction.atomic(savepoint=False):
+        if not resumes.update(**champs):
+            return 0
+        if montants_modifies:
+            ht, tva_taux = resumes.values_list('cout_total_ht', 'tva_taux').get()
+            tva = au_centime(ht * tva_taux / 100)
+            resumes.update(tva_montant=tva, cout_total_ttc=ht + tva)
+    return 1
+
+
+def appliquer_delta_sous_total(projet_id, categorie_id, discipline_id, nb, montant):
+    """``UPDATE`` du sous-total (projet, catégorie, discipline), créé au besoin."""
+    from .models import EstimationSubtotal
+
+    cle = {'projet_id': projet_id, 'categorie_id': categorie_id, 'discipline_id': discipline_id}
+    if EstimationSubtotal.objects.filter(**cle).update(nb_lignes=F('nb_lignes') + nb,
+                                                      montant=F('montant') + Value(montant)):
+        return
+    sous_total, cree = EstimationSubtotal.objects.get_or_create(
+        **cle, defaults={'nb_lignes': nb, 'montant': montant})
+    if not cree:  # créé entre-temps par une écriture concurrente
+        EstimationSubtotal.objects.filter(pk=sous_total.pk).update(
+            nb_lignes=F('nb_lignes') + nb, montant=F('montant') + Value(montant))
@@ -0,0 +1,198 @@
+# estimation/donnees_synthetiques.py
+"""Jeu de données synthétique reproductible, pour mesurer les vues à l'échelle.
+
+Même graine et mêmes paramètres : mêmes clients, projets, éléments, lignes,
+demandes et sessions de sablage (seuls les ids et les dates diffèrent).
+Tout ce qui est généré est reconnaissable (codes et numéros ``SYN-``, e-mails
+``@synthetique.local``) et peut être supprimé avec ``purger()``.
+
+Les insertions passent par ``bulk_create`` : pas de signaux. Les caches du
+catalogue sont invalidés et les résumés des projets calculés à la fin (une
+fois par projet), puis les statistiques du planificateur mises à jour
+(``ANALYZE``) : sans elles, SQLite suppose qu'une égalité indexée ne renvoie
+qu'une dizaine de lignes et peut choisir de très mauvais plans (ex. parcourir
+une catégorie et relancer la requête FTS5 pour chaque élément).
+"""
+import random
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from .models import (
+    CalculSablage, Categorie, Client, DemandeElement, Discipline, Element, EstimationElement,
+    Projet, SessionSablage, Unite,
+)
+from .pagination import invalider_catalogue
+from .recalcul import recalculer_projet, recalculs_groupes
+from .trigrammes import index_catalogue
+
+PREFIXE = 'SYN-'
+DOMAINE = 'synthetique.local'
+TAILLE_LOT = 5000
+# Prix fixe négocié d'une ligne sur dix
+REMISE = Decimal('0.9')
+
+CATEGORIES = [
+    ('SYN-MAT-TUY', 'Matériel tuyauterie', 'materiel'),
+    ('SYN-MAT-ELE', 'Matériel électrique', 'materiel'),
+    ('SYN-MAT-GC', 'Matériel génie civil', 'materiel'),
+    ('SYN-MO-TUY', "Main d'œuvre tuyauterie", 'main_oeuvre'),
+    ('SYN-MO-ELE', "Main d'œuvre électricité", 'main_oeuvre'),
+    ('SYN-TRA', 'Transport et levage', 'transport'),
+    ('SYN-ETU', 'Études et ingénierie', 'etude'),
+]
+DISCIPLINES = [
+    ('SYN-TUY', 'Tuyauterie', '#007bff'),
+    ('SYN-ELE', 'Électricité', '#ffc107'),
+    ('SYN-GC', 'Génie civil', '#6c757d'),
+    ('SYN-INS', 'Instrumentation', '#28a745'),
+]
+UNITES = [('u', 'Unité', 'u'), ('ml', 'Mètre linéaire', 'm'), ('m2', 'm²', 'm²'),
+          ('kg', 'Kilogramme', 'kg'), ('h', 'Heure', 'h'), ('ff', 'Forfait', 'ff')]
+
+ARTICLES = ['Coude 90°', 'Coude 45°', 'Tube', 'Té égal', 'Té réduit', 'Réduction concentrique',
+            'Bride plate', 'Bride à collerette', 'Vanne à boisseau', 'Vanne papillon', 'Clapet anti-retour',
+            'Manchon', 'Câble', 'Chemin de câbles', 'Disjoncteur', 'Presse-étoupe', 'Transmetteur de pression',
+            'Béton dosé', 'Ferraillage', 'Coffrage', 'Support de tuyauterie', 'Joint spiralé', 'Boulonnerie']
+MATIERES = ['inox 316L', 'inox 304L', 'acier carbone', 'acier galvanisé', 'PVC', 'PEHD', 'cuivre',
+            'fonte ductile', 'aluminium', 'laiton']
+DIAMETRES = [15, 20, 25, 32, 40, 50, 65, 80, 100, 125, 150, 200, 250, 300]
+SERIES = ['SCH10', 'SCH40', 'SCH80', 'PN10', 'PN16', 'PN40', 'classe 150', 'classe 300']
+PIECES_SABLAGE = ['tube', 'coude_90', 'coude_45', 'te', 'reduction', 'bride']
+
+
+def purger():
+    """Supprime les données synthétiques ; renvoie le nombre d'objets supprimés."""
+    with transaction.atomic(), recalculs_groupes(executer=False):
+        supprimes, _ = Client.objects.filter(email__endswith=f'@{DOMAINE}').delete()
+        nb, _ = Element.objects.filter(numero__startswith=PREFIXE).delete()
+        supprimes += nb
+        for modele in (Categorie, Discipline):
+            nb, _ = modele.objects.filter(code__startswith=PREFIXE).delete()
+            supprimes += nb
+        transaction.on_commit(_invalider_catalogue)
+    return supprimes
+
+
+def generer(graine=42, clients=20, projets_par_client=3, elements=100_000, lignes_par_projet=500,
+            demandes_par_projet=20, sessions_par_projet=2):
+    """Crée le jeu de données ; renvoie le nombre d'objets créés par modèle."""
+    alea = random.Random(graine)
+    with transaction.atomic(), recalculs_groupes(executer=False):
+        unites, disciplines, categories = _referentiel()
+        catalogue = _inserer(Element, [_element(alea, i, unites, disciplines, categories)
+                                       for i in range(elements)])
+        standards = [element for element in catalogue
+                     if element.categorie.type_categorie in ('materiel', 'main_oeuvre')]
+
+        liste_clients = _inserer(Client, [
+            Client(nom=f'Client {i:03d}', email=f'client{i:03d}@{DOMAINE}', entreprise=f'Entreprise {i:03d}',
+                   password='!')  # mot de passe inutilisable
+            for i in range(clients)
+        ])
+        projets = _inserer(Projet, [
+            Projet(nom=f'{PREFIXE}{client.nom} - projet {j}', client=client, client_nom=client.nom)
+            for client in liste_clients for j in range(projets_par_client)
+        ])
+
+        nb_lignes = nb_demandes = nb_sessions = 0
+        for projet in projets:
+            nb_lignes += _lignes(alea, projet, standards, lignes_par_projet)
+            nb_demandes += _demandes(alea, projet, unites, disciplines, categories, demandes_par_projet)
+            nb_sessions += _sessions(alea, projet, sessions_par_projet)
+        transaction.on_commit(_invalider_catalogue)
+
+    for projet in projets:
+        recalculer_projet(projet.id)
+    analyser()
+    return {'clients': len(liste_clients), 'projets': len(projets), 'elements': len(catalogue),
+            'lignes': nb_lignes, 'demandes': nb_demandes, 'sessions_sablage': nb_sessions}
+
+
+def analyser():
+    """Met à jour les statistiques du planificateur (SQLite, PostgreSQL)."""
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def _inserer(modele, objets):
+    """``bulk_create`` si la base renvoie les ids insérés, sinon une insertion par objet (MySQL)."""
+    if connection.features.can_return_rows_from_bulk_insert:
+        return modele.objects.bulk_create(objets, batch_size=TAILLE_LOT)
+    for objet in objets:
+        objet.save(force_insert=True)
+    return objets
+
+
+def _invalider_catalogue():
+    index_catalogue.invalider()
+    invalider_catalogue()
+
+
+def _referentiel():
+    unites = [Unite.objects.get_or_create(code=code, defaults={'libelle': libelle, 'symbole': symbole})[0]
+              for code, libelle, symbole in UNITES]
+    disciplines = [Discipline.objects.get_or_create(code=code, defaults={'nom': nom, 'couleur': couleur})[0]
+                   for code, nom, couleur in DISCIPLINES]
+    categories = [Categorie.objects.get_or_create(code=code, defaults={'nom': nom, 'type_categorie': type_cat})[0]
+                  for code, nom, type_cat in CATEGORIES]
+    return unites, disciplines, categories
+
+
+def _element(alea, i, unites, disciplines, categories):
+    categorie = categories[i % len(categories)]
+    dn = alea.choice(DIAMETRES)
+    return Element(
+        numero=f'{PREFIXE}{categorie.code[4:]}-{i:06d}',
+        designation=f'{alea.choice(ARTICLES)} {alea.choice(MATIERES)} DN{dn}',
+        caracteristiques=f'{alea.choice(SERIES)}, Ø {dn} mm',
+        prix_unitaire=Decimal(alea.randint(100, 5_000_000)) / 100,
+        unite=alea.choice(unites),
+        categorie=categorie,
+        discipline=alea.choice(disciplines),
+        actif=alea.random() > 0.02,
+    )
+
+
+def _lignes(alea, projet, standards, nombre):
+    choisis = alea.sample(standards, min(nombre, len(standards)))
+    EstimationElement.objects.bulk_create([
+        EstimationElement(projet=projet, element=element, quantite=Decimal(alea.randint(1, 2000)) / 4,
+                          prix_unitaire_fixe=(element.prix_unitaire * REMISE).quantize(Decimal('0.01')) if alea.random() < 0.1 else None)
+        for element in choisis
+    ], batch_size=TAILLE_LOT)
+    return len(choisis)
+
+
+def _demandes(alea, projet, unites, disciplines, categories, nombre):
+    demandes = []
+    for i in range(nombre):
+        statut = alea.choice(['en_attente', 'approuve', 'approuve', 'rejete'])
+        demandes.append(DemandeElement(
+            projet=projet, categorie=alea.choice(categories), discipline=alea.choice(disciplines),
+            designation=f'{alea.choice(ARTICLES)} spécial {i}', caracteristiques='Sur plan',
+            unite=alea.choice(unites), quantite=Decimal(alea.randint(1, 40)), statut=statut,
+            prix_unitaire_admin=Decimal(alea.randint(1_000, 900_000)) if statut == 'approuve' else None,
+        ))
+    DemandeElement.objects.bulk_create(demandes)
+    return len(demandes)
+
+
+def _sessions(alea, projet, nombre):
+    for _ in range(nombre):
+        calculs = []
+        for _ in range(alea.randint(3, 8)):
+            quantite = Decimal(alea.randint(1, 50))
+            surface = Decimal(alea.randint(5_000, 900_000)) / 1_000_000
+            calculs.append(CalculSablage(projet=projet, type_piece=alea.choice(PIECES_SABLAGE),
+                                         diametre_dn=alea.choice(DIAMETRES), quantite=quantite,
+                                         surface_unitaire=surface, surface_totale=surface * quantite))
+        calculs = _inserer(CalculSablage, calculs)
+        surface_globale = sum(calcul.surface_totale for calcul in calculs)
+        session = _inserer(SessionSablage, [SessionSablage(
+            projet=projet, surface_globale=surface_globale,
+            cout_total=(surface_globale * 5000).quantize(Decimal('0.01')), valide=alea.random() < 0.5,
+        )])[0]
+        session.calculs.add(*calculs)
+    return nombre
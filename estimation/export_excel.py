@@ -0,0 +1,262 @@
+# estimation/export_excel.py
+"""Export Excel en écriture seule (``openpyxl.Workbook(write_only=True)``).
+
+Même mise en page que le classeur construit en mémoire (``views``), mais les
+lignes sont écrites au fil de l'eau dans le fichier de sortie : la mémoire ne
+grandit plus avec le nombre de lignes. Les styles sont des styles nommés
+déclarés une fois par classeur ; chaque cellule ne porte que le nom de son
+style au lieu de ses propres objets ``Font``/``PatternFill``/``Alignment``.
+
+Choix du mode : voir ``ecriture_seule`` (réglage ``ESTIMATION_EXCEL_SEUIL_FLUX``).
+"""
+import datetime
+import logging
+import os
+from io import BytesIO
+
+import openpyxl
+from django.conf import settings
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as ExcelImage
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from PIL import Image as PILImage
+
+from . import cache_exports
+from .rapport import DESIGNATION_SABLAGE, PERSONNALISE, TEMPORAIRE
+
+logger = logging.getLogger(__name__)
+
+# Nombre de lignes du rapport à partir duquel l'export passe en écriture seule.
+# 0 : toujours (aussi rapide dès 20 lignes, voir la commande ``benchmark_excel``).
+SEUIL_FLUX_PAR_DEFAUT = 0
+LARGEURS = {'A': 30, 'B': 25, 'C': 15, 'D': 12, 'E': 10, 'F': 15}
+ENTETES = ['Désignation', 'Caractéristiques', 'Prix Unitaire', 'Quantité', 'Unité', 'Total']
+
+_BORDURE = Border(left=Side(style='thin'), right=Side(style='thin'),
+                  top=Side(style='thin'), bottom=Side(style='thin'))
+_CENTRE = Alignment(horizontal='center', vertical='center')
+_DROITE = Alignment(horizontal='right', vertical='center')
+_VIOLET = PatternFill(start_color="667EEA", end_color="667EEA", fill_type="solid")
+
+# Fond des lignes selon leur type (sablage validé, sablage en cours, demande personnalisée)
+FONDS = {
+    'standard': None,
+    'sablage': PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid"),
+    'temporaire': PatternFill(start_color="FFFACD", end_color="FFFACD", fill_type="solid"),
+    'personnalise': PatternFill(start_color="D4EDDA", end_color="D4EDDA", fill_type="solid"),
+}
+# Colonnes d'une ligne : (police, alignement, format de nombre)
+COLONNES_LIGNE = {
+    'texte': (None, None, None),
+    'prix': (None, _DROITE, '#,##0.00'),
+    'quantite': (None, _DROITE, '#,##0.00'),
+    'quantite_sablage': (None, _DROITE, '#,##0.000'),
+    'total': (Font(bold=True), _DROITE, '#,##0.00'),
+}
+# Styles des six colonnes d'une ligne, par fond et format de quantité
+STYLES_LIGNE = {
+    (fond, quantite): (f'ligne_texte_{fond}', f'ligne_texte_{fond}', f'ligne_prix_{fond}',
+                       f'ligne_{quantite}_{fond}', f'ligne_texte_{fond}', f'ligne_total_{fond}')
+    for fond in FONDS for quantite in ('quantite', 'quantite_sablage')
+}
+
+
+def seuil_flux():
+    return getattr(settings, 'ESTIMATION_EXCEL_SEUIL_FLUX', SEUIL_FLUX_PAR_DEFAUT)
+
+
+def ecriture_seule(nb_lignes):
+    """Vrai si un rapport de ``nb_lignes`` lignes s'exporte en écriture seule."""
+    return nb_lignes >= seuil_flux()
+
+
+def _style(nom, font=None, fill=None, alignment=None, number_format=None, border=None):
+    style = NamedStyle(name=nom)
+    if font is not None:
+        style.font = font
+    if fill is not None:
+        style.fill = fill
+    if alignment is not None:
+        style.alignment = alignment
+    if number_format is not None:
+        style.number_format = number_format
+    if border is not None:
+        style.border = border
+    return style
+
+
+def styles_rapport():
+    """Styles nommés du rapport, à déclarer dans chaque classeur."""
+    styles = [
+        _style('rapport_entreprise', font=Font(bold=True, size=12, color="333333"), alignment=_CENTRE),
+        _style('rapport_adresse', font=Font(size=10), alignment=_CENTRE),
+        _style('rapport_titre', font=Font(bold=True, size=16, color="667EEA"), alignment=_CENTRE),
+        _style('rapport_gras', font=Font(bold=True)),
+        _style('rapport_categorie', font=Font(bold=True, size=14, color="333333"), alignment=_CENTRE),
+        _style('rapport_entete', font=Font(bold=True, color="FFFFFF"), fill=_VIOLET, alignment=_CENTRE,
+               border=_BORDURE),
+        _style('rapport_resume_libelle', font=Font(bold=True), alignment=_DROITE),
+        _style('rapport_resume_montant', font=Font(bold=True), alignment=_DROITE, number_format='#,##0.00 "CFA"'),
+        _style('rapport_ttc_libelle', font=Font(bold=True, color="FFFFFF"), fill=_VIOLET, alignment=_DROITE),
+        _style('rapport_ttc_montant', font=Font(bold=True, color="FFFFFF"), fill=_VIOLET, alignment=_DROITE,
+               number_format='#,##0.00 "CFA"'),
+        _style('rapport_note', font=Font(italic=True, size=10), alignment=_CENTRE),
+    ]
+    for fond, remplissage in FONDS.items():
+        for colonne, (police, alignement, format_nombre) in COLONNES_LIGNE.items():
+            styles.append(_style(f'ligne_{colonne}_{fond}', font=police, fill=remplissage, alignment=alignement,
+                                 number_format=format_nombre, border=_BORDURE))
+    return styles
+
+
+def _logo():
+    """Logo réduit à 150 px de haut, ou ``None``."""
+    logo_path = cache_exports.chemin_logo()
+    if not os.path.exists(logo_path):
+        return None
+    try:
+        with PILImage.open(logo_path) as pil_img:
+            if pil_img.height > 150:
+                ratio = 150 / pil_img.height
+                pil_img = pil_img.resize((int(pil_img.width * ratio), 150), PILImage.Resampling.LANCZOS)
+            img_buffer = BytesIO()
+            pil_img.save(img_buffer, format='PNG')
+        img_buffer.seek(0)
+        return ExcelImage(img_buffer)
+    except Exception as e:
+        logger.warning("Erreur lors du chargement du logo dans Excel : %s", e)
+        return None
+
+
+class _Feuille:
+    """Feuille en écriture seule : numérote les lignes écrites et fusionne les titres."""
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.ligne = 0
+        self._modeles = {}  # (colonne, style) -> cellule réutilisée
+
+    def cellule(self, valeur, style=None):
+        cellule = WriteOnlyCell(self.ws, value=valeur)
+        if style is not None:
+            cellule.style = style
+        return cellule
+
+    def ecrire(self, cellules=()):
+        self.ws.append(list(cellules))
+        self.ligne += 1
+
+    def ecrire_valeurs(self, valeurs, styles):
+        """Ligne de données : une cellule stylée par (colonne, style), réutilisée d'une ligne à l'autre.
+
+        ``append`` sérialise la ligne aussitôt (comme openpyxl le fait pour ses
+        cellules sans style) : le style n'est appliqué qu'une fois par modèle.
+        """
+        cellules = []
+        for colonne, (valeur, style) in enumerate(zip(valeurs, styles)):
+            modele = self._modeles.get((colonne, style))
+            if modele is None:
+                modele = self._modeles[(colonne, style)] = self.cellule(None, style)
+            modele.value = valeur
+            cellules.append(modele)
+        self.ecrire(cellules)
+
+    def titre(self, texte, style):
+        """Texte sur toute la largeur du tableau (cellules A:F fusionnées)."""
+        self.ecrire([self.cellule(texte, style)])
+        self.ws.merged_cells.add(f'A{self.ligne}:F{self.ligne}')
+
+    def montant(self, libelle, valeur, style_libelle, style_montant):
+        self.ecrire([None, None, None, self.cellule(libelle, style_libelle), None,
+                     self.cellule(float(valeur), style_montant)])
+
+
+def _valeurs_ligne(ligne, section):
+    """(désignation, caractéristiques, fond) d'une ligne, comme dans le classeur en mémoire."""
+    if ligne.type == TEMPORAIRE:
+        sablage_temp = section.sablage_temporaire
+        resume_text = ", ".join(f"{elem['nom_type_piece']} {elem['nom_dn']} ({elem['quantite']:g})"
+                                for elem in sablage_temp['elements'])
+        return ("Sablage Tuyauterie (Temporaire)",
+                f"Surface: {sablage_temp['surface_globale']:.3f} m² - {resume_text}", 'temporaire')
+    if ligne.est_sablage:
+        return DESIGNATION_SABLAGE, f"Surface: {ligne.quantite:.3f} m²", 'sablage'
+    if ligne.type == PERSONNALISE:
+        return f"{ligne.designation} (Personnalisé)", ligne.caracteristiques or '-', 'personnalise'
+    return ligne.designation, ligne.caracteristiques or '-', 'standard'
+
+
+def ecrire_excel_flux(projet, rapport, elements_sablage_temp, sortie, progression=None):
+    """Écrit le classeur du rapport en écriture seule dans ``sortie``.
+
+    ``rapport`` inclut déjà le sablage en cours (``avec_sablage_temporaire``) ;
+    ``progression(fait, total)`` est appelée à chaque ligne écrite.
+    """
+    financier = rapport.financier()
+    nb_lignes = sum(len(section.lignes) for section in rapport.sections)
+    date_texte = datetime.date.today().strftime('%d/%m/%Y')
+
+    wb = openpyxl.Workbook(write_only=True)
+    for style in styles_rapport():
+        wb.add_named_style(style)
+    ws = wb.create_sheet("Rapport d'Estimation")
+    # Dimensions et images : avant la première ligne écrite
+    for colonne, largeur in LARGEURS.items():
+        ws.column_dimensions[colonne].width = largeur
+    feuille = _Feuille(ws)
+
+    logo = _logo()
+    if logo is not None:
+        logo.anchor = 'A1'
+        ws.add_image(logo)
+        for i in range(1, 9):
+            ws.row_dimensions[i].height = 20
+        for _ in range(8):
+            feuille.ecrire()
+
+    # En-tête
+    feuille.titre("VOTRE ENTREPRISE", 'rapport_entreprise')
+    feuille.titre("Adresse de l'entreprise - Téléphone - Email", 'rapport_adresse')
+    feuille.ecrire()
+    feuille.titre(f"RAPPORT D'ESTIMATION - Projet: {projet.nom}", 'rapport_titre')
+    feuille.ecrire()
+    if projet.client:
+        feuille.ecrire([feuille.cellule(f"Client: {projet.client}", 'rapport_gras')])
+    feuille.ecrire([feuille.cellule(f"Date: {date_texte}", 'rapport_gras')])
+    feuille.ecrire()
+
+    # Données par catégorie
+    faites = 0
+    for section in rapport.sections:
+        feuille.titre(f"{section.nom} - Total: {section.total:,.2f} CFA", 'rapport_categorie')
+        feuille.ecrire([feuille.cellule(entete, 'rapport_entete') for entete in ENTETES])
+        for ligne in section.lignes:
+            designation, caracteristiques, fond = _valeurs_ligne(ligne, section)
+            quantite = 'quantite_sablage' if ligne.est_sablage else 'quantite'
+            feuille.ecrire_valeurs(
+                [designation, caracteristiques, float(ligne.prix_unitaire), float(ligne.quantite), ligne.unite,
+                 float(ligne.total)],
+                STYLES_LIGNE[fond, quantite])
+            faites += 1
+            if progression is not None:
+                progression(faites, nb_lignes)
+        feuille.ecrire()
+
+    # Résumé financier
+    feuille.ecrire()
+    feuille.titre("RÉSUMÉ FINANCIER", 'rapport_categorie')
+    feuille.montant("Sous-total HT:", financier['cout_total_ht'], 'rapport_resume_libelle', 'rapport_resume_montant')
+    feuille.montant(f"TVA ({financier['tva_taux']}%):", financier['tva_montant'],
+                    'rapport_resume_libelle', 'rapport_resume_montant')
+    feuille.montant("TOTAL TTC:", financier['cout_total_ttc'], 'rapport_ttc_libelle', 'rapport_ttc_montant')
+
+    if elements_sablage_temp:
+        for _ in range(2):
+            feuille.ecrire()
+        feuille.titre(f"Note: Ce rapport inclut {len(elements_sablage_temp)} élément(s) de sablage temporaire",
+                      'rapport_note')
+
+    feuille.ecrire()
+    feuille.titre(f"Rapport d'estimation généré pour le projet \"{projet.nom}\" le {date_texte}", 'rapport_note')
+
+    wb.save(sortie)
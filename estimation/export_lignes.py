@@ -0,0 +1,192 @@
+# estimation/export_lignes.py
+"""Export des lignes chiffrées (CSV, NDJSON) : rapport d'un projet et flux pour les outils décisionnels.
+
+Un seul format CSV pour toutes les lignes exportées : colonnes ``COLONNES_CSV``,
+séparateur ``;`` et UTF-8 avec BOM (ouverture directe dans Excel), écrit par
+``flux_csv``. L'export CSV du rapport (``views.ecrire_csv``) y passe les
+lignes du rapport (``lignes_du_rapport``), l'export en flux celles lues en
+base (``lignes``).
+
+``lignes`` donne une ligne par ligne d'estimation (éléments du catalogue et
+sablage enregistré), par session de sablage validée puis par demande
+approuvée et chiffrée, comme dans le rapport : prix unitaire et total
+calculés en SQL comme pour le résumé, arrondis au centime. Elles sont lues
+avec ``.iterator(chunk_size=...)`` sur des ``values_list`` (pas d'instances
+de modèle) et écrites par blocs dans une ``StreamingHttpResponse`` : la
+mémoire ne dépend pas du nombre de lignes. Les noms de catégorie,
+discipline et unité viennent du référentiel en mémoire, sans jointure.
+"""
+import csv
+import json
+
+from .calculs import au_centime, cout_demande_expression, cout_ligne_expression, prix_unitaire_expression
+from .models import DemandeElement, EstimationElement, SessionSablage
+from .rapport import DESIGNATION_SABLAGE, PERSONNALISE, SABLAGE, SESSION, STANDARD
+from .referentiel import referentiel
+
+TAILLE_MORCEAU = 2000  # lignes lues par aller-retour avec la base
+TAILLE_BLOC = 500  # lignes par morceau de réponse
+SEPARATEUR_CSV = ';'
+# Colonnes du CSV : (clé de la ligne, en-tête)
+COLONNES_CSV = [
+    ('projet', 'Projet'), ('client', 'Client'), ('categorie', 'Catégorie'), ('discipline', 'Discipline'),
+    ('type', 'Type'), ('designation', 'Désignation'), ('reference', 'Référence'),
+    ('caracteristiques', 'Caractéristiques'), ('prix_unitaire', 'Prix unitaire'), ('quantite', 'Quantité'),
+    ('unite', 'Unité'), ('total', 'Total'),
+]
+# Clés des objets NDJSON
+COLONNES = ['projet_id', *(cle for cle, _ in COLONNES_CSV)]
+
+
+def _surface(quantite):
+    return f"Surface : {quantite:.3f} m²"
+
+
+def lignes(projets, taille_morceau=TAILLE_MORCEAU):
+    """Lignes (dictionnaires ``COLONNES``) des projets du queryset ``projets``, projet par projet."""
+    ref = referentiel()
+    categorie_sablage = ref.categorie_main_oeuvre_tuyauterie()
+
+    def nom(objet):
+        return objet.nom if objet else ''
+
+    def libelle(unite_id, defaut=''):
+        unite = ref.unite(unite_id)
+        return unite.libelle if unite else defaut
+
+    estimations = (EstimationElement.objects
+                   .filter(projet__in=projets)
+                   .order_by('projet_id', 'pk')
+                   .annotate(prix=prix_unitaire_expression(), montant=cout_ligne_expression())
+                   .values_list('projet_id', 'projet__nom', 'projet__client__nom', 'element_id', 'element__numero',
+                                'element__designation', 'element__caracteristiques', 'element__categorie_id',
+                                'element__discipline_id', 'element__unite_id', 'demande_element_id',
+                                'demande_element__designation', 'demande_element__caracteristiques',
+                                'demande_element__unite_id', 'quantite', 'prix', 'montant'))
+    for (projet_id, projet, client, element_id, numero, designation, caracteristiques, categorie_id,
+         discipline_id, unite_id, demande_id, demande_designation, demande_caracteristiques, demande_unite_id,
+         quantite, prix, montant) in estimations.iterator(chunk_size=taille_morceau):
+        if demande_id is not None:
+            # Même priorité que EstimationElement.designation/caracteristiques/unite_display
+            designation, caracteristiques = demande_designation, demande_caracteristiques
+            unite_id = demande_unite_id or unite_id
+        sablage = element_id is None
+        yield {
+            'projet_id': projet_id, 'projet': projet, 'client': client or '',
+            'type': SABLAGE if sablage else STANDARD,
+            'reference': numero or '',
+            'designation': designation or (DESIGNATION_SABLAGE if sablage else ''),
+            'caracteristiques': caracteristiques or (_surface(quantite) if sablage else ''),
+            'categorie': nom(categorie_sablage) if sablage else nom(ref.categorie(categorie_id)),
+            'discipline': nom(ref.discipline(discipline_id)),
+            'unite': libelle(unite_id, 'm²' if sablage else 'Unité'),
+            'quantite': quantite, 'prix_unitaire': _centimes(prix), 'total': _centimes(montant),
+        }
+
+    sessions = (SessionSablage.objects
+                .filter(projet__in=projets, valide=True)
+                .order_by('projet_id', 'pk')
+                .values_list('projet_id', 'projet__nom', 'projet__client__nom', 'surface_globale',
+                             'prix_unitaire_m2', 'cout_total'))
+    for projet_id, projet, client, surface, prix, cout_total in sessions.iterator(chunk_size=taille_morceau):
+        yield {
+            'projet_id': projet_id, 'projet': projet, 'client': client or '',
+            'type': SESSION, 'reference': '', 'designation': DESIGNATION_SABLAGE,
+            'caracteristiques': _surface(surface), 'categorie': nom(categorie_sablage), 'discipline': '',
+            'unite': 'm²', 'quantite': surface, 'prix_unitaire': _centimes(prix), 'total': _centimes(cout_total),
+        }
+
+    demandes = (DemandeElement.objects
+                .filter(projet__in=projets, statut='approuve', prix_unitaire_admin__isnull=False)
+                .order_by('projet_id', 'pk')
+                .annotate(montant=cout_demande_expression())
+                .values_list('projet_id', 'projet__nom', 'projet__client__nom', 'designation', 'caracteristiques',
+                             'categorie_id', 'discipline_id', 'unite_id', 'quantite', 'prix_unitaire_admin',
+                             'montant'))
+    for (projet_id, projet, client, designation, caracteristiques, categorie_id, discipline_id, unite_id,
+         quantite, prix, montant) in demandes.iterator(chunk_size=taille_morceau):
+        yield {
+            'projet_id': projet_id, 'projet': projet, 'client': client or '',
+            'type': PERSONNALISE, 'reference': '', 'designation': designation,
+            'caracteristiques': caracteristiques or '',
+            'categorie': nom(ref.categorie(categorie_id)),
+            'discipline': nom(ref.discipline(discipline_id)),
+            'unite': libelle(unite_id, 'Unité'),
+            'quantite': quantite, 'prix_unitaire': _centimes(prix), 'total': _centimes(montant),
+        }
+
+
+def lignes_du_rapport(projet, rapport, progression=None):
+    """Lignes (dictionnaires ``COLONNES``) d'un rapport déjà construit, section par section.
+
+    ``progression(faites, total)`` est appelée après chaque ligne.
+    """
+    ref = referentiel()
+    client = projet.client.nom if projet.client_id else ''
+    total = sum(len(section.lignes) for section in rapport.sections)
+    faites = 0
+    for section in rapport.sections:
+        for ligne in section.lignes:
+            discipline = ref.discipline(ligne.discipline_id)
+            yield {
+                'projet_id': projet.pk, 'projet': projet.nom, 'client': client,
+                'type': ligne.type, 'reference': ligne.reference or '', 'designation': ligne.designation,
+                'caracteristiques': ligne.caracteristiques or '', 'categorie': section.nom,
+                'discipline': discipline.nom if discipline else '', 'unite': ligne.unite or '',
+                'quantite': ligne.quantite, 'prix_unitaire': _centimes(ligne.prix_unitaire),
+                'total': _centimes(ligne.total),
+            }
+            faites += 1
+            if progression is not None:
+                progression(faites, total)
+
+
+def _centimes(montant):
+    # Montants calculés en SQL : arrondis au centime, comme pour les sous-totaux
+    return None if montant is None else au_centime(montant)
+
+
+class _Tampon:
+    """Pseudo-fichier pour ``csv.writer`` : ``write`` renvoie la ligne au lieu de la stocker."""
+
+    def write(self, valeur):
+        return valeur
+
+
+def _par_blocs(textes, taille=TAILLE_BLOC):
+    """Regroupe les lignes de texte : un morceau de réponse par bloc plutôt que par ligne."""
+    bloc = []
+    for texte in textes:
+        bloc.append(texte)
+        if len(bloc) >= taille:
+            yield ''.join(bloc)
+            bloc = []
+    if bloc:
+        yield ''.join(bloc)
+
+
+def flux_csv(lignes):
+    """BOM et en-tête, puis une ligne CSV (``COLONNES_CSV``, séparateur ``;``) par ligne chiffrée."""
+    ecrivain = csv.writer(_Tampon(), delimiter=SEPARATEUR_CSV)
+    yield '\ufeff' + ecrivain.writerow([entete for _, entete in COLONNES_CSV])
+    yield from _par_blocs(ecrivain.writerow([ligne[cle] for cle, _ in COLONNES_CSV]) for ligne in lignes)
+
+
+def flux_ndjson(lignes):
+    """Un objet JSON par ligne ; montants et quantités en nombres."""
+    nombres = ('quantite', 'prix_unitaire', 'total')
+
+    def objet(ligne):
+        for colonne in nombres:
+            if ligne[colonne] is not None:
+                ligne[colonne] = float(ligne[colonne])
+        return json.dumps(ligne, ensure_ascii=False) + '\n'
+
+    yield from _par_blocs(objet(ligne) for ligne in lignes)
+
+
+# Format (extension du fichier) : (type MIME, flux)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', flux_csv),
+    'ndjson': ('application/x-ndjson; charset=utf-8', flux_ndjson),
+}
@@ -0,0 +1,38 @@
+# estimation/management/commands/benchmark_excel.py
+import json
+
+from django.core.management.base import BaseCommand
+
+from estimation import benchmark
+
+
+class Command(BaseCommand):
+    help = ("Compare l'export Excel en mémoire (classeur) et en écriture seule (flux) : "
+            "durée et pic de mémoire résidente, sur des rapports synthétiques, au format JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lignes', type=int, action='append',
+                            help='Nombre de lignes du rapport (répétable). Par défaut : 1000, 10000 et 100000.')
+        parser.add_argument('--mode', action='append', dest='modes', choices=benchmark.MODES_EXCEL,
+                            help='Mode mesuré (répétable). Par défaut : les deux.')
+        parser.add_argument('--repetitions', type=int, default=1)
+        parser.add_argument('--sortie', help='Écrit le rapport JSON dans ce fichier au lieu de la sortie standard.')
+
+    def handle(self, *args, **options):
+        rapport = benchmark.comparer_excel(options['lignes'] or benchmark.TAILLES_EXCEL,
+                                           options['modes'] or benchmark.MODES_EXCEL, options['repetitions'])
+
+        texte = json.dumps(rapport, indent=2, ensure_ascii=False)
+        if options['sortie']:
+            with open(options['sortie'], 'w', encoding='utf-8') as fichier:
+                fichier.write(texte + '\n')
+            self.stderr.write(self.style.SUCCESS(f"==> Rapport écrit dans {options['sortie']}"))
+        else:
+            self.stdout.write(texte)
+
+        for taille, modes in rapport['tailles'].items():
+            self.stderr.write(self.style.HTTP_INFO(f"==> {taille} lignes"))
+            for mode, mesure in modes.items():
+                self.stderr.write(f"   {mode:9} {mesure['duree_ms']:10.1f} ms   "
+                                  f"pic RSS {mesure['rss_pic_mo']:7.1f} Mo (export : +{mesure['rss_export_mo']:.1f} Mo)   "
+                                  f"{mesure['octets']} octets")
@@ -0,0 +1,61 @@
+# estimation/management/commands/benchmark_vues.py
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from estimation import benchmark
+from estimation.models import Projet
+
+
+class Command(BaseCommand):
+    help = ("Chronomètre les vues principales (sélection, rapport, exports, AJAX, calculer_totaux) : "
+            "temps, nombre de requêtes SQL et pic mémoire, au format JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projet', type=int, help='Id du projet mesuré. Par défaut : celui qui a le plus de lignes.')
+        parser.add_argument('--categorie', type=int,
+                            help="Id de la catégorie parcourue. Par défaut : celle qui a le plus d'éléments.")
+        parser.add_argument('--repetitions', type=int, default=benchmark.REPETITIONS)
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Scénario à jouer (répétable). Par défaut : tous.')
+        parser.add_argument('--sortie', help='Écrit le rapport JSON dans ce fichier au lieu de la sortie standard.')
+        parser.add_argument('--comparer', help="Rapport JSON d'une exécution précédente : affiche les écarts.")
+
+    def handle(self, *args, **options):
+        projet = None
+        if options['projet']:
+            projet = Projet.objects.filter(id=options['projet']).first()
+            if projet is None:
+                raise CommandError(f"Projet {options['projet']} introuvable.")
+        try:
+            rapport = benchmark.executer(projet, options['categorie'], options['repetitions'], options['scenarios'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        texte = json.dumps(rapport, indent=2, ensure_ascii=False)
+        if options['sortie']:
+            with open(options['sortie'], 'w', encoding='utf-8') as fichier:
+                fichier.write(texte + '\n')
+            self.stderr.write(self.style.SUCCESS(f"==> Rapport écrit dans {options['sortie']}"))
+        else:
+            self.stdout.write(texte)
+
+        if options['comparer']:
+            with open(options['comparer'], encoding='utf-8') as fichier:
+                self.comparer(json.load(fichier), rapport)
+
+    def comparer(self, avant, apres):
+        self.stderr.write(self.style.HTTP_INFO(f"==> Écarts par rapport au {avant.get('date', '?')}"))
+        for nom, mesure in apres['scenarios'].items():
+            ancienne = avant.get('scenarios', {}).get(nom)
+            if ancienne is None:
+                self.stderr.write(f"   {nom} : nouveau")
+                continue
+            t0, t1 = ancienne['duree_ms']['mediane'], mesure['duree_ms']['mediane']
+            ecart = (t1 - t0) / t0 * 100 if t0 else 0
+            style = self.style.ERROR if ecart > 10 else self.style.SUCCESS if ecart < -10 else str
+            self.stderr.write(style(
+                f"   {nom} : {t0:.1f} → {t1:.1f} ms ({ecart:+.0f} %), "
+                f"requêtes {ancienne['requetes']} → {mesure['requetes']}, "
+                f"mémoire {ancienne['memoire_pic_ko']:.0f} → {mesure['memoire_pic_ko']:.0f} Ko"
+            ))
@@ -0,0 +1,46 @@
+# estimation/management/commands/generer_donnees.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from estimation.donnees_synthetiques import generer, purger
+
+
+class Command(BaseCommand):
+    help = ("Génère un jeu de données synthétique reproductible (clients, projets, catalogue, lignes, "
+            "demandes, sessions de sablage) pour les mesures de performance.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--graine', type=int, default=42, help='Graine du générateur aléatoire.')
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--projets-par-client', type=int, default=3)
+        parser.add_argument('--elements', type=int, default=100_000, help="Taille du catalogue.")
+        parser.add_argument('--lignes', type=int, default=500, help="Lignes d'estimation par projet.")
+        parser.add_argument('--demandes', type=int, default=20, help='Demandes personnalisées par projet.')
+        parser.add_argument('--sessions', type=int, default=2, help='Sessions de sablage par projet.')
+        parser.add_argument('--purger', action='store_true',
+                            help='Supprime les données synthétiques existantes avant de générer.')
+        parser.add_argument('--purger-seulement', action='store_true',
+                            help='Supprime les données synthétiques sans rien générer.')
+
+    def handle(self, *args, **options):
+        if options['purger'] or options['purger_seulement']:
+            self.stdout.write(self.style.HTTP_INFO("==> Suppression des données synthétiques"))
+            self.stdout.write(self.style.SUCCESS(f"   ✔ {purger()} objet(s) supprimé(s)"))
+            if options['purger_seulement']:
+                return
+
+        self.stdout.write(self.style.HTTP_INFO(f"==> Génération (graine {options['graine']})"))
+        debut = time.perf_counter()
+        crees = generer(
+            graine=options['graine'],
+            clients=options['clients'],
+            projets_par_client=options['projets_par_client'],
+            elements=options['elements'],
+            lignes_par_projet=options['lignes'],
+            demandes_par_projet=options['demandes'],
+            sessions_par_projet=options['sessions'],
+        )
+        for modele, nombre in crees.items():
+            self.stdout.write(f"   {modele} : {nombre}")
+        self.stdout.write(self.style.SUCCESS(f"==> Terminé en {time.perf_counter() - debut:.1f} s"))
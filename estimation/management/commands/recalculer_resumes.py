@@ -0,0 +1,76 @@
+# estimation/management/commands/recalculer_resumes.py
+from django.core.management.base import BaseCommand, CommandError
+
+from estimation.calculs import TYPES_CATEGORIE, agreger_projet, calculer_scenario
+from estimation.models import EstimationSubtotal, EstimationSummary, Projet
+
+
+class Command(BaseCommand):
+    help = ("Vérifie les résumés maintenus de façon incrémentale contre le calcul complet "
+            "et reconstruit ceux qui divergent.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projet', type=int, action='append', dest='projets',
+                            help='Id de projet à traiter (répétable). Par défaut : tous.')
+        parser.add_argument('--verifier-seulement', action='store_true',
+                            help="N'écrit rien ; échoue si un résumé diverge.")
+        parser.add_argument('--tout-reconstruire', action='store_true',
+                            help='Reconstruit tous les résumés, même ceux qui sont justes.')
+
+    def handle(self, *args, **options):
+        projets = Projet.objects.order_by('id')
+        if options['projets']:
+            projets = projets.filter(id__in=options['projets'])
+        resumes = {s.projet_id: s for s in EstimationSummary.objects.filter(projet__in=projets)}
+
+        verifies = divergents = 0
+        for projet_id in projets.values_list('id', flat=True):
+            verifies += 1
+            attendu, sous_totaux = agreger_projet(projet_id)
+            summary = resumes.get(projet_id)
+            ecarts = self.ecarts(summary, attendu) + self.ecarts_sous_totaux(projet_id, sous_totaux)
+            if ecarts:
+                divergents += 1
+                self.stdout.write(self.style.WARNING(f"⚠ Projet {projet_id} : {', '.join(ecarts)}"))
+
+            if options['verifier_seulement']:
+                continue
+            if ecarts or options['tout_reconstruire']:
+                if summary is None:
+                    summary = EstimationSummary(projet_id=projet_id)
+                summary.calculer_totaux()
+
+        if options['verifier_seulement'] and divergents:
+            raise CommandError(f"{divergents} résumé(s) divergent(s) du calcul complet.")
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {verifies} résumé(s) vérifié(s), {divergents} divergent(s)"
+            + ("" if options['verifier_seulement'] else " reconstruit(s)")
+        ))
+
+    @staticmethod
+    def ecarts(summary, attendu):
+        if summary is None:
+            return ['résumé absent']
+        ecarts = []
+        for type_cat in TYPES_CATEGORIE:
+            stocke = getattr(summary, f'cout_total_{type_cat}')
+            if stocke != attendu[type_cat]:
+                ecarts.append(f"{type_cat} {stocke} ≠ {attendu[type_cat]}")
+        scenario = calculer_scenario(attendu, summary.tva_taux)
+        for champ, libelle in (('cout_total_ht', 'HT'), ('tva_montant', 'TVA'), ('cout_total_ttc', 'TTC')):
+            stocke = getattr(summary, champ)
+            if stocke != scenario[champ]:
+                ecarts.append(f"{libelle} {stocke} ≠ {scenario[champ]}")
+        return ecarts
+
+    @staticmethod
+    def ecarts_sous_totaux(projet_id, attendus):
+        stockes = {
+            (st.categorie_id, st.discipline_id): (st.nb_lignes, st.montant)
+            for st in EstimationSubtotal.objects.filter(projet_id=projet_id, nb_lignes__gt=0)
+        }
+        if stockes == attendus:
+            return []
+        cles = sorted(set(stockes) ^ set(attendus)
+                      | {cle for cle in stockes if cle in attendus and stockes[cle] != attendus[cle]})
+        return [f"sous-totaux (catégorie, discipline) {', '.join(map(str, cles))}"]
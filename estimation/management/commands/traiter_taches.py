@@ -0,0 +1,87 @@
+# estimation/management/commands/traiter_taches.py
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from estimation import processus
+from estimation.models import Tache
+from estimation.taches import TAILLE_LOT, executer_tache, reserver_tache
+
+
+class Command(BaseCommand):
+    help = "Worker : exécute les tâches de fond en attente (recalculs après changement de prix, exports, ...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--boucle', action='store_true',
+                            help="Tourne en continu au lieu de s'arrêter quand la file est vide.")
+        parser.add_argument('--intervalle', type=float, default=2.0,
+                            help='Secondes entre deux scrutations de la file (avec --boucle).')
+        parser.add_argument('--lot', type=int, default=TAILLE_LOT,
+                            help='Nombre de projets recalculés par transaction.')
+        parser.add_argument('--processus', type=int, default=1,
+                            help='Nombre de tâches exécutées en parallèle, chacune dans un processus du pool.')
+
+    def handle(self, *args, **options):
+        if options['processus'] > 1:
+            traitees = self._traiter_en_parallele(options)
+        else:
+            traitees = self._traiter(options)
+        self.stdout.write(self.style.SUCCESS(f"==> {traitees} tâche(s) traitée(s)"))
+
+    def _traiter(self, options):
+        traitees = 0
+        while True:
+            tache = reserver_tache()
+            if tache is None:
+                if not options['boucle']:
+                    break
+                time.sleep(options['intervalle'])
+                continue
+
+            self.stdout.write(self.style.HTTP_INFO(f"==> {tache}"))
+            tache = executer_tache(tache, taille_lot=options['lot'])
+            self._compte_rendu(tache.statut, tache.message)
+            traitees += 1
+        return traitees
+
+    def _traiter_en_parallele(self, options):
+        """Le parent réserve les tâches (la base reste la seule file) et les confie au pool."""
+        nombre = options['processus']
+        traitees = 0
+        en_cours = {}  # futur -> tâche
+        with ProcessPoolExecutor(max_workers=nombre, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=processus.initialiser,
+                                 initargs=(processus.configuration(),)) as pool:
+            while True:
+                while len(en_cours) < nombre:
+                    tache = reserver_tache()
+                    if tache is None:
+                        break
+                    self.stdout.write(self.style.HTTP_INFO(f"==> {tache}"))
+                    en_cours[pool.submit(processus.executer, tache.pk, options['lot'])] = tache
+
+                if not en_cours:
+                    if not options['boucle']:
+                        break
+                    time.sleep(options['intervalle'])
+                    continue
+
+                terminees, _ = wait(en_cours, timeout=options['intervalle'], return_when=FIRST_COMPLETED)
+                for futur in terminees:
+                    tache = en_cours.pop(futur)
+                    try:
+                        statut, message = futur.result()
+                    except Exception as e:  # processus du pool mort en cours de tâche
+                        statut, message = 'echec', f"{type(e).__name__}: {e}"
+                        Tache.objects.filter(pk=tache.pk).update(statut=statut, message=message,
+                                                                 date_fin=timezone.now())
+                    self._compte_rendu(statut, message)
+                    traitees += 1
+        return traitees
+
+    def _compte_rendu(self, statut, message):
+        style = self.style.SUCCESS if statut == 'termine' else self.style.ERROR
+        self.stdout.write(style(f"   {'✔' if statut == 'termine' else '✘'} {message}"))
@@ -16,4 +16,28 @@ class ClientMiddleware:
             request.client = None
 
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+
+class ProfilageMiddleware:
+    """Profilage à la demande (voir estimation/profilage.py).
+
+    À placer après ``AuthenticationMiddleware`` (l'en-tête ``X-Profilage``
+    n'est accepté que d'un membre du staff). Sans profilage, seul l'en-tête
+    et le réglage sont lus.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        from .profilage import mode_profilage, profiler
+
+        mode = mode_profilage(request)
+        if mode is None:
+            return self.get_response(request)
+
+        response, profil = profiler(request, self.get_response, mode)
+        response['Server-Timing'] = f'total;dur={profil.duree_ms}, db;dur={profil.duree_sql_ms}'
+        response['X-Profilage-Id'] = str(profil.id)
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0002_unite_remove_demandeelement_unite_personnalisee_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_tache', models.CharField(choices=[('recalcul_prix', 'Recalcul après changement de prix')], max_length=30)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminée'), ('echec', 'Échec')], default='en_attente', max_length=20)),
+                ('parametres', models.JSONField(blank=True, default=dict)),
+                ('progression', models.PositiveIntegerField(default=0)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Tâche de fond',
+                'verbose_name_plural': 'Tâches de fond',
+                'ordering': ['-date_creation'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0003_tache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estimationsummary',
+            name='version_calculee',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='projet',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def perimer_resumes(apps, schema_editor):
+    # Sous-totaux encore vides : les résumés existants seront recalculés
+    # (et leurs sous-totaux construits) à la prochaine lecture
+    apps.get_model('estimation', 'EstimationSummary').objects.update(version_calculee=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0004_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstimationSubtotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nb_lignes', models.IntegerField(default=0)),
+                ('montant', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('categorie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='estimation.categorie')),
+                ('discipline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='estimation.discipline')),
+                ('projet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sous_totaux', to='estimation.projet')),
+            ],
+            options={
+                'verbose_name': "Sous-total d'estimation",
+                'verbose_name_plural': "Sous-totaux d'estimation",
+                'constraints': [models.UniqueConstraint(fields=('projet', 'categorie', 'discipline'), name='sous_total_unique_par_projet')],
+            },
+        ),
+        migrations.RunPython(perimer_resumes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0005_sous_totaux'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estimationsummary',
+            name='recalcul_en_attente',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:20
+
+import django.db.models.deletion
+import estimation.recherche
+from django.db import migrations, models
+
+
+def installer_index(apps, schema_editor):
+    estimation.recherche.installer_index(schema_editor.connection)
+
+
+def supprimer_index(apps, schema_editor):
+    estimation.recherche.supprimer_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0006_recalcul_en_attente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElementRecherche',
+            fields=[
+                ('element', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='index_recherche', serialize=False, to='estimation.element')),
+                ('fts', estimation.recherche.ChampPleinTexte(db_column='estimation_element_fts')),
+            ],
+            options={
+                'db_table': 'estimation_element_fts',
+                'managed': False,
+            },
+        ),
+        # FTS5 + triggers sur SQLite, FULLTEXT sur MySQL (voir estimation/recherche.py)
+        migrations.RunPython(installer_index, supprimer_index),
+    ]
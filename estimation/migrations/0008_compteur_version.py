@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0007_recherche_plein_texte'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompteurVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=50, unique=True)),
+                ('valeur', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Compteur de version',
+                'verbose_name_plural': 'Compteurs de version',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0008_compteur_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='demandeelement',
+            index=models.Index(fields=['projet', 'categorie', '-date_demande'], name='demande_projet_cat_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='demandeelement',
+            index=models.Index(condition=models.Q(('prix_unitaire_admin__isnull', False)), fields=['projet', 'statut'], name='demande_projet_chiffree_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='element',
+            index=models.Index(condition=models.Q(('actif', True)), fields=['categorie', 'numero', 'designation'], name='element_actif_cat_ordre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='element',
+            index=models.Index(condition=models.Q(('actif', True)), fields=['categorie', 'discipline', 'numero', 'designation'], name='element_actif_cat_disc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='estimationelement',
+            index=models.Index(fields=['projet', 'element'], name='ligne_projet_element_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sessionsablage',
+            index=models.Index(condition=models.Q(('valide', True)), fields=['projet'], name='sablage_projet_valide_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0009_index_requetes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tache',
+            name='type_tache',
+            field=models.CharField(choices=[('recalcul_prix', 'Recalcul après changement de prix'), ('export', 'Export de rapport (PDF, Excel, CSV)')], max_length=30),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estimation', '0010_tache_export'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='demandeelement',
+            name='demande_projet_chiffree_idx',
+        ),
+        migrations.AddIndex(
+            model_name='demandeelement',
+            index=models.Index(fields=['projet', 'statut', 'prix_unitaire_admin'], name='demande_projet_statut_prix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='element',
+            index=models.Index(fields=['categorie', 'actif', 'numero', 'designation'], name='element_cat_actif_ordre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='element',
+            index=models.Index(fields=['categorie', 'discipline', 'actif', 'numero', 'designation'], name='element_cat_disc_actif_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sessionsablage',
+            index=models.Index(fields=['projet', 'valide'], name='sablage_projet_valide_cmp_idx'),
+        ),
+    ]
@@ -4,6 +4,8 @@ import json
 from django.db import models
 from django.http import JsonResponse
 
+from .recherche import ChampPleinTexte
+
 
 # -----------------------------
 # Clients / Projets / Référentiels
@@ -46,10 +48,21 @@ class Projet(models.Model):
     client_nom = models.CharField(max_length=200, blank=True)  # compatibilité
     date_creation = models.DateTimeField(auto_now_add=True)
     actif = models.BooleanField(default=True)
+    # Incrémentée à chaque modification du contenu (lignes, demandes, sablage, prix)
+    version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.nom
 
+    def cle_version(self):
+        """Clé de cache du contenu du projet : change dès que le contenu change."""
+        return f"projet-{self.pk}-v{self.version}"
+
+    @classmethod
+    def marquer_modifies(cls, projets):
+        """Incrémente la version des projets (ids ou queryset) en une requête."""
+        return cls.objects.filter(pk__in=projets).update(version=models.F('version') + 1)
+
     class Meta:
         verbose_name = "Projet"
         verbose_name_plural = "Projets"
@@ -108,6 +121,30 @@ class Unite(models.Model):
         return f"{self.libelle} ({self.code})" if self.code else self.libelle
 
 
+class CompteurVersion(models.Model):
+    """Compteur de version partagé entre processus (ex. ``referentiel`` : catégories,
+    disciplines, unités), incrémenté à chaque modification des données suivies."""
+    nom = models.CharField(max_length=50, unique=True)
+    valeur = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.nom} v{self.valeur}"
+
+    @classmethod
+    def lire(cls, nom):
+        return cls.objects.filter(nom=nom).values_list('valeur', flat=True).first() or 0
+
+    @classmethod
+    def incrementer(cls, nom):
+        if not cls.objects.filter(nom=nom).update(valeur=models.F('valeur') + 1):
+            cls.objects.get_or_create(nom=nom)
+            cls.objects.filter(nom=nom).update(valeur=models.F('valeur') + 1)
+
+    class Meta:
+        verbose_name = "Compteur de version"
+        verbose_name_plural = "Compteurs de version"
+
+
 # -----------------------------
 # Eléments & Demandes
 # -----------------------------
@@ -130,6 +167,33 @@ class Element(models.Model):
         verbose_name = "Élément"
         verbose_name_plural = "Éléments"
         ordering = ['numero', 'designation']
+        indexes = [
+            # Catalogue d'une catégorie (éventuellement d'une discipline), dans l'ordre
+            # d'affichage : pas de tri à part, pagination par curseur sur l'index.
+            # Index partiels : Django filtre sur la colonne seule (WHERE "actif"), ce
+            # qui empêche ``actif`` de servir de clé d'égalité dans un index composite.
+            models.Index(fields=['categorie', 'numero', 'designation'],
+                         condition=models.Q(actif=True), name='element_actif_cat_ordre_idx'),
+            models.Index(fields=['categorie', 'discipline', 'numero', 'designation'],
+                         condition=models.Q(actif=True), name='element_actif_cat_disc_idx'),
+            # MySQL n'a pas d'index partiels (condition ignorée) mais compare ``actif = 1`` :
+            # index composites complets
+            models.Index(fields=['categorie', 'actif', 'numero', 'designation'], name='element_cat_actif_ordre_idx'),
+            models.Index(fields=['categorie', 'discipline', 'actif', 'numero', 'designation'],
+                         name='element_cat_disc_actif_idx'),
+        ]
+
+
+class ElementRecherche(models.Model):
+    """Index plein texte FTS5 du catalogue (table virtuelle SQLite gérée par
+    recherche.py) : seulement joint par ``rechercher_elements``."""
+    element = models.OneToOneField(Element, on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_column='rowid', related_name='index_recherche')
+    fts = ChampPleinTexte(db_column='estimation_element_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'estimation_element_fts'
 
 
 class DemandeElement(models.Model):
@@ -169,6 +233,10 @@ class DemandeElement(models.Model):
     def est_integrable(self):
         return self.statut == 'approuve' and self.prix_unitaire_admin is not None
 
+    @property
+    def unite_display(self):
+        return self.unite.libelle if self.unite_id else "Unité"
+
     def __str__(self):
         return f"{self.designation} - {self.get_statut_display()}"
 
@@ -176,6 +244,13 @@ class DemandeElement(models.Model):
         verbose_name = "Demande d'élément"
         verbose_name_plural = "Demandes d'éléments"
         ordering = ['-date_demande']
+        indexes = [
+            # Demandes d'un projet dans une catégorie, plus récentes d'abord
+            models.Index(fields=['projet', 'categorie', '-date_demande'], name='demande_projet_cat_date_idx'),
+            # Demandes chiffrées (résumé, rapport) : index complet, utilisable par toutes les
+            # bases (préféré par SQLite à l'ancien index partiel sur prix_unitaire_admin IS NOT NULL)
+            models.Index(fields=['projet', 'statut', 'prix_unitaire_admin'], name='demande_projet_statut_prix_idx'),
+        ]
 
 
 class EstimationElement(models.Model):
@@ -230,6 +305,10 @@ class EstimationElement(models.Model):
     class Meta:
         verbose_name = "Élément d'estimation"
         verbose_name_plural = "Éléments d'estimation"
+        indexes = [
+            # Lignes d'un projet, par élément (sélection d'une catégorie, quantités)
+            models.Index(fields=['projet', 'element'], name='ligne_projet_element_idx'),
+        ]
 
 
 class EstimationSummary(models.Model):
@@ -243,66 +322,80 @@ class EstimationSummary(models.Model):
     tva_montant = models.DecimalField(max_digits=20, decimal_places=2, default=0)
     cout_total_ttc = models.DecimalField(max_digits=20, decimal_places=2, default=0)
     derniere_mise_a_jour = models.DateTimeField(auto_now=True)
+    # Version du projet à laquelle les totaux ont été calculés (None = jamais)
+    version_calculee = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    # Un recalcul a été demandé et pas encore fait (voir recalcul.recalculer_projet)
+    recalcul_en_attente = models.BooleanField(default=False, editable=False)
+
+    @classmethod
+    def obtenir_a_jour(cls, projet):
+        """Résumé du projet, recalculé seulement s'il est périmé : aucune écriture sinon."""
+        summary = cls.objects.filter(projet=projet).first() or cls(projet=projet)
+        if not summary.est_a_jour(projet):
+            summary.calculer_totaux()
+        return summary
+
+    def est_a_jour(self, projet=None):
+        projet = projet or self.projet
+        return self.pk is not None and self.version_calculee == projet.version
+
+    @property
+    def totaux(self):
+        """Montants par type de catégorie, tels qu'enregistrés."""
+        return {
+            'materiel': self.cout_total_materiel,
+            'main_oeuvre': self.cout_total_main_oeuvre,
+            'transport': self.cout_total_transport,
+            'etude': self.cout_total_etude,
+        }
+
+    def save(self, *args, **kwargs):
+        # Un changement de taux (admin, shell) périme la TVA et le TTC enregistrés,
+        # comme tout ce qui est mis en cache par version du projet : on avance la
+        # version et on recalcule
+        update_fields = kwargs.get('update_fields')
+        taux_modifie = (self.pk is not None
+                        and (update_fields is None or 'tva_taux' in update_fields)
+                        and EstimationSummary.objects.filter(pk=self.pk).exclude(tva_taux=self.tva_taux).exists())
+        super().save(*args, **kwargs)
+        if taux_modifie:
+            Projet.marquer_modifies([self.projet_id])
+            self.calculer_totaux()
+
+    def simuler(self, tva_taux=None, marge_taux=0, remise_taux=0):
+        """HT/TVA/TTC pour d'autres taux, à partir des totaux enregistrés : rien n'est modifié."""
+        from .calculs import calculer_scenario
+        return calculer_scenario(self.totaux, self.tva_taux if tva_taux is None else tva_taux,
+                                 marge_taux, remise_taux)
 
     def calculer_totaux(self):
         """Calcule les totaux en incluant les éléments standards et les demandes personnalisées approuvées"""
-        elements_standards = EstimationElement.objects.filter(projet=self.projet)
-        demandes_approuvees = DemandeElement.objects.filter(
-            projet=self.projet,
-            statut='approuve',
-            prix_unitaire_admin__isnull=False
-        )
-
-        self.cout_total_materiel = 0
-        self.cout_total_main_oeuvre = 0
-        self.cout_total_transport = 0
-        self.cout_total_etude = 0
-
-        for element in elements_standards:
-            if element.element and element.element.categorie:
-                type_cat = element.element.categorie.type_categorie
-                cout = element.cout_total
-                if type_cat == 'materiel':
-                    self.cout_total_materiel += cout
-                elif type_cat == 'main_oeuvre':
-                    self.cout_total_main_oeuvre += cout
-                elif type_cat == 'transport':
-                    self.cout_total_transport += cout
-                elif type_cat == 'etude':
-                    self.cout_total_etude += cout
-
-        for demande in demandes_approuvees:
-            if demande.categorie:
-                type_cat = demande.categorie.type_categorie
-                cout = demande.cout_total
-                if type_cat == 'materiel':
-                    self.cout_total_materiel += cout
-                elif type_cat == 'main_oeuvre':
-                    self.cout_total_main_oeuvre += cout
-                elif type_cat == 'transport':
-                    self.cout_total_transport += cout
-                elif type_cat == 'etude':
-                    self.cout_total_etude += cout
-
-        self.cout_total_ht = (
-            self.cout_total_materiel + self.cout_total_main_oeuvre +
-            self.cout_total_transport + self.cout_total_etude
-        )
-        self.tva_montant = self.cout_total_ht * (self.tva_taux / 100)
-        self.cout_total_ttc = self.cout_total_ht + self.tva_montant
-
-        # Sessions de sablage validées (considérées main d'œuvre)
-        sessions_sablage = SessionSablage.objects.filter(projet=self.projet, valide=True)
-        for session in sessions_sablage:
-            self.cout_total_main_oeuvre += session.cout_total
-
-        self.cout_total_ht = (
-            self.cout_total_materiel + self.cout_total_main_oeuvre +
-            self.cout_total_transport + self.cout_total_etude
-        )
-        self.tva_montant = self.cout_total_ht * (self.tva_taux / 100)
-        self.cout_total_ttc = self.cout_total_ht + self.tva_montant
-        self.save()
+        from .calculs import agreger_projet, reconstruire_sous_totaux
+
+        # Version lue AVANT les totaux : une modification concurrente rendra le résumé périmé
+        self.version_calculee = (Projet.objects
+                                 .filter(pk=self.projet_id)
+                                 .values_list('version', flat=True)
+                                 .first())
+        # Agrégations SQL groupées : nombre de requêtes constant quel que soit le nombre de lignes
+        totaux, sous_totaux = agreger_projet(self.projet_id)
+        self.cout_total_materiel = totaux['materiel']
+        self.cout_total_main_oeuvre = totaux['main_oeuvre']  # sessions de sablage validées incluses
+        self.cout_total_transport = totaux['transport']
+        self.cout_total_etude = totaux['etude']
+
+        scenario = self.simuler()
+        self.cout_total_ht = scenario['cout_total_ht']
+        self.tva_montant = scenario['tva_montant']
+        self.cout_total_ttc = scenario['cout_total_ttc']
+        if self.pk is None:
+            self.save()
+        else:
+            # Sans recalcul_en_attente : un déclenchement concurrent doit rester visible
+            self.save(update_fields=[*(f'cout_total_{type_cat}' for type_cat in self.totaux),
+                                     'cout_total_ht', 'tva_montant', 'cout_total_ttc',
+                                     'version_calculee', 'derniere_mise_a_jour'])
+        reconstruire_sous_totaux(self.projet_id, sous_totaux)
 
     def __str__(self):
         return f"Résumé - {self.projet.nom}"
@@ -312,6 +405,52 @@ class EstimationSummary(models.Model):
         verbose_name_plural = "Résumés d'estimation"
 
 
+class EstimationSubtotal(models.Model):
+    """Sous-total matérialisé par (projet, catégorie, discipline).
+
+    Maintenu avec le résumé (deltas des signaux, reconstruit par calculer_totaux).
+    Couvre les éléments standards et les demandes approuvées ; le sablage est
+    compté à part dans le résumé.
+    """
+    projet = models.ForeignKey(Projet, on_delete=models.CASCADE, related_name='sous_totaux')
+    categorie = models.ForeignKey(Categorie, on_delete=models.CASCADE)
+    discipline = models.ForeignKey(Discipline, on_delete=models.CASCADE)
+    nb_lignes = models.IntegerField(default=0)
+    montant = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    @classmethod
+    def par_categorie(cls, projet):
+        """``{categorie_id: {'nb_lignes', 'montant'}}`` en une lecture indexée."""
+        resultat = {}
+        for categorie_id, nb_lignes, montant in (cls.objects
+                                                 .filter(projet=projet, nb_lignes__gt=0)
+                                                 .values_list('categorie_id', 'nb_lignes', 'montant')):
+            total = resultat.setdefault(categorie_id, {'nb_lignes': 0, 'montant': 0})
+            total['nb_lignes'] += nb_lignes
+            total['montant'] += montant
+        return resultat
+
+    @classmethod
+    def par_discipline(cls, projet):
+        """Répartition par discipline (triée par montant décroissant)."""
+        return list(cls.objects
+                    .filter(projet=projet, nb_lignes__gt=0)
+                    .values('discipline__nom', 'discipline__couleur')
+                    .annotate(nb_lignes=models.Sum('nb_lignes'), montant=models.Sum('montant'))
+                    .order_by('-montant'))
+
+    def __str__(self):
+        return f"{self.projet} - {self.categorie} / {self.discipline}"
+
+    class Meta:
+        verbose_name = "Sous-total d'estimation"
+        verbose_name_plural = "Sous-totaux d'estimation"
+        constraints = [
+            models.UniqueConstraint(fields=['projet', 'categorie', 'discipline'],
+                                    name='sous_total_unique_par_projet'),
+        ]
+
+
 # -----------------------------
 # Sablage (optionnel)
 # -----------------------------
@@ -440,3 +579,50 @@ class SessionSablage(models.Model):
     class Meta:
         verbose_name = "Session de sablage"
         verbose_name_plural = "Sessions de sablage"
+        indexes = [
+            # Sessions validées d'un projet (résumé, rapport) : index partiel, plus index complet pour MySQL
+            models.Index(fields=['projet'], condition=models.Q(valide=True), name='sablage_projet_valide_idx'),
+            models.Index(fields=['projet', 'valide'], name='sablage_projet_valide_cmp_idx'),
+        ]
+
+
+# -----------------------------
+# Tâches de fond (file d'attente en base)
+# -----------------------------
+
+class Tache(models.Model):
+    """Tâche exécutée hors requête par la commande ``traiter_taches``"""
+    TYPES_CHOICES = [
+        ('recalcul_prix', 'Recalcul après changement de prix'),
+        ('export', 'Export de rapport (PDF, Excel, CSV)'),
+    ]
+    STATUT_CHOICES = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminée'),
+        ('echec', 'Échec'),
+    ]
+
+    type_tache = models.CharField(max_length=30, choices=TYPES_CHOICES)
+    statut = models.CharField(max_length=20, choices=STATUT_CHOICES, default='en_attente')
+    parametres = models.JSONField(default=dict, blank=True)
+    progression = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_debut = models.DateTimeField(null=True, blank=True)
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def pourcentage(self):
+        if self.statut == 'termine':
+            return 100
+        return int(100 * self.progression / self.total) if self.total else 0
+
+    def __str__(self):
+        return f"{self.get_type_tache_display()} #{self.pk} - {self.get_statut_display()}"
+
+    class Meta:
+        verbose_name = "Tâche de fond"
+        verbose_name_plural = "Tâches de fond"
+        ordering = ['-date_creation']
@@ -0,0 +1,195 @@
+# estimation/pagination.py
+"""Pagination par curseur (keyset) du catalogue.
+
+Au lieu d'un ``OFFSET`` (les lignes des pages précédentes sont parcourues puis
+jetées) et d'un ``COUNT(*)`` à chaque page, chaque page repart de la dernière
+ligne affichée :
+``WHERE (numero, designation, id) > (...) ORDER BY numero, designation, id LIMIT 21``.
+La page 500 coûte autant que la page 1.
+
+Le curseur passé dans l'URL est opaque et signé : clés de tri de la ligne
+frontière, sens, numéro de page et total. Le total n'est compté qu'à l'entrée
+dans la liste (et mis en cache) puis transporté par les curseurs : il peut
+être légèrement périmé si le catalogue change pendant la navigation.
+
+La génération du catalogue (clés des totaux, du rapport, des exports, index
+des suggestions) est le compteur ``CompteurVersion('catalogue')`` : la même
+dans tous les processus. Comme pour le référentiel, elle n'est relue qu'une
+fois toutes les ``ESTIMATION_CATALOGUE_VERIFICATION`` secondes (0 : à chaque
+accès) ; dans le processus qui a modifié le catalogue, immédiatement.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import CompteurVersion
+
+SEL_CURSEUR = 'estimation.pagination'
+DUREE_CACHE_TOTAL = 60
+COMPTEUR_CATALOGUE = 'catalogue'
+
+
+class PageCurseur:
+    """Page de résultats, même interface de base que ``django.core.paginator.Page``."""
+
+    def __init__(self, objets, numero, nb_total, par_page, suivant=None, precedent=None):
+        self.object_list = objets
+        self.number = numero
+        self.count = nb_total
+        self.num_pages = max(numero, math.ceil(nb_total / par_page) if nb_total else 1)
+        self.curseur_suivant = suivant
+        self.curseur_precedent = precedent
+        self.curseur_dernier = None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.curseur_suivant is not None
+
+    def has_previous(self):
+        return self.curseur_precedent is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def ordre_du_queryset(queryset):
+    """Champs de tri du queryset (ou ``Meta.ordering``), complétés par ``id`` pour un ordre total."""
+    ordre = [str(champ) for champ in (queryset.query.order_by or queryset.model._meta.ordering)]
+    if not any(champ.lstrip('-') in ('id', 'pk') for champ in ordre):
+        ordre.append('id')
+    return ordre
+
+
+def _inverser(ordre):
+    return [champ[1:] if champ.startswith('-') else f'-{champ}' for champ in ordre]
+
+
+def _apres(ordre, valeurs):
+    """Lignes strictement après ``valeurs`` dans ``ordre`` (comparaison de tuples)."""
+    condition = Q()
+    egalites = {}
+    for champ, valeur in zip(ordre, valeurs):
+        nom = champ.lstrip('-')
+        operateur = 'lt' if champ.startswith('-') else 'gt'
+        condition |= Q(**egalites, **{f'{nom}__{operateur}': valeur})
+        egalites[nom] = valeur
+    return condition
+
+
+def _empreinte(queryset):
+    sql, params = queryset.order_by().query.sql_with_params()
+    return hashlib.sha1(f'{sql}|{params!r}'.encode()).hexdigest()
+
+
+_generation = None  # (valeur, lue le)
+
+
+def _intervalle_verification():
+    return getattr(settings, 'ESTIMATION_CATALOGUE_VERIFICATION', 5)
+
+
+def generation_catalogue():
+    global _generation
+    generation, maintenant = _generation, time.monotonic()
+    if generation is not None and maintenant - generation[1] < _intervalle_verification():
+        return generation[0]
+    valeur = CompteurVersion.lire(COMPTEUR_CATALOGUE)
+    _generation = (valeur, maintenant)
+    return valeur
+
+
+def oublier_generation():
+    """Relit la génération en base au prochain accès."""
+    global _generation
+    _generation = None
+
+
+def invalider_catalogue():
+    """Nouvelle génération du catalogue : périme les totaux en cache et l'index des suggestions."""
+    # Valeur horodatée plutôt que +1 : une génération annulée (rollback) ne peut pas revenir
+    CompteurVersion.objects.update_or_create(nom=COMPTEUR_CATALOGUE, defaults={'valeur': time.time_ns()})
+    oublier_generation()
+
+
+def total_en_cache(queryset):
+    cle = f'estimation:total:{generation_catalogue()}:{_empreinte(queryset)}'
+    return cache.get_or_set(cle, lambda: queryset.order_by().count(), DUREE_CACHE_TOTAL)
+
+
+def _curseur(empreinte, sens, page, total, valeurs=None):
+    return signing.dumps({'q': empreinte[:12], 's': sens, 'p': page, 'n': total, 'v': valeurs},
+                         salt=SEL_CURSEUR, compress=True)
+
+
+def _lire_curseur(curseur, empreinte):
+    if not curseur:
+        return None
+    try:
+        donnees = signing.loads(curseur, salt=SEL_CURSEUR)
+    except signing.BadSignature:
+        return None
+    # Curseur d'une autre liste (filtres modifiés) : retour au début
+    return donnees if donnees.get('q') == empreinte[:12] else None
+
+
+def paginer_par_curseur(queryset, curseur=None, par_page=20):
+    """Page de ``queryset`` désignée par ``curseur`` (première page si absent ou invalide).
+
+    L'ordre du queryset doit porter sur des champs (ou annotations) dont les
+    valeurs sont sérialisables en JSON.
+    """
+    ordre = ordre_du_queryset(queryset)
+    empreinte = _empreinte(queryset)
+    donnees = _lire_curseur(curseur, empreinte)
+    if donnees is None:
+        donnees = {'s': 'debut', 'p': 1, 'n': total_en_cache(queryset), 'v': None}
+    sens, numero, total = donnees['s'], donnees['p'], donnees['n']
+
+    if sens in ('debut', 'apres'):
+        lignes = queryset.order_by(*ordre)
+        if sens == 'apres':
+            lignes = lignes.filter(_apres(ordre, donnees['v']))
+        objets = list(lignes[:par_page + 1])
+        encore = len(objets) > par_page
+        objets = objets[:par_page]
+        a_suivre, a_preceder = encore, sens == 'apres'
+    else:
+        # Pages parcourues à rebours : ordre inversé, puis remis à l'endroit
+        taille = par_page
+        if sens == 'fin':
+            numero = max(1, math.ceil(total / par_page))
+            taille = total - (numero - 1) * par_page or par_page
+        lignes = queryset.order_by(*_inverser(ordre))
+        if sens == 'avant':
+            lignes = lignes.filter(_apres(_inverser(ordre), donnees['v']))
+        objets = list(lignes[:taille + 1])
+        encore = len(objets) > taille
+        objets = objets[:taille][::-1]
+        a_suivre, a_preceder = sens == 'avant', encore
+        if not a_preceder:
+            numero = 1
+
+    def cles(objet):
+        return [getattr(objet, champ.lstrip('-')) for champ in ordre]
+
+    page = PageCurseur(objets, numero, total, par_page)
+    if objets and a_suivre:
+        page.curseur_suivant = _curseur(empreinte, 'apres', numero + 1, total, cles(objets[-1]))
+    if objets and a_preceder:
+        page.curseur_precedent = _curseur(empreinte, 'avant', numero - 1, total, cles(objets[0]))
+    if page.num_pages > numero:
+        page.curseur_dernier = _curseur(empreinte, 'fin', page.num_pages, total)
+    return page
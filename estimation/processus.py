@@ -0,0 +1,42 @@
+# estimation/processus.py
+"""Processus du pool de ``traiter_taches --processus N``.
+
+Les processus sont lancés en mode ``spawn`` : ils réimportent Django. Ce
+module n'importe donc aucun modèle au chargement ; ``initialiser`` reprend
+les réglages du parent qui ont pu changer à l'exécution (base de test,
+``MEDIA_ROOT``) avant ``django.setup()``.
+"""
+import os
+
+
+def configuration():
+    """Réglages du processus parent à reproduire dans le pool."""
+    from django.conf import settings
+
+    return {
+        'settings': os.environ.get('DJANGO_SETTINGS_MODULE'),
+        'bases': {alias: base['NAME'] for alias, base in settings.DATABASES.items()},
+        'media_root': str(settings.MEDIA_ROOT),
+    }
+
+
+def initialiser(config):
+    if config['settings']:
+        os.environ['DJANGO_SETTINGS_MODULE'] = config['settings']
+    from django.conf import settings
+
+    for alias, nom in config['bases'].items():
+        settings.DATABASES[alias]['NAME'] = nom
+    settings.MEDIA_ROOT = config['media_root']
+
+    import django
+    django.setup()
+
+
+def executer(tache_id, taille_lot):
+    """Exécute une tâche déjà réservée par le parent ; renvoie ``(statut, message)``."""
+    from .models import Tache
+    from .taches import executer_tache
+
+    tache = executer_tache(Tache.objects.get(pk=tache_id), taille_lot)
+    return tache.statut, tache.message
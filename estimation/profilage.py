@@ -0,0 +1,174 @@
+# estimation/profilage.py
+"""Profilage des requêtes HTTP, activé à la demande (``ProfilageMiddleware``).
+
+Pour une requête profilée on relève : nom de la vue, durée totale, temps
+passé en base, nombre de requêtes SQL et de doublons (même SQL, mêmes
+paramètres), taille de la réponse, et le détail des requêtes SQL. En option,
+la sortie de cProfile.
+
+Le profilage est actif :
+
+- pour toutes les requêtes si ``ESTIMATION_PROFILAGE = True`` ;
+- pour une requête d'un membre du staff qui envoie l'en-tête
+  ``X-Profilage: 1`` (``X-Profilage: cprofile`` pour ajouter cProfile).
+
+Seules les ``ESTIMATION_PROFILAGE_TAILLE`` requêtes les plus lentes sont
+gardées, en mémoire et par processus : voir la page admin ``/admin/profilage/``.
+"""
+import cProfile
+import heapq
+import io
+import itertools
+import pstats
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+EN_TETE = 'HTTP_X_PROFILAGE'
+TAILLE_PAR_DEFAUT = 50
+# Au-delà, les requêtes SQL sont comptées mais pas conservées
+MAX_REQUETES_CONSERVEES = 500
+NB_LIGNES_CPROFILE = 40
+
+
+def profilage_global():
+    return getattr(settings, 'ESTIMATION_PROFILAGE', False)
+
+
+def cprofile_global():
+    return getattr(settings, 'ESTIMATION_PROFILAGE_CPROFILE', False)
+
+
+class EnregistreurSql:
+    """Enveloppe d'exécution SQL (``connection.execute_wrapper``) : durée et texte de chaque requête."""
+
+    def __init__(self):
+        self.requetes = []  # (alias, sql, params, durée en ms)
+        self.nombre = 0
+        self.duree_ms = 0.0
+        self._vues = set()
+        self.doublons = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duree = (time.perf_counter() - debut) * 1000
+            self.nombre += 1
+            self.duree_ms += duree
+            cle = (sql, repr(params))
+            if cle in self._vues:
+                self.doublons += 1
+            else:
+                self._vues.add(cle)
+            if len(self.requetes) < MAX_REQUETES_CONSERVEES:
+                alias = context['connection'].alias
+                self.requetes.append((alias, sql, repr(params)[:500], round(duree, 3)))
+
+
+class Profil:
+    """Mesures d'une requête HTTP profilée."""
+
+    _compteur = itertools.count(1)
+
+    def __init__(self, request, reponse, duree_ms, sql, cprofile=None):
+        self.id = next(self._compteur)
+        self.date = timezone.now()
+        self.methode = request.method
+        self.chemin = request.get_full_path()[:500]
+        correspondance = getattr(request, 'resolver_match', None)
+        self.vue = correspondance.view_name if correspondance else ''
+        self.statut = reponse.status_code
+        # Réponse en flux : taille inconnue sans la consommer
+        self.taille = None if reponse.streaming else len(reponse.content)
+        self.duree_ms = round(duree_ms, 2)
+        self.duree_sql_ms = round(sql.duree_ms, 2)
+        self.nb_requetes = sql.nombre
+        self.nb_doublons = sql.doublons
+        self.requetes = sql.requetes
+        self.cprofile = cprofile
+
+    def __str__(self):
+        return f"{self.methode} {self.chemin} ({self.duree_ms} ms)"
+
+
+class JournalProfilage:
+    """Les ``taille`` profils les plus lents (tas borné, partagé entre threads)."""
+
+    def __init__(self, taille=None):
+        self._taille = taille
+        self._verrou = threading.Lock()
+        self._tas = []  # (durée, id, profil) : le plus rapide en tête
+
+    @property
+    def taille(self):
+        return self._taille or getattr(settings, 'ESTIMATION_PROFILAGE_TAILLE', TAILLE_PAR_DEFAUT)
+
+    def ajouter(self, profil):
+        entree = (profil.duree_ms, profil.id, profil)
+        with self._verrou:
+            if len(self._tas) < self.taille:
+                heapq.heappush(self._tas, entree)
+            elif entree > self._tas[0]:
+                heapq.heapreplace(self._tas, entree)
+            while len(self._tas) > self.taille:
+                heapq.heappop(self._tas)
+
+    def profils(self):
+        """Du plus lent au plus rapide."""
+        with self._verrou:
+            entrees = sorted(self._tas, reverse=True)
+        return [profil for _, _, profil in entrees]
+
+    def profil(self, profil_id):
+        return next((profil for profil in self.profils() if profil.id == profil_id), None)
+
+    def vider(self):
+        with self._verrou:
+            self._tas.clear()
+
+
+journal = JournalProfilage()
+
+
+def mode_profilage(request):
+    """``None`` (pas de profilage), ``'sql'`` ou ``'cprofile'``."""
+    demande = request.META.get(EN_TETE, '').strip().lower()
+    if demande and demande not in ('0', 'non', 'off'):
+        utilisateur = getattr(request, 'user', None)
+        if utilisateur is not None and utilisateur.is_active and utilisateur.is_staff:
+            return 'cprofile' if demande == 'cprofile' or cprofile_global() else 'sql'
+    if profilage_global():
+        return 'cprofile' if cprofile_global() else 'sql'
+    return None
+
+
+def profiler(request, get_response, mode):
+    """Exécute la requête en relevant ses mesures ; renvoie ``(réponse, profil)``."""
+    sql = EnregistreurSql()
+    profileur = cProfile.Profile() if mode == 'cprofile' else None
+    with ExitStack() as pile:
+        for connection in connections.all():
+            pile.enter_context(connection.execute_wrapper(sql))
+        debut = time.perf_counter()
+        if profileur is not None:
+            reponse = profileur.runcall(get_response, request)
+        else:
+            reponse = get_response(request)
+        duree_ms = (time.perf_counter() - debut) * 1000
+    profil = Profil(request, reponse, duree_ms, sql, _rapport_cprofile(profileur))
+    journal.ajouter(profil)
+    return reponse, profil
+
+
+def _rapport_cprofile(profileur):
+    if profileur is None:
+        return None
+    sortie = io.StringIO()
+    pstats.Stats(profileur, stream=sortie).sort_stats('cumulative').print_stats(NB_LIGNES_CPROFILE)
+    return sortie.getvalue()
@@ -0,0 +1,273 @@
+# estimation/rapport.py
+"""Modèle du rapport d'un projet, commun à la page HTML, au PDF et à l'Excel.
+
+``construire_rapport`` lit tout en un nombre fixe de requêtes (résumé, lignes,
+demandes approuvées, sessions de sablage validées) sous forme de lignes
+compactes (``values_list``, coûts calculés en SQL comme pour le résumé), puis
+les regroupe par catégorie. Les totaux des sections et la répartition par
+discipline viennent des sous-totaux maintenus (``EstimationSubtotal``) ; seul
+le sablage, hors sous-totaux, est additionné ligne à ligne. Le résultat ne
+dépend d'aucun format de sortie.
+
+``rapport_en_cache`` le garde dans le cache Django sous une clé qui change
+avec le contenu du projet (version), le catalogue (désignations, unités des
+éléments) et le référentiel (noms des catégories, unités, disciplines).
+
+Le sablage en cours (``request.session['elements_sablage']``) n'est pas en
+base : il est ajouté par requête, sur une copie (``avec_sablage_temporaire``).
+"""
+import copy
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from .calculs import (
+    ZERO, au_centime, calculer_scenario, cout_demande_expression, cout_ligne_expression,
+    prix_unitaire_expression,
+)
+from .models import (
+    Categorie, DemandeElement, EstimationElement, EstimationSubtotal, EstimationSummary, SessionSablage,
+)
+from .pagination import generation_catalogue
+from .referentiel import referentiel
+
+DUREE_CACHE_RAPPORT = 3600
+PRIX_SABLAGE_M2 = 5000
+NOM_CATEGORIE_SABLAGE = "Main d'œuvre Tuyauterie"
+DESIGNATION_SABLAGE = "Sablage Tuyauterie"
+
+# Types de ligne, dans l'ordre d'affichage d'une catégorie
+STANDARD = 'standard'
+SABLAGE = 'sablage'              # ligne d'estimation sans élément catalogue
+SESSION = 'session'              # session de sablage validée
+TEMPORAIRE = 'temporaire'        # sablage en cours (session de l'utilisateur)
+PERSONNALISE = 'personnalise'    # demande approuvée
+ORDRE_TYPES = (STANDARD, SABLAGE, SESSION, TEMPORAIRE, PERSONNALISE)
+TYPES_SABLAGE = (SABLAGE, SESSION, TEMPORAIRE)
+
+
+class Ligne:
+    """Une ligne du rapport, déjà chiffrée."""
+
+    __slots__ = ('type', 'designation', 'reference', 'caracteristiques', 'prix_unitaire',
+                 'quantite', 'unite', 'total', 'discipline_id')
+
+    def __init__(self, type, designation, caracteristiques, prix_unitaire, quantite, unite, total,
+                 reference='', discipline_id=None):
+        self.type = type
+        self.designation = designation
+        self.reference = reference
+        self.caracteristiques = caracteristiques
+        self.prix_unitaire = prix_unitaire
+        self.quantite = quantite
+        self.unite = unite
+        self.total = total
+        self.discipline_id = discipline_id
+
+    @property
+    def est_sablage(self):
+        return self.type in TYPES_SABLAGE
+
+
+class Section:
+    """Lignes d'une catégorie et leur total."""
+
+    __slots__ = ('categorie_id', 'nom', 'type_categorie', 'lignes', 'total', 'sablage_temporaire')
+
+    def __init__(self, categorie_id, nom, type_categorie):
+        self.categorie_id = categorie_id
+        self.nom = nom
+        self.type_categorie = type_categorie
+        self.lignes = []
+        self.total = ZERO
+        # Détail du sablage en cours (voir Rapport.avec_sablage_temporaire)
+        self.sablage_temporaire = None
+
+
+class Rapport:
+    """Rapport d'un projet : sections par catégorie, totaux du résumé, répartition par discipline."""
+
+    __slots__ = ('projet_id', 'version', 'sections', 'totaux', 'tva_taux', 'date_calcul',
+                 'repartition_disciplines')
+
+    def __init__(self, projet_id, version, sections, totaux, tva_taux, date_calcul, repartition_disciplines):
+        self.projet_id = projet_id
+        self.version = version
+        self.sections = sections
+        self.totaux = totaux
+        self.tva_taux = tva_taux
+        self.date_calcul = date_calcul
+        self.repartition_disciplines = repartition_disciplines
+
+    def lignes(self):
+        for section in self.sections:
+            yield from section.lignes
+
+    @property
+    def nb_lignes(self):
+        """Lignes enregistrées (hors sablage en cours)."""
+        return sum(1 for ligne in self.lignes() if ligne.type != TEMPORAIRE)
+
+    @property
+    def total_sablage(self):
+        return sum((ligne.total for ligne in self.lignes() if ligne.est_sablage), ZERO)
+
+    @property
+    def a_sablage(self):
+        return any(ligne.est_sablage for ligne in self.lignes())
+
+    def financier(self, tva_taux=None):
+        """HT/TVA/TTC (``calculer_scenario``), au taux du résumé par défaut."""
+        return calculer_scenario(self.totaux, self.tva_taux if tva_taux is None else tva_taux)
+
+    def avec_sablage_temporaire(self, elements, compter=True):
+        """Copie du rapport avec le sablage en cours ajouté à la catégorie de sablage.
+
+        ``compter`` : l'ajouter au total de la catégorie et à la main d'œuvre
+        (exports) ; sinon la ligne est seulement affichée (page du rapport).
+        Le rapport d'origine, éventuellement en cache, n'est pas modifié.
+        """
+        if not elements:
+            return self
+        surface = sum(element['surface_totale'] for element in elements)
+        prix_total = Decimal(str(surface * PRIX_SABLAGE_M2))
+        detail = ', '.join(f"{e['nom_type_piece']} {e['nom_dn']} ({e['quantite']:g})" for e in elements)
+
+        rapport = copy.copy(self)
+        rapport.sections = list(self.sections)
+        rapport.totaux = dict(self.totaux)
+        index, section = _section_sablage(rapport.sections)
+        section = copy.copy(section)
+        section.lignes = _inserer(section.lignes, Ligne(
+            TEMPORAIRE, DESIGNATION_SABLAGE, f"Surface : {surface:.3f} m² - {detail}",
+            Decimal(PRIX_SABLAGE_M2), surface, 'm²', prix_total))
+        section.sablage_temporaire = {
+            'elements': elements,
+            'surface_globale': surface,
+            'prix_unitaire': PRIX_SABLAGE_M2,
+            'prix_total': prix_total,
+            'nb_elements': len(elements),
+        }
+        if compter:
+            section.total += prix_total
+            rapport.totaux['main_oeuvre'] = rapport.totaux.get('main_oeuvre', ZERO) + prix_total
+        if index is None:
+            rapport.sections.append(section)
+        else:
+            rapport.sections[index] = section
+        return rapport
+
+
+def cle_cache(projet):
+    # Le taux de TVA du résumé est couvert par la version : EstimationSummary.save
+    # la fait avancer quand le taux change.
+    # La date de création distingue un projet d'un autre qui aurait repris son id
+    creation = projet.date_creation.timestamp() if projet.date_creation else 0
+    return (f'estimation:rapport:{projet.cle_version()}:{creation}'
+            f':{generation_catalogue()}:{referentiel().version}')
+
+
+def rapport_en_cache(projet):
+    """Rapport du projet, reconstruit seulement si son contenu a changé."""
+    cle = cle_cache(projet)
+    rapport = cache.get(cle)
+    if rapport is None:
+        rapport = construire_rapport(projet)
+        cache.set(cle, rapport, DUREE_CACHE_RAPPORT)
+    return rapport
+
+
+def construire_rapport(projet):
+    """Rapport du projet en 6 requêtes (plus le recalcul du résumé s'il est périmé)."""
+    ref = referentiel()
+    summary = EstimationSummary.obtenir_a_jour(projet)
+    sections = {}
+
+    def section(categorie_id):
+        if categorie_id not in sections:
+            # Catégorie créée dans un autre processus et pas encore dans le référentiel : lue en base
+            categorie = categorie_id and (ref.categorie(categorie_id)
+                                          or Categorie.objects.filter(pk=categorie_id).first())
+            sections[categorie_id] = (Section(categorie.pk, categorie.nom, categorie.type_categorie) if categorie
+                                      else Section(None, NOM_CATEGORIE_SABLAGE, 'main_oeuvre'))
+        return sections[categorie_id]
+
+    def libelle_unite(unite_id, defaut='Unité'):
+        unite = ref.unite(unite_id)
+        return unite.libelle if unite else defaut
+
+    lignes = (EstimationElement.objects
+              .filter(projet=projet)
+              .order_by('pk')
+              .annotate(prix=prix_unitaire_expression(), montant=cout_ligne_expression())
+              .values_list('element_id', 'element__numero', 'element__designation',
+                           'element__caracteristiques', 'element__unite_id', 'element__categorie_id',
+                           'element__discipline_id', 'demande_element_id', 'demande_element__designation',
+                           'demande_element__caracteristiques', 'demande_element__unite_id',
+                           'quantite', 'prix', 'montant'))
+    categorie_sablage = ref.categorie_main_oeuvre_tuyauterie()
+    categorie_sablage = categorie_sablage and categorie_sablage.pk
+    for (element_id, numero, designation, caracteristiques, unite_id, categorie_id, discipline_id,
+         demande_id, demande_designation, demande_caracteristiques, demande_unite_id,
+         quantite, prix, montant) in lignes:
+        if demande_id is not None:
+            # Même priorité que EstimationElement.designation/caracteristiques/unite_display
+            designation, caracteristiques = demande_designation, demande_caracteristiques
+            unite_id = demande_unite_id or unite_id
+        if element_id is None:
+            section(categorie_sablage).lignes.append(Ligne(
+                SABLAGE, designation or DESIGNATION_SABLAGE,
+                caracteristiques or f"Surface : {quantite:.3f} m²",
+                prix, quantite, libelle_unite(unite_id, 'm²'), montant))
+        else:
+            section(categorie_id).lignes.append(Ligne(
+                STANDARD, designation, caracteristiques, prix, quantite, libelle_unite(unite_id),
+                montant, reference=numero, discipline_id=discipline_id))
+
+    for surface, prix, cout_total in (SessionSablage.objects
+                                      .filter(projet=projet, valide=True)
+                                      .order_by('pk')
+                                      .values_list('surface_globale', 'prix_unitaire_m2', 'cout_total')):
+        section(categorie_sablage).lignes.append(Ligne(
+            SESSION, DESIGNATION_SABLAGE, f"Surface : {surface:.3f} m²", prix, surface, 'm²', cout_total))
+
+    demandes = (DemandeElement.objects
+                .filter(projet=projet, statut='approuve', prix_unitaire_admin__isnull=False)
+                .annotate(montant=cout_demande_expression())
+                .values_list('categorie_id', 'discipline_id', 'designation', 'caracteristiques',
+                             'unite_id', 'quantite', 'prix_unitaire_admin', 'montant'))
+    for categorie_id, discipline_id, designation, caracteristiques, unite_id, quantite, prix, montant in demandes:
+        section(categorie_id).lignes.append(Ligne(
+            PERSONNALISE, designation, caracteristiques, prix, quantite, libelle_unite(unite_id),
+            montant, discipline_id=discipline_id))
+
+    # Catégories dans l'ordre du référentiel, lignes dans l'ordre des types
+    rangs = {categorie.pk: rang for rang, categorie in enumerate(ref.categories)}
+    ordonnees = sorted(sections.values(), key=lambda s: (s.categorie_id is None, rangs.get(s.categorie_id, 0)))
+    sous_totaux = EstimationSubtotal.par_categorie(projet)
+    for s in ordonnees:
+        s.lignes.sort(key=lambda ligne: ORDRE_TYPES.index(ligne.type))
+        sablage = sum((au_centime(ligne.total) for ligne in s.lignes if ligne.est_sablage), ZERO)
+        s.total = sous_totaux.get(s.categorie_id, {}).get('montant', ZERO) + sablage
+
+    return Rapport(projet.pk, projet.version, ordonnees, summary.totaux, summary.tva_taux,
+                   summary.derniere_mise_a_jour, EstimationSubtotal.par_discipline(projet))
+
+
+def _section_sablage(sections):
+    """``(index, section)`` de la catégorie de sablage ; index ``None`` si elle est à créer."""
+    categorie = referentiel().categorie_main_oeuvre_tuyauterie()
+    categorie_id = categorie.pk if categorie else None
+    for index, s in enumerate(sections):
+        if s.categorie_id == categorie_id and (categorie_id is not None or s.nom == NOM_CATEGORIE_SABLAGE):
+            return index, s
+    if categorie is None:
+        return None, Section(None, NOM_CATEGORIE_SABLAGE, 'main_oeuvre')
+    return None, Section(categorie.pk, categorie.nom, categorie.type_categorie)
+
+
+def _inserer(lignes, nouvelle):
+    """Nouvelle liste avec ``nouvelle`` à sa place (ordre des types)."""
+    rang = ORDRE_TYPES.index(nouvelle.type)
+    position = next((i for i, ligne in enumerate(lignes) if ORDRE_TYPES.index(ligne.type) > rang), len(lignes))
+    return [*lignes[:position], nouvelle, *lignes[position:]]
@@ -0,0 +1,190 @@
+# estimation/recalcul.py
+"""Planification des recalculs de résumé d'estimation.
+
+Les signaux ne recalculent plus directement : ils marquent le projet comme
+« à recalculer ».
+
+- Dans un bloc ``recalculs_groupes()`` : les projets sont accumulés et recalculés
+  une seule fois à la sortie du bloc (ou pas du tout avec ``executer=False``).
+- Dans une transaction : un seul ``calculer_totaux`` par projet, exécuté dans
+  ``transaction.on_commit`` (rien n'est fait si la transaction est annulée).
+- Sinon (autocommit) : recalcul immédiat, comme avant.
+
+Le calcul lui-même est sérialisé par projet (``verrou_projet``) et les
+déclenchements concurrents sont fusionnés via ``recalcul_en_attente``.
+"""
+import threading
+from contextlib import ContextDecorator, contextmanager
+
+from django.db import DatabaseError, transaction
+
+_etat = threading.local()
+
+
+def recalculer_projet(projet_id):
+    """Recalcule (ou crée puis calcule) le résumé d'un projet existant.
+
+    Au plus un calcul à la fois par projet : le déclencheur lève le drapeau
+    ``recalcul_en_attente`` puis tente de prendre le verrou du projet sans
+    attendre. S'il est déjà pris, le détenteur refera un passage pour lui :
+    N déclenchements simultanés se réduisent à un ou deux calculs.
+    """
+    from .models import EstimationSummary, Projet
+
+    # Le contenu a changé : nouvelle version (0 ligne si le projet a été
+    # supprimé entre le marquage et le commit)
+    if not Projet.marquer_modifies([projet_id]):
+        return
+    resumes = EstimationSummary.objects.filter(projet_id=projet_id)
+    if not resumes.update(recalcul_en_attente=True):
+        _, cree = EstimationSummary.objects.get_or_create(projet_id=projet_id,
+                                                          defaults={'recalcul_en_attente': True})
+        if not cree:
+            resumes.update(recalcul_en_attente=True)
+
+    while True:
+        with verrou_projet(projet_id) as obtenu:
+            if not obtenu:
+                return
+            # Le drapeau est baissé AVANT le calcul : une demande arrivée
+            # pendant le calcul provoque un passage de plus
+            while resumes.filter(recalcul_en_attente=True).update(recalcul_en_attente=False):
+                resumes.get().calculer_totaux()
+        # Demande arrivée entre la dernière vérification et la libération du verrou
+        if not resumes.filter(recalcul_en_attente=True).exists():
+            return
+
+
+# -----------------------------
+# Verrou par projet
+# -----------------------------
+
+_verrous_locaux = {}
+_verrous_locaux_garde = threading.Lock()
+
+
+def _verrou_local(cle):
+    with _verrous_locaux_garde:
+        return _verrous_locaux.setdefault(cle, threading.Lock())
+
+
+@contextmanager
+def verrou_projet(projet_id):
+    """Verrou exclusif non bloquant sur le résumé d'un projet ; produit True si obtenu.
+
+    - Base avec ``SELECT ... FOR UPDATE NOWAIT`` (PostgreSQL, Oracle, MySQL 8) :
+      verrou de la ligne du résumé, tenu jusqu'à la fin de la transaction.
+    - SQLite (pas de verrou de ligne) : verrou du processus, les écritures
+      étant de toute façon sérialisées par la base.
+    """
+    from .models import EstimationSummary
+
+    connection = transaction.get_connection()
+    if connection.features.has_select_for_update_nowait:
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    list(EstimationSummary.objects
+                         .select_for_update(nowait=True)
+                         .filter(projet_id=projet_id)
+                         .values_list('pk', flat=True))
+            except DatabaseError:
+                obtenu = False
+            else:
+                obtenu = True
+            yield obtenu
+        return
+
+    verrou = _verrou_local((connection.alias, projet_id))
+    obtenu = verrou.acquire(blocking=False)
+    try:
+        yield obtenu
+    finally:
+        if obtenu:
+            verrou.release()
+
+
+def _lots():
+    if not hasattr(_etat, 'lots'):
+        _etat.lots = []
+    return _etat.lots
+
+
+def _executer_en_attente():
+    projets_ids, _etat.en_attente = _etat.en_attente, set()
+    _etat.callback = None
+    for projet_id in sorted(projets_ids):
+        recalculer_projet(projet_id)
+
+
+def _callback_enregistre(connection):
+    # Callback propre à la transaction : un callback déjà exécuté ne compte
+    # plus, même s'il reste dans la liste (cas de captureOnCommitCallbacks)
+    callback = getattr(_etat, 'callback', None)
+    return callback is not None and any(func is callback for _, func, _ in connection.run_on_commit)
+
+
+def _enregistrer_callback():
+    def executer():
+        _executer_en_attente()
+    _etat.en_attente = set()
+    _etat.callback = executer
+    transaction.on_commit(executer)
+
+
+def planifier_recalcul(projet_id):
+    """Marque un projet comme à recalculer (voir la docstring du module)."""
+    if not projet_id:
+        return
+
+    lots = _lots()
+    if lots:
+        lots[-1].add(projet_id)
+        return
+
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        recalculer_projet(projet_id)
+        return
+
+    # Un seul callback on_commit par transaction ; s'il a disparu (rollback),
+    # l'ensemble en attente est obsolète et on repart de zéro.
+    if not _callback_enregistre(connection):
+        _enregistrer_callback()
+    _etat.en_attente.add(projet_id)
+
+
+def est_groupe():
+    """Vrai si l'on est dans un bloc ``recalculs_groupes()``."""
+    return bool(_lots())
+
+
+class recalculs_groupes(ContextDecorator):
+    """Regroupe les recalculs déclenchés dans le bloc : un seul par projet.
+
+    Utilisable comme context manager (commandes de gestion, actions admin)
+    ou comme décorateur de vue. Avec ``executer=False`` les recalculs sont
+    simplement supprimés (ex. suppression d'un projet).
+
+        with recalculs_groupes():
+            for ligne in lignes:
+                ligne.save()
+    """
+
+    def __init__(self, executer=True):
+        self.executer = executer
+
+    def __enter__(self):
+        # L'ensemble vit dans la pile du thread : une même instance peut
+        # décorer une vue servie par plusieurs threads.
+        projets_ids = set()
+        _lots().append(projets_ids)
+        return projets_ids
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        projets_ids = _lots().pop()
+        if self.executer and exc_type is None:
+            for projet_id in sorted(projets_ids):
+                # Remonte au bloc englobant, à la transaction ou s'exécute
+                planifier_recalcul(projet_id)
+        return False
@@ -0,0 +1,200 @@
+# estimation/recherche.py
+"""Recherche plein texte dans le catalogue d'éléments.
+
+- SQLite : table virtuelle FTS5 ``estimation_element_fts`` (contenu externe :
+  ``estimation_element``) tenue à jour par triggers, insensible aux accents
+  (``remove_diacritics``), classement bm25.
+- MySQL : index FULLTEXT sur les mêmes colonnes, ``MATCH ... AGAINST`` en
+  mode booléen (l'insensibilité aux accents vient de la collation).
+- Autres bases : repli sur ``icontains``.
+
+Chaque mot saisi doit apparaître, comme préfixe, dans le numéro, la
+désignation ou les caractéristiques : « coude 90 inox DN50 ».
+"""
+import re
+
+from django.db import connections, models
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
+
+TABLE_ELEMENT = 'estimation_element'
+TABLE_FTS = 'estimation_element_fts'
+INDEX_FULLTEXT = 'estimation_element_fulltext'
+COLONNES = ('numero', 'designation', 'caracteristiques')
+# Poids bm25 par colonne (même ordre que COLONNES)
+POIDS = (4.0, 10.0, 1.0)
+
+_TRIGGERS_SQLITE = {
+    f'{TABLE_FTS}_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE_FTS}_ai AFTER INSERT ON {TABLE_ELEMENT} BEGIN
+            INSERT INTO {TABLE_FTS}(rowid, numero, designation, caracteristiques)
+            VALUES (new.id, new.numero, new.designation, new.caracteristiques);
+        END""",
+    f'{TABLE_FTS}_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE_FTS}_ad AFTER DELETE ON {TABLE_ELEMENT} BEGIN
+            INSERT INTO {TABLE_FTS}({TABLE_FTS}, rowid, numero, designation, caracteristiques)
+            VALUES ('delete', old.id, old.numero, old.designation, old.caracteristiques);
+        END""",
+    f'{TABLE_FTS}_au': f"""
+        CREATE TRIGGER IF NOT EXISTS {TABLE_FTS}_au
+        AFTER UPDATE OF numero, designation, caracteristiques ON {TABLE_ELEMENT} BEGIN
+            INSERT INTO {TABLE_FTS}({TABLE_FTS}, rowid, numero, designation, caracteristiques)
+            VALUES ('delete', old.id, old.numero, old.designation, old.caracteristiques);
+            INSERT INTO {TABLE_FTS}(rowid, numero, designation, caracteristiques)
+            VALUES (new.id, new.numero, new.designation, new.caracteristiques);
+        END""",
+}
+
+
+class ChampPleinTexte(models.TextField):
+    """Colonne cachée d'une table FTS5 (même nom que la table), cible de ``__match``."""
+
+
+@ChampPleinTexte.register_lookup
+class Correspond(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+def jetons(texte):
+    """Mots de la saisie, en minuscules (découpage proche du tokenizer unicode61)."""
+    return [mot for mot in re.split(r'[\W_]+', (texte or '').lower()) if mot]
+
+
+def rechercher_elements(queryset, texte):
+    """Filtre ``queryset`` (d'``Element``) sur ``texte`` et le trie par pertinence."""
+    mots = jetons(texte)
+    if not mots:
+        return queryset
+
+    connection = connections[queryset.db]
+    tri_secondaire = ('numero', 'designation', 'id')
+    if connection.vendor == 'sqlite':
+        requete = ' '.join(f'"{mot}"*' for mot in mots)
+        return (queryset
+                .filter(index_recherche__fts__match=requete)
+                .annotate(rang_recherche=RawSQL(f'bm25({TABLE_FTS}, %s, %s, %s)', POIDS))
+                .order_by('rang_recherche', *tri_secondaire))  # bm25 : plus petit = meilleur
+
+    if connection.vendor == 'mysql':
+        qn = connection.ops.quote_name
+        colonnes = ', '.join(f'{qn(TABLE_ELEMENT)}.{qn(colonne)}' for colonne in COLONNES)
+        requete = ' '.join(f'+{mot}*' for mot in mots)
+        return (queryset
+                .annotate(rang_recherche=RawSQL(f'MATCH ({colonnes}) AGAINST (%s IN BOOLEAN MODE)',
+                                                (requete,)))
+                .filter(rang_recherche__gt=0)
+                .order_by('-rang_recherche', *tri_secondaire))
+
+    condition = Q()
+    for mot in mots:
+        condition &= Q(numero__icontains=mot) | Q(designation__icontains=mot) | Q(caracteristiques__icontains=mot)
+    return queryset.filter(condition)
+
+
+def compter_facettes(queryset, categorie_id=None, discipline_id=None):
+    """Nombre de résultats par catégorie et par discipline, en une requête groupée.
+
+    Une seule requête compte les couples (catégorie, discipline) ; chaque axe
+    en est déduit en ignorant son propre filtre : choisir une catégorie ne
+    fait pas disparaître les autres de la liste.
+    Retourne ``{'categories': [...], 'disciplines': [...]}``, chaque entrée
+    ``{'id', 'nom', 'nb'}`` (+ ``couleur`` pour les disciplines), par nombre décroissant.
+    """
+    cellules = (queryset
+                .order_by()
+                .values('categorie_id', 'categorie__nom', 'discipline_id', 'discipline__nom', 'discipline__couleur')
+                .annotate(nb=Count('id')))
+    categories, disciplines = {}, {}
+    for cellule in cellules:
+        if discipline_id is None or cellule['discipline_id'] == discipline_id:
+            entree = categories.setdefault(cellule['categorie_id'], {
+                'id': cellule['categorie_id'], 'nom': cellule['categorie__nom'], 'nb': 0})
+            entree['nb'] += cellule['nb']
+        if categorie_id is None or cellule['categorie_id'] == categorie_id:
+            entree = disciplines.setdefault(cellule['discipline_id'], {
+                'id': cellule['discipline_id'], 'nom': cellule['discipline__nom'],
+                'couleur': cellule['discipline__couleur'], 'nb': 0})
+            entree['nb'] += cellule['nb']
+
+    def trier(entrees):
+        return sorted(entrees.values(), key=lambda entree: (-entree['nb'], entree['nom']))
+
+    return {'categories': trier(categories), 'disciplines': trier(disciplines)}
+
+
+def meilleurs_par_categorie(queryset, nb_par_categorie):
+    """Les ``nb_par_categorie`` premiers éléments (dans l'ordre du queryset) de chaque catégorie.
+
+    Deux requêtes : les couples ``(id, categorie_id)`` dans l'ordre, sans
+    charger les objets, puis les seuls éléments retenus. (bm25 n'est pas
+    utilisable dans une fonction de fenêtre ``ROW_NUMBER() OVER (...)``.)
+    Retourne ``{categorie_id: [element, ...]}``.
+    """
+    retenus = {}
+    for element_id, categorie_id in queryset.values_list('id', 'categorie_id').iterator(chunk_size=2000):
+        ids = retenus.setdefault(categorie_id, [])
+        if len(ids) < nb_par_categorie:
+            ids.append(element_id)
+    elements = queryset.in_bulk([element_id for ids in retenus.values() for element_id in ids])
+    return {categorie_id: [elements[element_id] for element_id in ids]
+            for categorie_id, ids in retenus.items()}
+
+
+# -----------------------------
+# Installation de l'index
+# -----------------------------
+
+def _triggers_sqlite_manquants(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = %s", [TABLE_ELEMENT])
+    existants = {nom for nom, in cursor.fetchall()}
+    return [nom for nom in _TRIGGERS_SQLITE if nom not in existants]
+
+
+def installer_index(connection):
+    """Crée l'index plein texte s'il manque (idempotent).
+
+    Sur SQLite, les triggers sont aussi recréés : une migration qui reconstruit
+    la table ``estimation_element`` les supprime. L'index est alors reconstruit.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            tables = connection.introspection.table_names(cursor)
+            manquants = _triggers_sqlite_manquants(cursor)
+            if TABLE_FTS in tables and not manquants:
+                return False
+            cursor.execute(f"""
+                CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE_FTS} USING fts5(
+                    numero, designation, caracteristiques,
+                    content='{TABLE_ELEMENT}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2'
+                )""")
+            for nom in manquants:
+                cursor.execute(_TRIGGERS_SQLITE[nom])
+            cursor.execute(f"INSERT INTO {TABLE_FTS}({TABLE_FTS}) VALUES ('rebuild')")
+            return True
+
+        if connection.vendor == 'mysql':
+            if INDEX_FULLTEXT in connection.introspection.get_constraints(cursor, TABLE_ELEMENT):
+                return False
+            qn = connection.ops.quote_name
+            cursor.execute(f"ALTER TABLE {qn(TABLE_ELEMENT)} ADD FULLTEXT INDEX {qn(INDEX_FULLTEXT)} "
+                           f"({', '.join(qn(colonne) for colonne in COLONNES)})")
+            return True
+    return False
+
+
+def supprimer_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for nom in _TRIGGERS_SQLITE:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {nom}')
+            cursor.execute(f'DROP TABLE IF EXISTS {TABLE_FTS}')
+        elif connection.vendor == 'mysql':
+            if INDEX_FULLTEXT in connection.introspection.get_constraints(cursor, TABLE_ELEMENT):
+                qn = connection.ops.quote_name
+                cursor.execute(f'ALTER TABLE {qn(TABLE_ELEMENT)} DROP INDEX {qn(INDEX_FULLTEXT)}')
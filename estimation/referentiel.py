@@ -0,0 +1,136 @@
+# estimation/referentiel.py
+"""Cache en mémoire des données de référence : catégories, disciplines, unités.
+
+Ces petites tables changent rarement mais sont lues à chaque page. Elles sont
+chargées une fois par processus (3 requêtes) dans un instantané, et relues
+quand le compteur ``CompteurVersion('referentiel')`` change. Ce compteur est
+incrémenté par les signaux de sauvegarde/suppression de ces modèles.
+
+La version en base n'est relue qu'une fois toutes les
+``ESTIMATION_REFERENTIEL_VERIFICATION`` secondes (0 : à chaque accès) : une
+modification faite dans un autre processus est visible au plus tard après ce
+délai ; dans le processus qui l'a faite, immédiatement.
+
+Les instances sont partagées entre requêtes : ne pas les modifier.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Categorie, CompteurVersion, Discipline, Unite
+
+COMPTEUR = 'referentiel'
+CODE_UNITE_PAR_DEFAUT = 'u'
+
+
+class Referentiel:
+    """Instantané des données de référence, avec accès par id, code ou type."""
+
+    def __init__(self, version, categories, disciplines, unites):
+        self.version = version
+        self.categories = list(categories)
+        self.disciplines = list(disciplines)
+        self.unites = list(unites)
+        self._categories = {categorie.pk: categorie for categorie in self.categories}
+        self._categories_par_code = {categorie.code: categorie for categorie in self.categories}
+        self._disciplines = {discipline.pk: discipline for discipline in self.disciplines}
+        self._disciplines_par_code = {discipline.code: discipline for discipline in self.disciplines}
+        self._unites = {unite.pk: unite for unite in self.unites}
+        self._unites_par_code = {unite.code: unite for unite in self.unites}
+
+    # --- catégories ---
+
+    def categorie(self, categorie_id):
+        return self._categories.get(_entier(categorie_id))
+
+    def categorie_par_code(self, code):
+        return self._categories_par_code.get(code)
+
+    def categories_de_type(self, type_categorie):
+        return [categorie for categorie in self.categories if categorie.type_categorie == type_categorie]
+
+    def categorie_de_type(self, type_categorie):
+        """Première catégorie (par id) du type, ou ``None``."""
+        return next(iter(self.categories_de_type(type_categorie)), None)
+
+    def categories_groupees(self):
+        """``{libellé du type: [catégories]}`` dans l'ordre des ids."""
+        groupes = {}
+        for categorie in self.categories:
+            groupes.setdefault(categorie.get_type_categorie_display(), []).append(categorie)
+        return groupes
+
+    def categorie_main_oeuvre_tuyauterie(self):
+        """Catégorie des lignes de sablage : main d'œuvre « tuyauterie », sinon la première main d'œuvre."""
+        for categorie in self.categories_de_type('main_oeuvre'):
+            if 'tuyauterie' in categorie.nom.lower():
+                return categorie
+        return self.categorie_de_type('main_oeuvre')
+
+    # --- disciplines ---
+
+    def discipline(self, discipline_id):
+        return self._disciplines.get(_entier(discipline_id))
+
+    def discipline_par_code(self, code):
+        return self._disciplines_par_code.get(code)
+
+    # --- unités ---
+
+    def unite(self, unite_id):
+        return self._unites.get(_entier(unite_id))
+
+    def unite_par_code(self, code, defaut=CODE_UNITE_PAR_DEFAUT):
+        """Unité de code ``code``, sinon celle de code ``defaut`` (``None`` si aucune)."""
+        return self._unites_par_code.get(code) or self._unites_par_code.get(defaut)
+
+
+def _entier(valeur):
+    try:
+        return int(valeur)
+    except (TypeError, ValueError):
+        return None
+
+
+_verrou = threading.Lock()
+_instantane = None
+_verifie_le = None
+
+
+def _intervalle_verification():
+    return getattr(settings, 'ESTIMATION_REFERENTIEL_VERIFICATION', 5)
+
+
+def referentiel():
+    """Instantané courant des données de référence (rechargé si la version a changé)."""
+    global _instantane, _verifie_le
+    instantane, verifie_le = _instantane, _verifie_le
+    maintenant = time.monotonic()
+    if instantane is not None and maintenant - verifie_le < _intervalle_verification():
+        return instantane
+
+    with _verrou:
+        version = CompteurVersion.lire(COMPTEUR)
+        if _instantane is None or _instantane.version != version:
+            _instantane = Referentiel(version, Categorie.objects.order_by('pk'),
+                                      Discipline.objects.order_by('pk'), Unite.objects.all())
+        _verifie_le = maintenant
+        return _instantane
+
+
+def _oublier():
+    global _instantane
+    _instantane = None
+
+
+def invalider_referentiel():
+    """Oublie l'instantané local et fait changer la version pour les autres processus.
+
+    Oublié aussi au commit : un rechargement fait entre-temps par un autre
+    thread a pu lire les données d'avant la modification.
+    """
+    _oublier()
+    CompteurVersion.incrementer(COMPTEUR)
+    transaction.on_commit(_oublier)
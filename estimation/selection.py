@@ -0,0 +1,100 @@
+# estimation/selection.py
+"""Synchronisation de la sélection d'éléments standards d'une catégorie.
+
+Au lieu de tout supprimer puis recréer ligne par ligne, on compare la
+sélection soumise aux lignes existantes et on applique la différence en
+opérations groupées : le nombre de requêtes ne dépend pas de la taille de
+la sélection, et le résumé n'est recalculé qu'une fois.
+"""
+from django.db import transaction
+
+from .calculs import au_centime
+from .models import Element, EstimationElement
+from .recalcul import planifier_recalcul, recalculer_projet, recalculs_groupes
+
+
+def synchroniser_selection(projet, categorie, paires):
+    """Aligne les lignes du projet pour ``categorie`` sur ``paires``.
+
+    ``paires`` : ``(element_id, quantite)`` ; pour un élément répété, la
+    dernière quantité l'emporte. Les lignes conservées gardent leurs autres
+    champs (prix fixe, date d'ajout).
+    Lève ``Element.DoesNotExist`` si un élément n'appartient pas à la catégorie.
+    Retourne ``(nb_ajoutes, nb_modifies, nb_supprimes)``.
+    """
+    voulues = {}
+    for element_id, quantite in paires:
+        voulues[int(element_id)] = quantite
+
+    elements = Element.objects.filter(categorie=categorie).in_bulk(list(voulues))
+    if len(elements) != len(voulues):
+        raise Element.DoesNotExist(
+            f"Élément(s) absent(s) de la catégorie : {sorted(set(voulues) - set(elements))}")
+
+    with transaction.atomic():
+        # Les signaux de suppression ne font que marquer le projet : il est
+        # recalculé une seule fois ci-dessous, au commit
+        with recalculs_groupes(executer=False):
+            existantes = {}
+            a_supprimer = []
+            for ligne in (EstimationElement.objects
+                          .filter(projet=projet, element__categorie=categorie)
+                          .order_by('id')):
+                if ligne.element_id in voulues and ligne.element_id not in existantes:
+                    existantes[ligne.element_id] = ligne
+                else:
+                    a_supprimer.append(ligne.pk)  # désélectionnée ou doublon
+
+            a_modifier = []
+            for element_id, ligne in existantes.items():
+                if ligne.quantite != voulues[element_id]:
+                    ligne.quantite = voulues[element_id]
+                    a_modifier.append(ligne)
+
+            a_creer = [EstimationElement(projet=projet, element=elements[element_id], quantite=quantite)
+                       for element_id, quantite in voulues.items() if element_id not in existantes]
+
+            EstimationElement.objects.bulk_create(a_creer)
+            EstimationElement.objects.bulk_update(a_modifier, ['quantite'])
+            if a_supprimer:
+                EstimationElement.objects.filter(pk__in=a_supprimer).delete()
+
+        if a_creer or a_modifier or a_supprimer:
+            planifier_recalcul(projet.id)
+
+    return len(a_creer), len(a_modifier), len(a_supprimer)
+
+
+def mettre_a_jour_quantites(projet, changements):
+    """Applique plusieurs ``(element_id, quantite)`` en une transaction.
+
+    Un ``bulk_update`` pour toutes les lignes puis un seul recalcul du résumé.
+    Les quantités doivent déjà être validées (``Decimal`` au centime).
+    Retourne ``({element_id: nouveau_total_ligne}, [element_id inconnus])``.
+    """
+    quantites = {}
+    for element_id, quantite in changements:
+        quantites[int(element_id)] = quantite
+
+    lignes = list(EstimationElement.objects
+                  .filter(projet=projet, element_id__in=list(quantites))
+                  .select_related('element', 'demande_element')
+                  .order_by('id'))
+    totaux = {}
+    a_modifier = []
+    for ligne in lignes:
+        if ligne.element_id in totaux:
+            continue  # doublon éventuel : seule la première ligne est éditable
+        if ligne.quantite != quantites[ligne.element_id]:
+            ligne.quantite = quantites[ligne.element_id]
+            a_modifier.append(ligne)
+        totaux[ligne.element_id] = au_centime(ligne.cout_total)
+
+    if a_modifier:
+        # Recalcul dans la transaction (et non au commit) : la réponse peut
+        # renvoyer le résumé à jour même si la requête est elle-même atomique
+        with transaction.atomic():
+            EstimationElement.objects.bulk_update(a_modifier, ['quantite'])
+            recalculer_projet(projet.id)
+
+    return totaux, sorted(set(quantites) - set(totaux))
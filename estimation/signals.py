@@ -1,52 +1,140 @@
 # estimation/signals.py
-from decimal import Decimal
-from django.db.models.signals import post_save, post_delete
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate, post_save, post_delete, pre_save, pre_delete
 from django.dispatch import receiver
 
-from .models import EstimationSummary, DemandeElement, EstimationElement, Element
+from .calculs import appliquer_deltas, contribution
+from .models import (
+    Categorie, DemandeElement, Discipline, EstimationElement, Element, Projet, SessionSablage, Unite,
+)
+from .pagination import invalider_catalogue
+from .recalcul import est_groupe, planifier_recalcul
+from .recherche import TABLE_ELEMENT, installer_index
+from .referentiel import invalider_referentiel
+from .taches import enfiler_recalcul_prix, taches_asynchrones
+from .trigrammes import index_catalogue
 
+# Modèles dont chaque ligne contribue à un compartiment du résumé
+MODELES_LIGNES = (EstimationElement, DemandeElement, SessionSablage)
+# Données de référence mises en cache par referentiel.py
+MODELES_REFERENTIEL = (Categorie, Discipline, Unite)
 
-def _recalc_summary_for_project(projet):
-    if not projet:
+
+def _recalc_summary_for_project(projet_id):
+    # Regroupé par transaction / bloc recalculs_groupes() (voir recalcul.py)
+    planifier_recalcul(projet_id)
+
+
+# === Maintenance incrémentale du résumé ===
+# Avant l'écriture on lit la contribution actuelle de la ligne, après on lit la
+# nouvelle et on applique la différence au compartiment : O(1) par modification.
+# Dans un bloc recalculs_groupes() on se contente de marquer le projet.
+
+def _contribution_avant(sender, instance, **kwargs):
+    if est_groupe():
         return
-    summary, _ = EstimationSummary.objects.get_or_create(projet=projet)
-    summary.calculer_totaux()
+    instance._contribution_avant = contribution(sender, instance.pk)
 
 
-# === Demandes personnalisées (validation, prix, quantité, suppression) ===
-@receiver(post_save, sender=DemandeElement)
-def demandeelement_saved(sender, instance: DemandeElement, **kwargs):
-    # Quel que soit le statut, on recalcule : le template filtre ce qui est approuvé.
-    _recalc_summary_for_project(instance.projet)
+def _appliquer(avant, apres, *projets_ids):
+    if est_groupe():
+        for projet_id in projets_ids:
+            _recalc_summary_for_project(projet_id)
+        return
+    for projet_id in appliquer_deltas(avant, apres, projets_ids):
+        # Pas encore de résumé : calcul complet (qui le crée)
+        _recalc_summary_for_project(projet_id)
 
 
-@receiver(post_delete, sender=DemandeElement)
-def demandeelement_deleted(sender, instance: DemandeElement, **kwargs):
-    _recalc_summary_for_project(instance.projet)
+def ligne_saved(sender, instance, **kwargs):
+    avant = getattr(instance, '_contribution_avant', None)
+    apres = None if est_groupe() else contribution(sender, instance.pk)
+    _appliquer(avant, apres, instance.projet_id, avant and avant[0])
 
 
-# === Éléments standards sélectionnés (quantité, ajout, suppression) ===
-@receiver(post_save, sender=EstimationElement)
-def estimationelement_saved(sender, instance: EstimationElement, **kwargs):
-    _recalc_summary_for_project(instance.projet)
+def ligne_deleted(sender, instance, **kwargs):
+    avant = getattr(instance, '_contribution_avant', None)
+    _appliquer(avant, None, instance.projet_id)
 
 
-@receiver(post_delete, sender=EstimationElement)
-def estimationelement_deleted(sender, instance: EstimationElement, **kwargs):
-    _recalc_summary_for_project(instance.projet)
+for _model in MODELES_LIGNES:
+    pre_save.connect(_contribution_avant, sender=_model, dispatch_uid=f'avant_save_{_model.__name__}')
+    pre_delete.connect(_contribution_avant, sender=_model, dispatch_uid=f'avant_delete_{_model.__name__}')
+    post_save.connect(ligne_saved, sender=_model, dispatch_uid=f'save_{_model.__name__}')
+    post_delete.connect(ligne_deleted, sender=_model, dispatch_uid=f'delete_{_model.__name__}')
+
+
+# === Prix admin d'une demande référencée par des lignes d'estimation ===
+@receiver(post_save, sender=DemandeElement)
+def demandeelement_saved(sender, instance: DemandeElement, created=False, **kwargs):
+    # Le prix admin sert de prix aux EstimationElement qui pointent vers la demande
+    if not created and EstimationElement.objects.filter(demande_element=instance).exists():
+        _recalc_summary_for_project(instance.projet_id)
+
+
+# === Changement de prix, de catégorie ou de discipline d’un Element standard ===
+# Si un prix unitaire d'Element change, tous les projets qui l'utilisent doivent être recalculés.
+# Le recalcul part en tâche de fond (commande traiter_taches) pour ne pas bloquer l'admin.
+@receiver(pre_save, sender=Element)
+def element_avant_save(sender, instance: Element, **kwargs):
+    instance._tarif_avant = (Element.objects
+                             .filter(pk=instance.pk)
+                             .values_list('prix_unitaire', 'categorie_id', 'discipline_id')
+                             .first()) if instance.pk else None
 
 
-# === Changement de prix ou de catégorie d’un Element standard ===
-# Si un prix unitaire d'Element change, tous les projets qui l'utilisent doivent être recalculés
 @receiver(post_save, sender=Element)
-def element_saved(sender, instance: Element, **kwargs):
-    projets_ids = (EstimationElement.objects
-                   .filter(element=instance)
-                   .values_list('projet_id', flat=True)
-                   .distinct())
-    for pid in projets_ids:
-        try:
-            summary = EstimationSummary.objects.get(projet_id=pid)
-        except EstimationSummary.DoesNotExist:
-            continue
-        summary.calculer_totaux()
+def element_saved(sender, instance: Element, created=False, **kwargs):
+    tarif_avant = getattr(instance, '_tarif_avant', None)
+    if created or tarif_avant == (instance.prix_unitaire, instance.categorie_id, instance.discipline_id):
+        return  # nouvel élément (aucune ligne) ou prix/catégorie/discipline inchangés
+
+    lignes = EstimationElement.objects.filter(element=instance)
+    if taches_asynchrones():
+        # Les résumés deviennent périmés tout de suite ; les rapports les
+        # recalculeront à la demande si le worker n'est pas encore passé.
+        if Projet.marquer_modifies(lignes.values('projet_id')):
+            enfiler_recalcul_prix(instance.pk)
+        return
+
+    for pid in lignes.values_list('projet_id', flat=True).distinct():
+        _recalc_summary_for_project(pid)
+
+
+# === Index de trigrammes (recherche approximative), totaux paginés et suggestions ===
+# Appliqué au commit : une sauvegarde annulée ne doit pas entrer dans l'index.
+@receiver(post_save, sender=Element, dispatch_uid='trigrammes_save')
+def element_reindexe(sender, instance: Element, **kwargs):
+    transaction.on_commit(lambda: index_catalogue.mettre_a_jour(instance))
+    transaction.on_commit(invalider_catalogue)
+
+
+@receiver(post_delete, sender=Element, dispatch_uid='trigrammes_delete')
+def element_desindexe(sender, instance: Element, **kwargs):
+    element_id = instance.pk
+    transaction.on_commit(lambda: index_catalogue.retirer(element_id))
+    transaction.on_commit(invalider_catalogue)
+
+
+# === Cache des données de référence (catégories, disciplines, unités) ===
+def _referentiel_modifie(sender, **kwargs):
+    invalider_referentiel()
+
+
+for _model in MODELES_REFERENTIEL:
+    post_save.connect(_referentiel_modifie, sender=_model, dispatch_uid=f'referentiel_save_{_model.__name__}')
+    post_delete.connect(_referentiel_modifie, sender=_model, dispatch_uid=f'referentiel_delete_{_model.__name__}')
+
+
+# === Index plein texte du catalogue ===
+# Sur SQLite, une migration qui reconstruit la table des éléments supprime les
+# triggers de l'index FTS5 : on les recrée (et on réindexe) après chaque migrate.
+@receiver(post_migrate, dispatch_uid='index_recherche')
+def verifier_index_recherche(sender, using='default', plan=None, **kwargs):
+    if sender.name != 'estimation':
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if TABLE_ELEMENT not in connection.introspection.table_names(cursor):
+            return  # migré vers zéro
+    installer_index(connection)
@@ -0,0 +1,111 @@
+# estimation/suggestions.py
+"""Autocomplétion du catalogue : index de préfixes trié, en mémoire.
+
+Pour chaque catégorie, liste triée des mots (normalisés : minuscules, sans
+accents) du numéro et de la désignation des éléments actifs, avec l'id de
+l'élément. Compléter un préfixe revient à une bisection puis à parcourir la
+plage ``[prefixe, prefixe + '\\uffff')`` : aucune requête SQL.
+
+L'index est reconstruit (au plus une fois, à la requête suivante) dès que la
+génération du catalogue change : elle est avancée en base par les signaux de
+sauvegarde/suppression d'``Element``, donc vue par tous les processus (voir
+``pagination.generation_catalogue``). Il l'est aussi au bout de
+``DUREE_VIE`` secondes, comme l'index de trigrammes, pour les opérations
+groupées sans signaux.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from .pagination import generation_catalogue
+from .trigrammes import DUREE_VIE, normaliser
+
+NB_SUGGESTIONS = 10
+# Partition regroupant toutes les catégories
+TOUTES = None
+
+
+class IndexPrefixes:
+
+    def __init__(self, charger=None, duree_vie=DUREE_VIE):
+        self._charger = charger or _charger_elements
+        self.duree_vie = duree_vie
+        self._verrou = threading.Lock()
+        self._partitions = {}  # categorie_id | TOUTES -> (mots triés, array('I') d'ids)
+        self._elements = {}    # id -> (numero, designation, discipline_id, mots)
+        self._generation = None
+        self._construit_le = None
+
+    def construire(self, generation=None):
+        entrees = {TOUTES: []}
+        elements = {}
+        for element_id, numero, designation, categorie_id, discipline_id in self._charger():
+            mots = tuple(dict.fromkeys(normaliser(f'{numero} {designation}').split()))
+            elements[element_id] = (numero, designation, discipline_id, mots)
+            partition = entrees.setdefault(categorie_id, [])
+            for mot in mots:
+                partition.append((mot, element_id))
+                entrees[TOUTES].append((mot, element_id))
+        partitions = {}
+        for categorie_id, paires in entrees.items():
+            paires.sort()
+            partitions[categorie_id] = ([mot for mot, _ in paires], array('I', (i for _, i in paires)))
+        self._partitions, self._elements = partitions, elements
+        self._generation = generation
+        self._construit_le = time.monotonic()
+
+    def _perime(self, generation):
+        return (self._generation != generation or self._construit_le is None
+                or time.monotonic() - self._construit_le > self.duree_vie)
+
+    def _assurer_a_jour(self):
+        generation = generation_catalogue()
+        if self._perime(generation):
+            with self._verrou:
+                if self._perime(generation):
+                    self.construire(generation)
+
+    def completer(self, texte, categorie_id=TOUTES, discipline_id=None, limite=NB_SUGGESTIONS):
+        """``[(id, numero, designation)]`` dont chaque mot saisi préfixe un mot du numéro ou de la désignation."""
+        prefixes = normaliser(texte).split()
+        if not prefixes:
+            return []
+        self._assurer_a_jour()
+        partition = self._partitions.get(categorie_id)
+        if partition is None:
+            return []
+        mots, ids = partition
+        elements = self._elements
+
+        # Le préfixe le plus sélectif mène le parcours, les autres sont vérifiés par élément
+        plages = [(bisect_left(mots, prefixe), bisect_left(mots, prefixe + '\uffff'), prefixe)
+                  for prefixe in prefixes]
+        debut, fin, meneur = min(plages, key=lambda plage: plage[1] - plage[0])
+        autres = [prefixe for prefixe in prefixes if prefixe != meneur]
+
+        resultats, vus = [], set()
+        for position in range(debut, fin):
+            element_id = ids[position]
+            if element_id in vus:
+                continue
+            vus.add(element_id)
+            numero, designation, discipline, mots_element = elements[element_id]
+            if discipline_id is not None and discipline != discipline_id:
+                continue
+            if all(any(mot.startswith(prefixe) for mot in mots_element) for prefixe in autres):
+                resultats.append((element_id, numero, designation))
+                if len(resultats) >= limite:
+                    break
+        return resultats
+
+
+def _charger_elements():
+    from .models import Element
+    return (Element.objects
+            .filter(actif=True)
+            .values_list('id', 'numero', 'designation', 'categorie_id', 'discipline_id')
+            .iterator(chunk_size=5000))
+
+
+index_prefixes = IndexPrefixes()
@@ -0,0 +1,175 @@
+# estimation/taches.py
+"""File d'attente de tâches de fond stockée en base (modèle ``Tache``).
+
+Une requête (ou un signal) enfile une tâche ; la commande ``traiter_taches``
+les réserve une par une et les exécute par lots en mettant à jour la
+progression, visible dans l'admin.
+
+Une tâche restée ``en_cours`` au-delà de ``ESTIMATION_TACHES_DUREE_MAX``
+minutes (worker arrêté ou tué en cours de route) est considérée comme
+abandonnée : elle passe en échec à la réservation suivante et n'est plus
+réutilisée par un export identique.
+
+Exports (PDF, Excel, CSV) : la tâche rend le document dans le cache des
+exports (``cache_exports``) ; la page suit la progression puis télécharge
+le fichier. La base reste la seule file : pas de courtier de messages.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EstimationElement, Tache
+from .recalcul import recalculer_projet
+
+TAILLE_LOT = 50
+# Écart minimal entre deux enregistrements de la progression d'un export
+INTERVALLE_PROGRESSION = 0.5
+
+
+def taches_asynchrones():
+    return getattr(settings, 'ESTIMATION_TACHES_ASYNCHRONES', True)
+
+
+def limite_abandon():
+    """Date de début avant laquelle une tâche encore en cours est abandonnée."""
+    minutes = getattr(settings, 'ESTIMATION_TACHES_DUREE_MAX', 30)
+    return timezone.now() - datetime.timedelta(minutes=minutes)
+
+
+def liberer_taches_abandonnees():
+    """Passe en échec les tâches en cours depuis trop longtemps ; retourne leur nombre."""
+    return Tache.objects.filter(statut='en_cours', date_debut__lt=limite_abandon()).update(
+        statut='echec', message='Abandonnée : worker interrompu (durée maximale dépassée)',
+        date_fin=timezone.now())
+
+
+def enfiler_recalcul_prix(element_id):
+    """Enfile le recalcul des projets qui utilisent l'élément.
+
+    Les changements de prix successifs sont fusionnés dans la même tâche tant
+    qu'elle n'a pas démarré : les projets communs ne seront recalculés qu'une fois.
+    """
+    with transaction.atomic():
+        tache = (Tache.objects
+                 .select_for_update()
+                 .filter(type_tache='recalcul_prix', statut='en_attente')
+                 .order_by('date_creation')
+                 .first())
+        if tache is None:
+            return Tache.objects.create(type_tache='recalcul_prix',
+                                        parametres={'elements': [element_id]})
+        elements = tache.parametres.setdefault('elements', [])
+        if element_id not in elements:
+            elements.append(element_id)
+            tache.save(update_fields=['parametres'])
+        return tache
+
+
+def _recalcul_prix(tache, taille_lot):
+    projets_ids = list(EstimationElement.objects
+                       .filter(element_id__in=tache.parametres.get('elements', []))
+                       .order_by('projet_id')
+                       .values_list('projet_id', flat=True)
+                       .distinct())
+    tache.total = len(projets_ids)
+    tache.save(update_fields=['total'])
+
+    for debut in range(0, len(projets_ids), taille_lot):
+        lot = projets_ids[debut:debut + taille_lot]
+        with transaction.atomic():
+            for projet_id in lot:
+                recalculer_projet(projet_id)
+        tache.progression = debut + len(lot)
+        tache.save(update_fields=['progression'])
+    return f"{len(projets_ids)} projet(s) recalculé(s)"
+
+
+def enfiler_export(projet, format, elements_sablage=()):
+    """Enfile l'export ``format`` du projet.
+
+    Document déjà en cache : la tâche est créée terminée. Export identique
+    (même empreinte) en attente ou en cours (et pas abandonné) : cette
+    tâche est renvoyée.
+    """
+    from . import cache_exports
+
+    cle = cache_exports.empreinte(projet, format, elements_sablage)
+    parametres = {'projet_id': projet.pk, 'format': format,
+                  'elements_sablage': list(elements_sablage or ()), 'cle': cle}
+    if cache_exports.chemin(cle, format).exists():
+        maintenant = timezone.now()
+        return Tache.objects.create(type_tache='export', statut='termine', parametres=parametres,
+                                    date_debut=maintenant, date_fin=maintenant, message='Déjà en cache')
+    with transaction.atomic():
+        tache = (Tache.objects
+                 .select_for_update()
+                 .filter(type_tache='export', statut__in=('en_attente', 'en_cours'), parametres__cle=cle)
+                 .exclude(statut='en_cours', date_debut__lt=limite_abandon())
+                 .first())
+        return tache or Tache.objects.create(type_tache='export', parametres=parametres)
+
+
+def _export(tache, taille_lot):
+    from . import cache_exports
+    from .models import Projet
+    from .views import ECRIVAINS
+
+    parametres = tache.parametres
+    format, elements_sablage = parametres['format'], parametres.get('elements_sablage', [])
+    projet = Projet.objects.get(pk=parametres['projet_id'])
+    dernier_enregistrement = 0.0
+
+    def progression(fait, total):
+        nonlocal dernier_enregistrement
+        maintenant = time.monotonic()
+        if fait < total and maintenant - dernier_enregistrement < INTERVALLE_PROGRESSION:
+            return
+        dernier_enregistrement = maintenant
+        tache.progression, tache.total = min(fait, total), total
+        tache.save(update_fields=['progression', 'total'])
+
+    # Clé calculée à la mise en file : c'est sous elle qu'une demande identique
+    # cherche le document (enfiler_export) et que la page le télécharge
+    fichier = cache_exports.obtenir(
+        parametres['cle'], format, lambda sortie: ECRIVAINS[format](projet, elements_sablage, sortie, progression))
+    return f"{format} : {fichier.stat().st_size} octets"
+
+
+EXECUTANTS = {
+    'recalcul_prix': _recalcul_prix,
+    'export': _export,
+}
+
+
+def reserver_tache(tache_id=None):
+    """Réserve la plus ancienne tâche en attente, ou la tâche ``tache_id`` (sûr avec plusieurs workers).
+
+    Les tâches abandonnées par un worker interrompu sont d'abord passées en échec.
+    """
+    liberer_taches_abandonnees()
+    candidates = Tache.objects.filter(statut='en_attente')
+    if tache_id is not None:
+        candidates = candidates.filter(pk=tache_id)
+    for tache_id in (candidates
+                     .order_by('date_creation')
+                     .values_list('id', flat=True)[:10]):
+        # UPDATE conditionnel : un seul worker peut passer la tâche en cours
+        if Tache.objects.filter(pk=tache_id, statut='en_attente').update(
+                statut='en_cours', date_debut=timezone.now()):
+            return Tache.objects.get(pk=tache_id)
+    return None
+
+
+def executer_tache(tache, taille_lot=TAILLE_LOT):
+    try:
+        message = EXECUTANTS[tache.type_tache](tache, taille_lot)
+    except Exception as e:
+        tache.statut, tache.message = 'echec', f"{type(e).__name__}: {e}"
+    else:
+        tache.statut, tache.message = 'termine', message or ''
+    tache.date_fin = timezone.now()
+    tache.save(update_fields=['statut', 'message', 'date_fin'])
+    return tache
@@ -1,3 +1,2007 @@
-from django.test import TestCase
+from collections import Counter
+from decimal import Decimal, ROUND_HALF_UP
+from io import BytesIO, StringIO
+import datetime
+from pathlib import Path
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+from threading import Barrier, Thread
+import time
+import tracemalloc
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from unittest import skipUnless
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import (
+    CalculSablage, Categorie, Client, CompteurVersion, DemandeElement, Discipline, Element, EstimationElement,
+    EstimationSubtotal, EstimationSummary, Projet, SessionSablage, Tache, Unite,
+)
+from .benchmark import scenarios as scenarios_benchmark
+from .benchmark import rapport_synthetique
+from .donnees_synthetiques import generer, purger
+from .export_excel import ecrire_excel_flux
+from . import export_lignes
+from .pagination import generation_catalogue, invalider_catalogue, oublier_generation, paginer_par_curseur
+from .profilage import EnregistreurSql, JournalProfilage, journal
+from . import cache_exports
+from .rapport import cle_cache as cle_cache_rapport, construire_rapport, rapport_en_cache
+from .recalcul import recalculer_projet, recalculs_groupes
+from .referentiel import referentiel
+from .suggestions import index_prefixes
+from .taches import enfiler_export, executer_tache, reserver_tache
+from .recherche import compter_facettes, installer_index, meilleurs_par_categorie, rechercher_elements
+from .trigrammes import IndexTrigrammes, index_catalogue, trigrammes
+from .urls import urlpatterns
+from .views import ecrire_excel_classeur, ecrire_pdf
+
+
+def creer_referentiel():
+    """Référentiel minimal : une catégorie par type, une discipline, une unité."""
+    unite = Unite.objects.create(code='u', libelle='Unité', symbole='u')
+    discipline = Discipline.objects.create(nom='Tuyauterie', code='TUY')
+    categories = {
+        type_cat: Categorie.objects.create(nom=f'Catégorie {type_cat}', type_categorie=type_cat,
+                                           code=type_cat.upper())
+        for type_cat, _ in Categorie.TYPES_CHOICES
+    }
+    return unite, discipline, categories
+
+
+def creer_projet(nom='Projet test'):
+    client = Client.objects.create(nom=nom, email=f'{nom.replace(" ", "_")}@test.local')
+    return Projet.objects.create(nom=nom, client=client)
+
+
+def remplir_projet(projet, nb_lignes, unite, discipline, categories):
+    """Ajoute ``nb_lignes`` lignes standards réparties sur toutes les catégories."""
+    cats = list(categories.values())
+    elements = Element.objects.bulk_create([
+        Element(numero=f'E{projet.id}-{i:05d}', designation=f'Élément {i}',
+                prix_unitaire=Decimal('10.50') + i, unite=unite,
+                categorie=cats[i % len(cats)], discipline=discipline)
+        for i in range(nb_lignes)
+    ])
+    EstimationElement.objects.bulk_create([
+        EstimationElement(projet=projet, element=element, quantite=Decimal('2.25'),
+                          prix_unitaire_fixe=Decimal('7.00') if i % 7 == 0 else None)
+        for i, element in enumerate(elements)
+    ])
+    return elements
+
+
+def au_centime(montant):
+    return Decimal(montant).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def totaux_reference(projet):
+    """Ancien calcul ligne à ligne (coût de ligne au centime), référence pour les tests."""
+    totaux = dict.fromkeys(['materiel', 'main_oeuvre', 'transport', 'etude'], Decimal('0'))
+    for ligne in EstimationElement.objects.filter(projet=projet):
+        if ligne.element and ligne.element.categorie:
+            totaux[ligne.element.categorie.type_categorie] += au_centime(ligne.cout_total)
+    for demande in DemandeElement.objects.filter(projet=projet, statut='approuve',
+                                                 prix_unitaire_admin__isnull=False):
+        totaux[demande.categorie.type_categorie] += au_centime(demande.cout_total)
+    for session in SessionSablage.objects.filter(projet=projet, valide=True):
+        totaux['main_oeuvre'] += session.cout_total
+    return totaux
+
+
+def sous_totaux_reference(projet):
+    """``{(categorie_id, discipline_id): (nb_lignes, montant)}`` ligne à ligne."""
+    sous_totaux = {}
+    lignes = [(l.element.categorie_id, l.element.discipline_id, l.cout_total)
+              for l in EstimationElement.objects.filter(projet=projet, element__isnull=False)]
+    lignes += [(d.categorie_id, d.discipline_id, d.cout_total)
+               for d in DemandeElement.objects.filter(projet=projet, statut='approuve',
+                                                      prix_unitaire_admin__isnull=False)]
+    for categorie_id, discipline_id, montant in lignes:
+        nb, total = sous_totaux.get((categorie_id, discipline_id), (0, Decimal('0')))
+        sous_totaux[(categorie_id, discipline_id)] = (nb + 1, total + au_centime(montant))
+    return sous_totaux
+
+
+def sous_totaux_stockes(projet):
+    return {(st.categorie_id, st.discipline_id): (st.nb_lignes, st.montant)
+            for st in EstimationSubtotal.objects.filter(projet=projet, nb_lignes__gt=0)}
+
+
+class MediaTemporaireMixin:
+    """``MEDIA_ROOT`` dans un répertoire temporaire : les exports en cache n'atterrissent pas dans le projet."""
+
+    @classmethod
+    def setUpClass(cls):
+        media = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(media.cleanup)
+        cls.media = Path(media.name)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media.name))
+        super().setUpClass()
+
+    def setUp(self):
+        shutil.rmtree(self.media / 'exports', ignore_errors=True)
+        super().setUp()
+
+
+class CalculerTotauxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def test_totaux_identiques_au_calcul_ligne_a_ligne(self):
+        projet = creer_projet()
+        remplir_projet(projet, 30, self.unite, self.discipline, self.categories)
+        DemandeElement.objects.create(
+            projet=projet, categorie=self.categories['transport'], discipline=self.discipline,
+            designation='Camion', unite=self.unite, quantite=Decimal('3'),
+            statut='approuve', prix_unitaire_admin=Decimal('1500.00'),
+        )
+        DemandeElement.objects.create(
+            projet=projet, categorie=self.categories['etude'], discipline=self.discipline,
+            designation='En attente', unite=self.unite, quantite=Decimal('3'),
+            prix_unitaire_admin=Decimal('99.00'),
+        )
+        SessionSablage.objects.create(projet=projet, cout_total=Decimal('25000.00'), valide=True)
+        SessionSablage.objects.create(projet=projet, cout_total=Decimal('999.00'), valide=False)
+
+        summary, _ = EstimationSummary.objects.get_or_create(projet=projet)
+        summary.calculer_totaux()
+        summary.refresh_from_db()
+
+        reference = totaux_reference(projet)
+        self.assertEqual(summary.cout_total_materiel, reference['materiel'])
+        self.assertEqual(summary.cout_total_main_oeuvre, reference['main_oeuvre'])
+        self.assertEqual(summary.cout_total_transport, reference['transport'])
+        self.assertEqual(summary.cout_total_etude, reference['etude'])
+        self.assertEqual(summary.cout_total_ht, sum(reference.values()))
+        self.assertEqual(summary.cout_total_ttc, summary.cout_total_ht + summary.tva_montant)
+        self.assertEqual(sous_totaux_stockes(projet), sous_totaux_reference(projet))
+
+    def test_nombre_de_requetes_constant(self):
+        """Benchmark : le nombre de requêtes ne dépend pas du nombre de lignes."""
+        nb_requetes = {}
+        for nb_lignes in (5, 50, 500):
+            projet = creer_projet(f'Projet {nb_lignes}')
+            remplir_projet(projet, nb_lignes, self.unite, self.discipline, self.categories)
+            summary, _ = EstimationSummary.objects.get_or_create(projet=projet)
+            with CaptureQueriesContext(connection) as ctx:
+                summary.calculer_totaux()
+            nb_requetes[nb_lignes] = len(ctx.captured_queries)
+        self.assertEqual(len(set(nb_requetes.values())), 1, nb_requetes)
+
+
+class PlanificationRecalculTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        self.projet = creer_projet()
+        self.elements = remplir_projet(self.projet, 10, self.unite, self.discipline, self.categories)
+
+    def _compter_recalculs(self):
+        return mock.patch.object(EstimationSummary, 'calculer_totaux', autospec=True)
+
+    def test_un_seul_recalcul_par_transaction(self):
+        with self._compter_recalculs() as calcul:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    EstimationElement.objects.filter(projet=self.projet).delete()
+                    for element in self.elements:
+                        EstimationElement.objects.create(projet=self.projet, element=element)
+                    self.assertEqual(calcul.call_count, 0)
+        self.assertEqual(calcul.call_count, 1)
+
+    def test_recalculs_groupes_et_supprimes(self):
+        with self._compter_recalculs() as calcul:
+            with self.captureOnCommitCallbacks(execute=True):
+                with recalculs_groupes():
+                    for ligne in EstimationElement.objects.filter(projet=self.projet):
+                        ligne.quantite += 1
+                        ligne.save()
+            self.assertEqual(calcul.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                with recalculs_groupes(executer=False):
+                    EstimationElement.objects.filter(projet=self.projet).delete()
+            self.assertEqual(calcul.call_count, 1)
+
+    def test_rien_apres_rollback(self):
+        with self._compter_recalculs() as calcul:
+            with self.captureOnCommitCallbacks(execute=True):
+                with self.assertRaises(ValueError), transaction.atomic():
+                    EstimationElement.objects.create(projet=self.projet, element=self.elements[0])
+                    raise ValueError
+        self.assertEqual(calcul.call_count, 0)
+
+
+class MaintenanceIncrementaleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        self.projet = creer_projet()
+        EstimationSummary.objects.create(projet=self.projet)
+        self.elements = remplir_projet(self.projet, 0, self.unite, self.discipline, self.categories)
+        self.element = Element.objects.create(
+            designation='Coude 90', prix_unitaire=Decimal('12.35'), unite=self.unite,
+            categorie=self.categories['materiel'], discipline=self.discipline,
+        )
+
+    def assertResumeJuste(self):
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        reference = totaux_reference(self.projet)
+        for type_cat, montant in reference.items():
+            self.assertEqual(getattr(summary, f'cout_total_{type_cat}'), montant, type_cat)
+        self.assertEqual(summary.cout_total_ht, sum(reference.values()))
+        self.assertEqual(summary.tva_montant, au_centime(summary.cout_total_ht * summary.tva_taux / 100))
+        self.assertEqual(summary.cout_total_ttc, summary.cout_total_ht + summary.tva_montant)
+        self.assertEqual(sous_totaux_stockes(self.projet), sous_totaux_reference(self.projet))
+        return summary
+
+    def test_deltas_sur_insertion_modification_suppression(self):
+        ligne = EstimationElement.objects.create(projet=self.projet, element=self.element,
+                                                 quantite=Decimal('3.33'))
+        self.assertResumeJuste()
+
+        ligne.quantite = Decimal('7.5')
+        ligne.save()
+        self.assertResumeJuste()
+
+        # Changement de discipline : la ligne passe d'un sous-total à l'autre
+        self.element.discipline = Discipline.objects.create(nom='Électricité', code='ELE')
+        with self.settings(ESTIMATION_TACHES_ASYNCHRONES=False), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.element.save()
+        self.assertResumeJuste()
+
+        demande = DemandeElement.objects.create(
+            projet=self.projet, categorie=self.categories['transport'], discipline=self.discipline,
+            designation='Grue', unite=self.unite, quantite=Decimal('2'),
+            prix_unitaire_admin=Decimal('800.00'),
+        )
+        self.assertEqual(self.assertResumeJuste().cout_total_transport, 0)
+        demande.statut = 'approuve'
+        demande.save()
+        self.assertEqual(self.assertResumeJuste().cout_total_transport, Decimal('1600.00'))
+
+        session = SessionSablage.objects.create(projet=self.projet, cout_total=Decimal('5000.00'))
+        session.valide = True
+        session.save()
+        self.assertResumeJuste()
+
+        ligne.delete()
+        demande.delete()
+        session.delete()
+        summary = self.assertResumeJuste()
+        self.assertEqual(summary.cout_total_ttc, 0)
+
+    def test_modification_en_temps_constant(self):
+        remplir_projet(self.projet, 200, self.unite, self.discipline, self.categories)
+        EstimationSummary.objects.get(projet=self.projet).calculer_totaux()
+        ligne = EstimationElement.objects.filter(projet=self.projet).first()
+        ligne.quantite = Decimal('42')
+        # lecture avant, UPDATE de la ligne, lecture après, version du projet,
+        # UPDATE du résumé, relecture du HT, UPDATE de la TVA, UPDATE du sous-total
+        with self.assertNumQueries(8):
+            ligne.save()
+        self.assertResumeJuste()
+
+    def test_tva_sur_montants_ronds(self):
+        # HT entier et taux entier : la TVA ne doit pas être une division entière
+        element = Element.objects.create(
+            designation='Bride', prix_unitaire=Decimal('42'), unite=self.unite,
+            categorie=self.categories['materiel'], discipline=self.discipline,
+        )
+        ligne = EstimationElement.objects.create(projet=self.projet, element=element, quantite=1)
+        summary = self.assertResumeJuste()
+        self.assertEqual(summary.tva_montant, Decimal('7.56'))
+        self.assertEqual(summary.cout_total_ttc, Decimal('49.56'))
+
+        ligne.quantite = 3
+        ligne.save()
+        summary = self.assertResumeJuste()
+        self.assertEqual((summary.tva_montant, summary.cout_total_ttc), (Decimal('22.68'), Decimal('148.68')))
+
+    def test_commande_de_verification(self):
+        EstimationElement.objects.create(projet=self.projet, element=self.element, quantite=2)
+        EstimationSummary.objects.filter(projet=self.projet).update(cout_total_materiel=1)
+
+        sortie = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recalculer_resumes', verifier_seulement=True, stdout=sortie)
+        call_command('recalculer_resumes', stdout=sortie)
+        self.assertResumeJuste()
+        call_command('recalculer_resumes', verifier_seulement=True, stdout=sortie)
+
+        # Compartiments justes mais TVA/TTC faux : détecté et reconstruit aussi
+        EstimationSummary.objects.filter(projet=self.projet).update(tva_montant=1, cout_total_ttc=2)
+        with self.assertRaises(CommandError):
+            call_command('recalculer_resumes', verifier_seulement=True, stdout=sortie)
+        self.assertIn('TVA 1.00 ≠', sortie.getvalue())
+        call_command('recalculer_resumes', stdout=sortie)
+        self.assertResumeJuste()
+        call_command('recalculer_resumes', verifier_seulement=True, stdout=sortie)
+
+
+class TachesRecalculPrixTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def test_changements_de_prix_fusionnes_puis_traites(self):
+        projets = [creer_projet(f'Projet {i}') for i in range(3)]
+        elements = remplir_projet(projets[0], 4, self.unite, self.discipline, self.categories)
+        for projet in projets:
+            EstimationSummary.objects.create(projet=projet)
+            for element in elements:
+                EstimationElement.objects.create(projet=projet, element=element, quantite=2)
+
+        with mock.patch.object(EstimationSummary, 'calculer_totaux', autospec=True) as calcul:
+            for element in elements:
+                element.prix_unitaire += 100
+                element.save()
+            element.actif = False
+            element.save()  # prix inchangé : rien à enfiler
+            self.assertEqual(calcul.call_count, 0)
+
+        tache = Tache.objects.get()
+        self.assertEqual(tache.statut, 'en_attente')
+        self.assertEqual(sorted(tache.parametres['elements']), sorted(e.pk for e in elements))
+
+        call_command('traiter_taches', lot=2, stdout=StringIO())
+        tache.refresh_from_db()
+        self.assertEqual((tache.statut, tache.progression, tache.total), ('termine', 3, 3))
+        for projet in projets:
+            summary = EstimationSummary.objects.get(projet=projet)
+            self.assertEqual(summary.cout_total_ht, sum(totaux_reference(projet).values()))
+
+
+class ResumeVersionneTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        self.projet = creer_projet()
+        self.elements = remplir_projet(self.projet, 5, self.unite, self.discipline, self.categories)
+        EstimationSummary.objects.create(projet=self.projet).calculer_totaux()
+
+    def ecritures_du_rapport(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(reverse('rapport_projet', args=[self.projet.id])).status_code, 200)
+        return [q['sql'] for q in ctx.captured_queries
+                if q['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+                and 'django_session' not in q['sql']]
+
+    def test_rapport_sans_ecriture_si_resume_a_jour(self):
+        self.assertEqual(self.ecritures_du_rapport(), [])
+
+    def test_totaux_du_rapport_depuis_les_sous_totaux(self):
+        reponse = self.client.get(reverse('rapport_projet', args=[self.projet.id]))
+        rapport = reponse.context['rapport']
+        for section in rapport.sections:
+            lignes = EstimationElement.objects.filter(projet=self.projet, element__categorie_id=section.categorie_id)
+            self.assertEqual(section.total, sum(au_centime(e.cout_total) for e in lignes))
+        self.assertEqual(rapport.nb_lignes, 5)
+        [repartition] = rapport.repartition_disciplines
+        self.assertEqual(repartition['montant'], EstimationSummary.objects.get(projet=self.projet).cout_total_ht)
+
+        # Les totaux sont lus dans la table des sous-totaux, pas recalculés ligne à ligne
+        sous_total = EstimationSubtotal.objects.filter(projet=self.projet).first()
+        EstimationSubtotal.objects.filter(pk=sous_total.pk).update(montant=F('montant') + 1)
+        rapport = construire_rapport(self.projet)
+        section = next(s for s in rapport.sections if s.categorie_id == sous_total.categorie_id)
+        self.assertEqual(section.total, sous_total.montant + 1)
+        self.assertEqual(rapport.repartition_disciplines[0]['montant'],
+                         EstimationSummary.objects.get(projet=self.projet).cout_total_ht + 1)
+
+    def test_modification_garde_le_resume_a_jour(self):
+        ligne = EstimationElement.objects.filter(projet=self.projet).first()
+        ligne.quantite = 9
+        ligne.save()
+        self.projet.refresh_from_db()
+        self.assertTrue(EstimationSummary.objects.get(projet=self.projet).est_a_jour(self.projet))
+        self.assertEqual(self.ecritures_du_rapport(), [])
+
+    def test_changement_de_prix_rend_le_resume_perime(self):
+        version = self.projet.version
+        element = self.elements[0]
+        element.prix_unitaire += 1
+        element.save()
+        self.projet.refresh_from_db()
+        self.assertGreater(self.projet.version, version)
+        self.assertFalse(EstimationSummary.objects.get(projet=self.projet).est_a_jour(self.projet))
+
+        # Le rapport recalcule une fois, puis plus rien
+        self.assertNotEqual(self.ecritures_du_rapport(), [])
+        self.assertEqual(self.ecritures_du_rapport(), [])
+        self.assertEqual(EstimationSummary.objects.get(projet=self.projet).cout_total_ht,
+                         sum(totaux_reference(self.projet).values()))
+
+    def test_changement_de_taux_dans_l_admin(self):
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        version = self.projet.version
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        reponse = self.client.post(reverse('admin:estimation_estimationsummary_change', args=[summary.pk]),
+                                   {'projet': self.projet.pk, 'tva_taux': '10'})
+        self.assertEqual(reponse.status_code, 302)
+
+        self.projet.refresh_from_db()
+        self.assertGreater(self.projet.version, version)
+        summary.refresh_from_db()
+        self.assertTrue(summary.est_a_jour(self.projet))
+        self.assertEqual(summary.tva_montant, au_centime(summary.cout_total_ht * Decimal('0.10')))
+        self.assertEqual(summary.cout_total_ttc, summary.cout_total_ht + summary.tva_montant)
+
+
+class ScenariosTvaTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        cls.projet = creer_projet()
+        remplir_projet(cls.projet, 8, cls.unite, cls.discipline, cls.categories)
+        cls.summary = EstimationSummary.objects.create(projet=cls.projet)
+        cls.summary.calculer_totaux()
+
+    def test_simulation_sans_ecriture(self):
+        with self.assertNumQueries(0):
+            scenario = self.summary.simuler(tva_taux=10, marge_taux=5, remise_taux=2)
+        ht = self.summary.cout_total_ht
+        marge = au_centime(ht * Decimal('0.05'))
+        remise = au_centime((ht + marge) * Decimal('0.02'))
+        self.assertEqual(scenario['cout_total_ht'], ht + marge - remise)
+        self.assertEqual(scenario['cout_total_ttc'],
+                         scenario['cout_total_ht'] + au_centime(scenario['cout_total_ht'] / 10))
+        self.assertEqual(self.summary.simuler()['cout_total_ttc'], self.summary.cout_total_ttc)
+
+    def test_rapport_tva_ne_modifie_pas_le_resume(self):
+        url = reverse('rapport_projet', args=[self.projet.id])
+        response = self.client.get(url, {'tva': '5'})
+        self.assertEqual(response.context['financier']['tva_taux'], Decimal('5'))
+        self.assertEqual(EstimationSummary.objects.get(pk=self.summary.pk).tva_taux, Decimal('18'))
+
+    def test_table_de_scenarios(self):
+        url = reverse('ajax_scenarios_tva', args=[self.projet.id])
+        data = self.client.get(url, {'tva': '0,18', 'marge': '0,10'}).json()
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['scenarios']), 4)
+        sans_tva = data['scenarios'][0]
+        self.assertEqual(sans_tva['cout_total_ttc'], float(self.summary.cout_total_ht))
+        self.assertEqual(self.client.get(url, {'tva': ','.join(['1'] * 600)}).status_code, 400)
+
+
+@override_settings(ESTIMATION_REFERENTIEL_VERIFICATION=60)
+class ModeleRapportTests(MediaTemporaireMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.projet = creer_projet()
+        self.elements = remplir_projet(self.projet, 6, self.unite, self.discipline, self.categories)
+        DemandeElement.objects.create(projet=self.projet, categorie=self.categories['transport'],
+                                      discipline=self.discipline, designation='Grue', unite=self.unite,
+                                      quantite=2, statut='approuve', prix_unitaire_admin=Decimal('150.00'))
+        SessionSablage.objects.create(projet=self.projet, surface_globale=Decimal('1.5'),
+                                      cout_total=Decimal('7500.00'), valide=True)
+        EstimationElement.objects.create(projet=self.projet, quantite=Decimal('0.80'),
+                                         prix_unitaire_fixe=Decimal('5000'))  # sablage enregistré
+        recalculer_projet(self.projet.id)
+        self.projet.refresh_from_db()
+
+    def temporaire(self):
+        session = self.client.session
+        session['elements_sablage'] = [{'type_piece': 'tube', 'nom_type_piece': 'Tube', 'dn': 50,
+                                        'nom_dn': 'DN 50', 'quantite': 2.0, 'surface_unitaire': 0.2,
+                                        'surface_totale': 0.4}]
+        session.save()
+
+    def test_requetes_fixes_et_totaux(self):
+        with self.assertNumQueries(6):  # résumé, lignes, sessions, demandes, sous-totaux ×2
+            rapport = construire_rapport(self.projet)
+        self.assertEqual(rapport.totaux, totaux_reference(self.projet))
+        self.assertEqual(rapport.nb_lignes, 6 + 1 + 1 + 1)
+        mo = next(s for s in rapport.sections if s.categorie_id == self.categories['main_oeuvre'].id)
+        self.assertEqual([ligne.type for ligne in mo.lignes][-2:], ['sablage', 'session'])
+        for section in rapport.sections:
+            self.assertEqual(section.total, sum(au_centime(ligne.total) for ligne in section.lignes))
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        self.assertEqual(rapport.financier()['cout_total_ttc'], summary.cout_total_ttc)
+
+    def test_cache_par_version(self):
+        rapport = rapport_en_cache(self.projet)
+        with self.assertNumQueries(0):
+            self.assertEqual(rapport_en_cache(self.projet).totaux, rapport.totaux)
+
+        ligne = EstimationElement.objects.filter(projet=self.projet, element=self.elements[0]).get()
+        ligne.quantite = 10
+        ligne.save()
+        self.projet.refresh_from_db()
+        self.assertEqual(rapport_en_cache(self.projet).totaux, totaux_reference(self.projet))
+        self.assertNotEqual(rapport_en_cache(self.projet).totaux, rapport.totaux)
+
+        # Désignation du catalogue : pas de nouvelle version du projet, mais nouvelle génération du catalogue
+        with self.captureOnCommitCallbacks(execute=True):
+            Element.objects.filter(pk=self.elements[1].pk).update(designation='Renommé')
+            self.elements[1].refresh_from_db()
+            self.elements[1].save()
+        self.assertIn('Renommé', [ligne.designation for ligne in rapport_en_cache(self.projet).lignes()])
+
+    def test_cache_suit_le_taux_de_tva(self):
+        self.assertEqual(rapport_en_cache(self.projet).financier()['tva_taux'], Decimal('18'))
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        summary.tva_taux = Decimal('10')
+        summary.save()
+        self.projet.refresh_from_db()
+        financier = rapport_en_cache(self.projet).financier()
+        self.assertEqual(financier['tva_taux'], Decimal('10'))
+        self.assertEqual(financier['tva_montant'], EstimationSummary.objects.get(pk=summary.pk).tva_montant)
+
+    def test_sablage_temporaire_sur_une_copie(self):
+        rapport = rapport_en_cache(self.projet)
+        avec = rapport.avec_sablage_temporaire([{'nom_type_piece': 'Tube', 'nom_dn': 'DN 50', 'quantite': 2.0,
+                                                 'surface_totale': 0.4}])
+        self.assertEqual(avec.totaux['main_oeuvre'], rapport.totaux['main_oeuvre'] + 2000)
+        self.assertEqual(avec.nb_lignes, rapport.nb_lignes)
+        self.assertNotIn('temporaire', [ligne.type for ligne in rapport_en_cache(self.projet).lignes()])
+
+    def test_page_pdf_et_excel_lisent_le_meme_modele(self):
+        import openpyxl
+
+        self.temporaire()
+        page = self.client.get(reverse('rapport_projet', args=[self.projet.id])).context['rapport']
+        # Page : sablage en cours affiché mais non compté
+        self.assertEqual(page.totaux, rapport_en_cache(self.projet).totaux)
+        self.assertIn('temporaire', [ligne.type for ligne in page.lignes()])
+
+        attendu = rapport_en_cache(self.projet).avec_sablage_temporaire(self.client.session['elements_sablage'])
+        pdf = self.client.get(reverse('export_pdf', args=[self.projet.id]))
+        self.assertEqual(pdf.status_code, 200)
+        self.assertTrue(pdf.getvalue().startswith(b'%PDF'))
+
+        excel = self.client.get(reverse('export_excel', args=[self.projet.id]))
+        feuille = openpyxl.load_workbook(BytesIO(excel.getvalue())).active
+        cellules = [cellule for ligne in feuille.iter_rows() for cellule in ligne if cellule.value is not None]
+        titres = {c.value for c in cellules if isinstance(c.value, str) and ' - Total: ' in c.value}
+        self.assertEqual(titres, {f"{s.nom} - Total: {s.total:,.2f} CFA" for s in attendu.sections})
+        ttc = next(feuille.cell(row=c.row, column=6).value for c in cellules if c.value == 'TOTAL TTC:')
+        self.assertAlmostEqual(ttc, float(attendu.financier()['cout_total_ttc']), places=2)
+
+    def test_excel_en_ecriture_seule_identique_au_classeur(self):
+        import openpyxl
+
+        self.temporaire()
+        elements = self.client.session['elements_sablage']
+        rapport = rapport_en_cache(self.projet).avec_sablage_temporaire(elements)
+        feuilles = []
+        for ecrire in (ecrire_excel_classeur, ecrire_excel_flux):
+            sortie = BytesIO()
+            ecrire(self.projet, rapport, elements, sortie)
+            feuilles.append(openpyxl.load_workbook(BytesIO(sortie.getvalue())).active)
+
+        def couleur(couleur):
+            return couleur.rgb if couleur is not None and couleur.type == 'rgb' else None
+
+        def contenu(feuille):
+            return [[(c.value, c.number_format, c.font.b, couleur(c.font.color), couleur(c.fill.fgColor),
+                      c.alignment.horizontal, c.border.left and c.border.left.style)
+                     for c in ligne if c.value is not None]
+                    for ligne in feuille.iter_rows()]
+
+        classeur, flux = feuilles
+        self.assertEqual(contenu(flux), contenu(classeur))
+        self.assertEqual({str(r) for r in flux.merged_cells.ranges}, {str(r) for r in classeur.merged_cells.ranges})
+        self.assertEqual(flux.column_dimensions['A'].width, classeur.column_dimensions['A'].width)
+
+
+class ExportExcelFluxTests(TestCase):
+
+    def memoire_pic(self, ecrire, nb_lignes):
+        projet = Projet(nom='Mesure', client=Client(nom='Client'))
+        rapport = rapport_synthetique(nb_lignes)
+        tracemalloc.start()
+        try:
+            with tempfile.TemporaryFile() as sortie:
+                ecrire(projet, rapport, [], sortie)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_memoire_constante_en_ecriture_seule(self):
+        petit, gros = self.memoire_pic(ecrire_excel_flux, 500), self.memoire_pic(ecrire_excel_flux, 2000)
+        self.assertLess(gros, petit * 1.5)
+        # Le classeur en mémoire grandit avec le nombre de lignes
+        self.assertGreater(self.memoire_pic(ecrire_excel_classeur, 2000), 2 * gros)
+
+    def test_commande_benchmark_excel(self):
+        sortie = StringIO()
+        call_command('benchmark_excel', lignes=[30], stdout=sortie, stderr=StringIO())
+        mesures = json.loads(sortie.getvalue())['tailles']['30']
+        self.assertEqual(set(mesures), {'classeur', 'flux'})
+        self.assertGreater(mesures['flux']['octets'], 0)
+
+
+class ExportLignesTests(MediaTemporaireMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        cls.projet = creer_projet('Projet A')
+        remplir_projet(cls.projet, 6, cls.unite, cls.discipline, cls.categories)
+        DemandeElement.objects.create(projet=cls.projet, categorie=cls.categories['transport'],
+                                      discipline=cls.discipline, designation='Grue', unite=cls.unite,
+                                      quantite=2, statut='approuve', prix_unitaire_admin=Decimal('150.00'))
+        DemandeElement.objects.create(projet=cls.projet, categorie=cls.categories['transport'],
+                                      discipline=cls.discipline, designation='Nacelle', unite=cls.unite,
+                                      quantite=1, statut='en_attente')
+        cls.autre = creer_projet('Projet B')
+        remplir_projet(cls.autre, 3, cls.unite, cls.discipline, cls.categories)
+        cls.staff = User.objects.create_user('controleur', password='secret', is_staff=True)
+
+    def lire(self, url, **parametres):
+        reponse = self.client.get(url, parametres)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertTrue(reponse.streaming)
+        return reponse, b''.join(reponse.streaming_content).decode()
+
+    def test_csv_d_un_projet(self):
+        import csv
+
+        reponse, texte = self.lire(reverse('export_lignes_projet', args=[self.projet.id, 'csv']))
+        self.assertIn('attachment', reponse['Content-Disposition'])
+        self.assertTrue(texte.startswith('\ufeff'))  # BOM pour Excel
+        lignes = list(csv.DictReader(texte[1:].splitlines(), delimiter=';'))
+        self.assertEqual(len(lignes), 6 + 1)
+        self.assertEqual(list(lignes[0]), [entete for _, entete in export_lignes.COLONNES_CSV])
+        grue = next(ligne for ligne in lignes if ligne['Désignation'] == 'Grue')
+        self.assertEqual((grue['Type'], grue['Catégorie'], grue['Discipline'], grue['Unité'], grue['Client']),
+                         ('personnalise', 'Catégorie transport', 'Tuyauterie', 'Unité', self.projet.client.nom))
+        self.assertEqual(Decimal(grue['Total']), Decimal('300.00'))
+        self.assertEqual(sum(au_centime(Decimal(ligne['Total'])) for ligne in lignes),
+                         sum(totaux_reference(self.projet).values()))
+        self.assertEqual(self.client.get(reverse('export_lignes_projet', args=[self.projet.id, 'xml'])).status_code,
+                         404)
+
+    def test_meme_csv_que_l_export_du_rapport(self):
+        import csv
+
+        cache.clear()
+        _, texte = self.lire(reverse('export_lignes_projet', args=[self.projet.id, 'csv']))
+        reponse = self.client.get(reverse('export_csv', args=[self.projet.id]))
+        rapport = b''.join(reponse.streaming_content) if reponse.streaming else reponse.content
+        self.assertEqual(rapport.decode('utf-8').splitlines()[0], texte.splitlines()[0])
+
+        def contenu(lignes):
+            return Counter(tuple(ligne) for ligne in csv.reader(lignes, delimiter=';'))
+        self.assertEqual(contenu(rapport.decode('utf-8-sig').splitlines()), contenu(texte[1:].splitlines()))
+
+    def test_ndjson_d_un_ensemble_filtre(self):
+        url = reverse('export_lignes', args=['ndjson'])
+        self.assertEqual(self.client.get(url).status_code, 302)  # réservé au personnel
+        self.client.force_login(self.staff)
+
+        _, texte = self.lire(url)
+        lignes = [json.loads(ligne) for ligne in texte.splitlines()]
+        self.assertEqual(Counter(ligne['projet'] for ligne in lignes), {'Projet A': 7, 'Projet B': 3})
+        self.assertIsInstance(lignes[0]['total'], float)
+
+        _, texte = self.lire(url, projet=[self.autre.id], q='projet')
+        self.assertEqual({json.loads(ligne)['projet_id'] for ligne in texte.splitlines()}, {self.autre.id})
+        _, texte = self.lire(url, client=self.projet.client_id, depuis='2000-01-01')
+        self.assertEqual(len(texte.splitlines()), 7)
+        self.assertEqual(self.client.get(url, {'depuis': 'hier'}).status_code, 400)
+
+    def test_lecture_par_morceaux(self):
+        projets = Projet.objects.filter(pk=self.projet.pk)
+        referentiel()  # chargé une fois par processus
+        with CaptureQueriesContext(connection) as requetes:
+            lues = list(export_lignes.lignes(projets, taille_morceau=2))
+        self.assertEqual(len(lues), 7)
+        self.assertEqual(len(requetes), 3)  # une requête par modèle, quel que soit le nombre de lignes
+
+        # Mémoire : les lignes ne sont jamais toutes chargées
+        def pic(projet):
+            tracemalloc.start()
+            try:
+                for _ in export_lignes.flux_csv(export_lignes.lignes(Projet.objects.filter(pk=projet.pk), 50)):
+                    pass
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        moyen, gros = creer_projet('Projet C'), creer_projet('Projet D')
+        remplir_projet(moyen, 1000, self.unite, self.discipline, self.categories)
+        remplir_projet(gros, 4000, self.unite, self.discipline, self.categories)
+        self.assertLess(pic(gros), 1.5 * pic(moyen))
+
+
+class ExportsEnCacheTests(MediaTemporaireMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.projet = creer_projet()
+        remplir_projet(self.projet, 4, self.unite, self.discipline, self.categories)
+        recalculer_projet(self.projet.id)
+        self.url = reverse('export_pdf', args=[self.projet.id])
+
+    def telecharger(self, **en_tetes):
+        reponse = self.client.get(self.url, headers=en_tetes)
+        if reponse.streaming:
+            reponse.getvalue()
+        return reponse
+
+    def test_document_inchange_servi_depuis_le_cache(self):
+        with mock.patch('estimation.views.ecrire_pdf', wraps=ecrire_pdf) as generation:
+            premier = self.telecharger()
+            second = self.telecharger()
+        self.assertEqual(generation.call_count, 1)
+        self.assertEqual(premier['ETag'], second['ETag'])
+        self.assertIn('attachment', second['Content-Disposition'])
+        self.assertEqual(len(list(self.media.glob('exports/*/*.pdf'))), 1)
+
+        non_modifie = self.telecharger(if_none_match=premier['ETag'])
+        self.assertEqual(non_modifie.status_code, 304)
+
+    def test_empreinte_suit_le_contenu(self):
+        etag = self.telecharger()['ETag']
+        ligne = EstimationElement.objects.filter(projet=self.projet).first()
+        ligne.quantite += 1
+        ligne.save()
+        modifie = self.telecharger(if_none_match=etag)
+        self.assertEqual(modifie.status_code, 200)
+        self.assertNotEqual(modifie['ETag'], etag)
+
+        session = self.client.session
+        session['elements_sablage'] = [{'nom_type_piece': 'Tube', 'nom_dn': 'DN 50', 'quantite': 2.0,
+                                        'surface_totale': 0.4}]
+        session.save()
+        self.assertNotEqual(self.telecharger()['ETag'], modifie['ETag'])
+
+    def test_empreinte_suit_le_taux_de_tva(self):
+        etag = self.telecharger()['ETag']
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        summary.tva_taux = Decimal('10')
+        summary.save()
+        modifie = self.telecharger(if_none_match=etag)
+        self.assertEqual(modifie.status_code, 200)
+        self.assertNotEqual(modifie['ETag'], etag)
+
+    def test_cle_identique_d_un_processus_a_l_autre(self):
+        cle = cache_exports.empreinte(self.projet, 'pdf')
+        # Autre processus : cache LocMem vide, génération du catalogue pas encore lue
+        cache.clear()
+        oublier_generation()
+        self.assertEqual(cache_exports.empreinte(self.projet, 'pdf'), cle)
+
+        # Catalogue modifié ailleurs : nouvelle clé une fois la génération relue
+        invalider_catalogue()
+        cache.clear()
+        self.assertNotEqual(cache_exports.empreinte(self.projet, 'pdf'), cle)
+
+    @override_settings(ESTIMATION_EXPORTS_NOMBRE_MAX=2)
+    def test_eviction_des_moins_recemment_servis(self):
+        cles = [f'{i:064x}' for i in range(3)]
+        for age, cle in zip((30, 20), cles):
+            fichier = cache_exports.obtenir(cle, 'pdf', lambda sortie: sortie.write(b'%PDF'))
+            os.utime(fichier, (time.time() - age, time.time() - age))
+        cache_exports.obtenir(cles[0], 'pdf', self.fail)  # servi : devient le plus récent
+        cache_exports.obtenir(cles[2], 'pdf', lambda sortie: sortie.write(b'%PDF'))
+        self.assertEqual(sorted(f.stem for f in self.media.glob('exports/*/*')), [cles[0], cles[2]])
+
+
+class ExportsAsynchronesTests(MediaTemporaireMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.projet = creer_projet()
+        remplir_projet(self.projet, 6, self.unite, self.discipline, self.categories)
+        recalculer_projet(self.projet.id)
+
+    def lancer(self, format, client=None):
+        reponse = (client or self.client).post(reverse('export_lancer', args=[self.projet.id, format]))
+        self.assertEqual(reponse.status_code, 202)
+        return reponse.json()
+
+    def test_lancer_suivre_telecharger(self):
+        tache = self.lancer('csv')
+        self.assertEqual((tache['statut'], tache['url_telechargement']), ('en_attente', None))
+        self.assertEqual(self.lancer('csv')['tache'], tache['tache'])  # même export : même tâche
+        self.assertEqual(self.client.get(reverse('export_telecharger', args=[tache['tache']])).status_code, 409)
+
+        call_command('traiter_taches', stdout=StringIO())
+        statut = self.client.get(tache['url_statut']).json()
+        self.assertEqual((statut['statut'], statut['pourcentage']), ('termine', 100))
+        self.assertEqual(statut['progression'], statut['total'])
+
+        reponse = self.client.get(statut['url_telechargement'])
+        lignes = reponse.getvalue().decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lignes), 1 + rapport_en_cache(self.projet).nb_lignes)
+        self.assertEqual(self.client.get(statut['url_telechargement'],
+                                         headers={'if_none_match': reponse['ETag']}).status_code, 304)
+
+        # Document en cache : la tâche suivante est terminée d'emblée
+        self.assertEqual(self.lancer('csv')['statut'], 'termine')
+
+    def test_progression_du_pdf(self):
+        tache = Tache.objects.get(pk=self.lancer('pdf')['tache'])
+        tache = executer_tache(reserver_tache(tache.pk))
+        self.assertEqual(tache.statut, 'termine', tache.message)
+        self.assertGreater(tache.total, 0)
+        self.assertEqual(tache.progression, tache.total)
+        self.assertTrue(cache_exports.chemin(tache.parametres['cle'], 'pdf').exists())
+
+    def test_worker_ecrit_sous_la_cle_de_la_mise_en_file(self):
+        tache = self.lancer('excel')
+        cle = Tache.objects.get(pk=tache['tache']).parametres['cle']
+        # Le worker est un autre processus : il ne recalcule pas l'empreinte
+        with mock.patch('estimation.cache_exports.empreinte', side_effect=AssertionError):
+            call_command('traiter_taches', stdout=StringIO())
+        self.assertTrue(cache_exports.chemin(cle, 'excel').exists())
+        self.assertEqual(self.lancer('excel')['statut'], 'termine')
+
+    def test_tache_reservee_a_sa_session(self):
+        tache = self.lancer('excel')
+        self.assertEqual(self.client_class().get(tache['url_statut']).status_code, 404)
+        self.assertEqual(self.client.post(reverse('export_lancer', args=[self.projet.id, 'zip'])).status_code, 404)
+
+    def test_tache_abandonnee_liberee(self):
+        tache = Tache.objects.get(pk=self.lancer('csv')['tache'])
+        self.assertEqual(reserver_tache(tache.pk).statut, 'en_cours')
+        # Worker tué : la tâche reste en cours, mais pas au-delà de la durée maximale
+        self.assertEqual(self.lancer('csv')['tache'], tache.pk)
+        Tache.objects.filter(pk=tache.pk).update(date_debut=timezone.now() - datetime.timedelta(minutes=31))
+        nouvelle = self.lancer('csv')
+        self.assertNotEqual(nouvelle['tache'], tache.pk)
+
+        call_command('traiter_taches', stdout=StringIO())
+        tache.refresh_from_db()
+        self.assertEqual(tache.statut, 'echec')
+        self.assertIn('Abandonnée', tache.message)
+        self.assertEqual(Tache.objects.get(pk=nouvelle['tache']).statut, 'termine')
+
+    @override_settings(ESTIMATION_TACHES_ASYNCHRONES=False)
+    def test_mode_synchrone(self):
+        tache = self.lancer('excel')
+        self.assertEqual(tache['statut'], 'termine', tache['message'])
+        reponse = self.client.get(tache['url_telechargement'])
+        self.assertTrue(reponse.getvalue().startswith(b'PK'))
+
+        shutil.rmtree(self.media / 'exports')  # évincé entre-temps
+        self.assertEqual(self.client.get(tache['url_telechargement']).status_code, 410)
+
+
+class ExportsPoolProcessusTests(MediaTemporaireMixin, TransactionTestCase):
+    """``traiter_taches --processus`` : les exports sont rendus dans des processus séparés."""
+
+    def test_pool_de_processus(self):
+        unite, discipline, categories = creer_referentiel()
+        taches = []
+        for i, format in enumerate(('pdf', 'excel', 'csv')):
+            projet = creer_projet(f'Projet {i}')
+            remplir_projet(projet, 5, unite, discipline, categories)
+            recalculer_projet(projet.id)
+            taches.append(enfiler_export(projet, format))
+
+        sortie = StringIO()
+        call_command('traiter_taches', processus=2, intervalle=0.1, stdout=sortie)
+        self.assertIn('3 tâche(s) traitée(s)', sortie.getvalue())
+        for tache in taches:
+            tache.refresh_from_db()
+            self.assertEqual(tache.statut, 'termine', tache.message)
+            self.assertTrue(cache_exports.chemin(tache.parametres['cle'], tache.parametres['format']).exists())
+
+
+class SynchronisationSelectionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        cls.categorie = cls.categories['materiel']
+
+    def setUp(self):
+        self.projet = creer_projet()
+        EstimationSummary.objects.create(projet=self.projet)
+        self.elements = Element.objects.bulk_create([
+            Element(numero=f'S{i:04d}', designation=f'Élément {i}', prix_unitaire=Decimal('3.10') + i,
+                    unite=self.unite, categorie=self.categorie, discipline=self.discipline)
+            for i in range(300)
+        ])
+        session = self.client.session
+        session['projet_id'] = self.projet.id
+        session.save()
+
+    def soumettre(self, quantites_par_element):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('item_selection', args=[self.categorie.id]), {
+                'elements': [e.id for e in quantites_par_element],
+                'quantites': [str(q) for q in quantites_par_element.values()],
+            })
+
+    def test_diff_applique_et_resume_juste(self):
+        self.soumettre({e: 2 for e in self.elements[:10]})
+        ligne_conservee = EstimationElement.objects.get(projet=self.projet, element=self.elements[5])
+
+        self.soumettre({**{e: 2 for e in self.elements[5:10]}, self.elements[6]: 4, self.elements[20]: 1})
+        lignes = dict(EstimationElement.objects.filter(projet=self.projet).values_list('element_id', 'quantite'))
+        self.assertEqual(lignes, {**{e.id: 2 for e in self.elements[5:10]},
+                                  self.elements[6].id: 4, self.elements[20].id: 1})
+        self.assertTrue(EstimationElement.objects.filter(pk=ligne_conservee.pk).exists())
+
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        self.assertEqual(summary.cout_total_ht, sum(totaux_reference(self.projet).values()))
+        self.assertEqual(sous_totaux_stockes(self.projet), sous_totaux_reference(self.projet))
+
+    def test_quantites_invalides_refusees(self):
+        self.soumettre({e: 2 for e in self.elements[:3]})
+        for invalide in ('abc', 'NaN', '-1', '0', '1e12'):
+            with self.subTest(quantite=invalide):
+                reponse = self.soumettre({self.elements[0]: 5, self.elements[3]: invalide})
+                self.assertEqual(reponse.status_code, 200)
+                lignes = dict(EstimationElement.objects.filter(projet=self.projet)
+                              .values_list('element_id', 'quantite'))
+                self.assertEqual(lignes, {e.id: 2 for e in self.elements[:3]})
+
+    def test_nombre_de_requetes_borne(self):
+        """Benchmark : enregistrer 300 éléments tient dans un budget fixe de requêtes
+        (seuls les lots de bulk_create/bulk_update dépendent de la taille)."""
+        for selection in ({e: 1 for e in self.elements[:30]}, {e: 3 for e in self.elements}):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.soumettre(selection).status_code, 302)
+            self.assertLessEqual(len(ctx.captured_queries), 25,
+                                 '\n'.join(q['sql'][:120] for q in ctx.captured_queries))
+        self.assertEqual(EstimationElement.objects.filter(projet=self.projet).count(), 300)
+
+
+class QuantitesGroupeesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+
+    def setUp(self):
+        self.projet = creer_projet()
+        self.elements = remplir_projet(self.projet, 40, self.unite, self.discipline, self.categories)
+        EstimationSummary.objects.create(projet=self.projet).calculer_totaux()
+        session = self.client.session
+        session['projet_id'] = self.projet.id
+        session.save()
+
+    def envoyer(self, changements):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('ajax_update_quantities'),
+                                    data={'changements': changements},
+                                    content_type='application/json')
+
+    def test_lot_applique_avec_un_seul_recalcul(self):
+        changements = [{'element_id': e.id, 'quantite': '4,5'} for e in self.elements[:30]]
+        changements += [{'element_id': 999999, 'quantite': 2}, {'element_id': self.elements[0].id, 'quantite': 'x'}]
+        with mock.patch.object(EstimationSummary, 'calculer_totaux', autospec=True,
+                               side_effect=EstimationSummary.calculer_totaux) as calcul:
+            data = self.envoyer(changements).json()
+        self.assertEqual(calcul.call_count, 1)
+
+        self.assertTrue(data['success'])
+        self.assertEqual(data['inconnus'], [999999])
+        self.assertEqual(data['invalides'], [self.elements[0].id])
+        for ligne in EstimationElement.objects.filter(projet=self.projet, element__in=self.elements[:30]):
+            self.assertEqual(ligne.quantite, Decimal('4.5'))
+            self.assertEqual(data['lignes'][str(ligne.element_id)], float(au_centime(ligne.cout_total)))
+        self.assertEqual(Decimal(str(data['summary']['cout_total_ht'])),
+                         sum(totaux_reference(self.projet).values()))
+        self.projet.refresh_from_db()
+        self.assertEqual(data['summary']['version'], self.projet.version)
+
+    def test_requete_invalide(self):
+        self.assertEqual(self.envoyer({'element_id': 1}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('ajax_update_quantities')).status_code, 405)
+
+
+class RecalculConcurrentTests(TransactionTestCase):
+    """Stress : de nombreux threads déclenchent le recalcul du même projet."""
+
+    NB_THREADS = 8
+    PAR_THREAD = 5
+
+    def setUp(self):
+        unite, discipline, categories = creer_referentiel()
+        self.projet = creer_projet()
+        remplir_projet(self.projet, 50, unite, discipline, categories)
+        recalculer_projet(self.projet.id)
+
+    def test_declenchements_paralleles_regroupes(self):
+        calculer_totaux = EstimationSummary.calculer_totaux
+        calculs, erreurs = [], []
+
+        def calcul_lent(summary):
+            calculs.append(summary.projet_id)
+            time.sleep(0.02)  # élargit la fenêtre de concurrence
+            calculer_totaux(summary)
+
+        depart = Barrier(self.NB_THREADS)
+
+        def declencher():
+            try:
+                depart.wait()
+                for _ in range(self.PAR_THREAD):
+                    recalculer_projet(self.projet.id)
+            except Exception as e:  # remonté dans le thread principal
+                erreurs.append(e)
+            finally:
+                connection.close()
+
+        with mock.patch.object(EstimationSummary, 'calculer_totaux', autospec=True,
+                               side_effect=calcul_lent):
+            threads = [Thread(target=declencher) for _ in range(self.NB_THREADS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(erreurs, [])
+        # Regroupés : bien moins de calculs que de déclenchements
+        self.assertLessEqual(len(calculs), self.NB_THREADS * self.PAR_THREAD // 2)
+        summary = EstimationSummary.objects.get(projet=self.projet)
+        self.projet.refresh_from_db()
+        self.assertFalse(summary.recalcul_en_attente)
+        self.assertTrue(summary.est_a_jour(self.projet))
+        self.assertEqual(summary.cout_total_ht, sum(totaux_reference(self.projet).values()))
+
+
+class RechercheCatalogueTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        categorie = cls.categories['materiel']
+        cls.coude_90 = Element.objects.create(
+            numero='TUY-050-90', designation='Coude 90° inox DN50', caracteristiques='PN16 - soudé',
+            prix_unitaire=10, unite=cls.unite, categorie=categorie, discipline=cls.discipline)
+        cls.coude_45 = Element.objects.create(
+            numero='TUY-050-45', designation='Coude 45° acier DN50', caracteristiques='Revêtement inox',
+            prix_unitaire=10, unite=cls.unite, categorie=categorie, discipline=cls.discipline)
+        cls.cable = Element.objects.create(
+            numero='ELE-3G25', designation='Câble électrique 3G2.5', caracteristiques='Gaine PVC',
+            prix_unitaire=10, unite=cls.unite, categorie=categorie, discipline=cls.discipline)
+
+    def rechercher(self, texte):
+        return list(rechercher_elements(Element.objects.all(), texte))
+
+    def test_multi_mots_classes(self):
+        self.assertEqual(self.rechercher('coude 90 inox DN50'), [self.coude_90])
+        # « inox » dans la désignation passe avant « inox » dans les caractéristiques
+        self.assertEqual(self.rechercher('inox'), [self.coude_90, self.coude_45])
+        # Préfixes ; à pertinence égale, ordre du catalogue (numéro)
+        self.assertEqual(self.rechercher('cou dn5'), [self.coude_45, self.coude_90])
+        self.assertEqual(self.rechercher('tuy-050-45'), [self.coude_45])
+
+    def test_insensible_aux_accents_et_a_la_casse(self):
+        for texte in ('electrique', 'ÉLECTRIQUE', 'cable gaine', 'câble'):
+            self.assertEqual(self.rechercher(texte), [self.cable], texte)
+
+    def test_saisie_vide_ou_sans_resultat(self):
+        self.assertEqual(len(self.rechercher('  ,; ')), 3)
+        self.assertEqual(self.rechercher('vanne'), [])
+        # La syntaxe FTS5 saisie est neutralisée
+        self.assertEqual(self.rechercher('"coude*" ^ (-'), [self.coude_45, self.coude_90])
+
+    def test_index_synchronise_par_triggers(self):
+        self.cable.designation = 'Gaine annelée'
+        self.cable.save()
+        self.assertEqual(self.rechercher('electrique'), [])
+        self.assertEqual(self.rechercher('annelee'), [self.cable])
+
+        Element.objects.filter(pk=self.coude_45.pk).update(caracteristiques='Galvanisé')
+        self.assertEqual(self.rechercher('galvanise'), [self.coude_45])
+
+        [vanne] = Element.objects.bulk_create([Element(
+            designation='Vanne à boisseau', prix_unitaire=1, unite=self.unite,
+            categorie=self.categories['materiel'], discipline=self.discipline)])
+        self.assertEqual([e.pk for e in self.rechercher('vanne')], [vanne.pk])
+
+        self.coude_90.delete()
+        self.assertEqual(self.rechercher('coude'), [self.coude_45])
+
+    def test_triggers_recrees_apres_migration(self):
+        self.assertFalse(installer_index(connection))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER estimation_element_fts_ai')
+        self.assertTrue(installer_index(connection))
+        Element.objects.create(designation='Réduction', prix_unitaire=1, unite=self.unite,
+                               categorie=self.categories['materiel'], discipline=self.discipline)
+        self.assertEqual(len(self.rechercher('reduction')), 1)
+
+    def test_vue_item_selection(self):
+        session = self.client.session
+        session['projet_id'] = creer_projet().id
+        session.save()
+        reponse = self.client.get(reverse('item_selection', args=[self.categories['materiel'].id]),
+                                  {'search': 'coude inox'})
+        self.assertEqual(list(reponse.context['elements']), [self.coude_90, self.coude_45])
+        self.assertEqual(list(reponse.context['disciplines']), [self.discipline])
+
+
+class RechercheApproximativeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        materiel = cls.categories['materiel']
+        cls.reduction = Element.objects.create(
+            numero='TUY-RED', designation='Réduction concentrique', caracteristiques='Acier DN80x50',
+            prix_unitaire=10, unite=cls.unite, categorie=materiel, discipline=cls.discipline)
+        cls.tuyau = Element.objects.create(
+            numero='TUY-PE', designation='Tuyau PEHD', caracteristiques='PN16',
+            prix_unitaire=10, unite=cls.unite, categorie=materiel, discipline=cls.discipline)
+        cls.coude = Element.objects.create(
+            numero='TUY-050-90', designation='Coude 90° inox DN50', caracteristiques='PN16 - soudé',
+            prix_unitaire=10, unite=cls.unite, categorie=materiel, discipline=cls.discipline)
+        cls.cable = Element.objects.create(
+            numero='ELE-3G25', designation='Câble électrique 3G2.5', caracteristiques='Gaine PVC',
+            prix_unitaire=10, unite=cls.unite, categorie=cls.categories['main_oeuvre'],
+            discipline=cls.discipline)
+
+    def setUp(self):
+        # Index global : reconstruit depuis la base de chaque test
+        index_catalogue.invalider()
+        self.addCleanup(index_catalogue.invalider)
+
+    def ids(self, texte, **kwargs):
+        return [element_id for element_id, _ in index_catalogue.rechercher(texte, **kwargs)]
+
+    def test_trigrammes(self):
+        self.assertEqual(trigrammes('Té'), {'  t', ' te', 'te '})
+        self.assertEqual(trigrammes(' ,; '), set())
+
+    def test_fautes_abreviations_et_accents(self):
+        self.assertEqual(self.ids('reduc conc')[0], self.reduction.pk)
+        self.assertEqual(self.ids('tuyaux pehd')[0], self.tuyau.pk)
+        self.assertEqual(self.ids('coud inoxx')[0], self.coude.pk)
+        self.assertEqual(self.ids('CABLE ELECTRIQE')[0], self.cable.pk)
+        self.assertEqual(self.ids('pompe doseuse'), [])
+        similarite = dict(index_catalogue.rechercher('reduction concentrique'))[self.reduction.pk]
+        self.assertEqual(similarite, 1.0)
+
+    def test_filtre_categorie_et_actifs(self):
+        self.assertEqual(self.ids('cable', categorie_id=self.categories['materiel'].pk), [])
+        self.assertEqual(self.ids('cable', categorie_id=self.categories['main_oeuvre'].pk), [self.cable.pk])
+        Element.objects.filter(pk=self.cable.pk).update(actif=False)
+        index_catalogue.invalider()
+        self.assertEqual(self.ids('cable'), [])
+        self.assertEqual(self.ids('cable', actifs_seulement=False), [self.cable.pk])
+
+    def test_index_tenu_a_jour_par_signaux(self):
+        self.assertEqual(self.ids('vanne boisseau'), [])  # construit l'index
+        with self.captureOnCommitCallbacks(execute=True):
+            vanne = Element.objects.create(
+                designation='Vanne à boisseau', prix_unitaire=1, unite=self.unite,
+                categorie=self.categories['materiel'], discipline=self.discipline)
+            self.tuyau.designation = 'Gaine annelée'
+            self.tuyau.save()
+        self.assertEqual(self.ids('vane boiseau'), [vanne.pk])
+        self.assertEqual(self.ids('tuyau pehd'), [])
+        self.assertEqual(self.ids('gaine annelee')[0], self.tuyau.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            vanne.delete()
+        self.assertEqual(self.ids('vanne boisseau'), [])
+
+    def test_index_reconstruit_apres_expiration(self):
+        index = IndexTrigrammes(duree_vie=0)
+        self.assertEqual(index.rechercher('reduction', k=1)[0][0], self.reduction.pk)
+        Element.objects.filter(pk=self.reduction.pk).update(designation='Bride pleine')
+        self.assertEqual(index.rechercher('reduction'), [])
+
+    def test_demande_personnalisee_propose_existants(self):
+        projet = creer_projet()
+        session = self.client.session
+        session['projet_id'] = projet.id
+        session.save()
+        url = reverse('item_selection', args=[self.categories['materiel'].id])
+        donnees = {'nouveau_element': '1', 'designation_personnalisee': 'Reducton concentriq',
+                   'discipline_personnalisee': self.discipline.id, 'unite_personnalisee': 'u',
+                   'quantite_personnalisee': '2'}
+
+        reponse = self.client.post(url, donnees)
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.context['suggestions_similaires'][0][0], self.reduction)
+        self.assertEqual(reponse.context['demande_en_cours']['designation'], 'Reducton concentriq')
+        self.assertFalse(DemandeElement.objects.filter(projet=projet).exists())
+
+        reponse = self.client.post(url, {**donnees, 'confirmer_demande': '1'})
+        self.assertRedirects(reponse, url)
+        self.assertEqual(DemandeElement.objects.get(projet=projet).designation, 'Reducton concentriq')
+
+    def test_vue_ajax(self):
+        url = reverse('ajax_elements_similaires')
+        data = self.client.get(url, {'q': 'coud inox', 'categorie': self.categories['materiel'].id}).json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['elements'][0]['id'], self.coude.pk)
+        self.assertEqual(data['elements'][0]['unite'], 'u')
+        self.assertEqual(self.client.get(url, {'q': 'co'}).json()['elements'], [])
+
+
+@override_settings(ESTIMATION_CATALOGUE_VERIFICATION=60)
+class PaginationCurseurTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        unite, discipline, categories = creer_referentiel()
+        cls.categorie = categories['materiel']
+        # Numéros et désignations répétés : l'id départage
+        Element.objects.bulk_create(
+            Element(numero=f'N{i % 7}', designation=f'Bride {i % 3}', prix_unitaire=1, unite=unite,
+                    categorie=cls.categorie, discipline=discipline)
+            for i in range(47))
+
+    def setUp(self):
+        cache.clear()
+        generation_catalogue()  # génération lue en base, gardée ESTIMATION_CATALOGUE_VERIFICATION secondes
+
+    def catalogue(self):
+        return Element.objects.filter(categorie=self.categorie)
+
+    def attendus(self):
+        return list(self.catalogue().order_by('numero', 'designation', 'id').values_list('id', flat=True))
+
+    def test_parcours_avant_et_arriere(self):
+        vus, numeros = [], []
+        page = paginer_par_curseur(self.catalogue(), None, par_page=10)
+        while True:
+            vus += [e.pk for e in page]
+            numeros.append(page.number)
+            if not page.has_next():
+                break
+            page = paginer_par_curseur(self.catalogue(), page.curseur_suivant, par_page=10)
+        self.assertEqual(vus, self.attendus())
+        self.assertEqual(numeros, [1, 2, 3, 4, 5])
+        self.assertEqual((page.count, page.num_pages, len(page)), (47, 5, 7))
+
+        vus = []
+        while page.has_previous():
+            page = paginer_par_curseur(self.catalogue(), page.curseur_precedent, par_page=10)
+            vus = [e.pk for e in page] + vus
+        self.assertEqual(page.number, 1)
+        self.assertEqual(vus, self.attendus()[:40])
+
+    def test_derniere_page(self):
+        premiere = paginer_par_curseur(self.catalogue(), None, par_page=10)
+        derniere = paginer_par_curseur(self.catalogue(), premiere.curseur_dernier, par_page=10)
+        self.assertEqual(derniere.number, 5)
+        self.assertFalse(derniere.has_next())
+        self.assertEqual([e.pk for e in derniere], self.attendus()[40:])
+        avant_derniere = paginer_par_curseur(self.catalogue(), derniere.curseur_precedent, par_page=10)
+        self.assertEqual([e.pk for e in avant_derniere], self.attendus()[30:40])
+
+    def test_cout_constant_et_total_en_cache(self):
+        with self.assertNumQueries(2):  # COUNT puis la page
+            page = paginer_par_curseur(self.catalogue(), None, par_page=5)
+        with self.assertNumQueries(1):  # total en cache
+            paginer_par_curseur(self.catalogue(), None, par_page=5)
+        for _ in range(6):
+            with self.assertNumQueries(1):  # ni COUNT ni OFFSET : total porté par le curseur
+                page = paginer_par_curseur(self.catalogue(), page.curseur_suivant, par_page=5)
+        with CaptureQueriesContext(connection) as requetes:
+            paginer_par_curseur(self.catalogue(), page.curseur_suivant, par_page=5)
+        self.assertNotIn('OFFSET', requetes[0]['sql'])
+
+        # Un élément modifié périme les totaux en cache
+        element = self.catalogue().first()
+        with self.captureOnCommitCallbacks(execute=True):
+            element.save()
+        with self.assertNumQueries(3):  # nouvelle génération relue, COUNT puis la page
+            paginer_par_curseur(self.catalogue(), None, par_page=5)
+
+    def test_curseur_invalide_ou_d_une_autre_liste(self):
+        page = paginer_par_curseur(self.catalogue(), None, par_page=10)
+        for curseur in ('nimporte:quoi', page.curseur_suivant[:-2] + 'xx'):
+            self.assertEqual(paginer_par_curseur(self.catalogue(), curseur, par_page=10).number, 1)
+        filtre = self.catalogue().filter(numero='N1')
+        self.assertEqual(paginer_par_curseur(filtre, page.curseur_suivant, par_page=10).number, 1)
+
+    def test_ordre_par_pertinence(self):
+        Element.objects.filter(pk__in=self.attendus()[:25]).update(designation='Bride pleine')
+        Element.objects.filter(pk__in=self.attendus()[:3]).update(caracteristiques='Bride bride')
+        resultats = rechercher_elements(self.catalogue(), 'bride pleine')
+        vus, page = [], paginer_par_curseur(resultats, None, par_page=4)
+        while True:
+            vus += [e.pk for e in page]
+            if not page.has_next():
+                break
+            page = paginer_par_curseur(resultats, page.curseur_suivant, par_page=4)
+        self.assertEqual(vus, [e.pk for e in resultats])
+        self.assertEqual(len(vus), 25)
+
+    def test_vue_item_selection(self):
+        session = self.client.session
+        session['projet_id'] = creer_projet().id
+        session.save()
+        url = reverse('item_selection', args=[self.categorie.id])
+        reponse = self.client.get(url)
+        page = reponse.context['elements']
+        self.assertEqual((page.number, page.num_pages), (1, 3))
+        self.assertContains(reponse, 'Page 1 sur 3')
+        reponse = self.client.get(url, {'curseur': page.curseur_suivant})
+        self.assertEqual([e.pk for e in reponse.context['elements']], self.attendus()[20:40])
+
+
+class SuggestionsCatalogueTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.tuyauterie, cls.categories = creer_referentiel()
+        cls.electricite = Discipline.objects.create(nom='Électricité', code='ELE')
+        materiel = cls.categories['materiel']
+        cls.coude_90 = Element.objects.create(
+            numero='TUY-050-90', designation='Coude 90° inox DN50', prix_unitaire=10,
+            unite=cls.unite, categorie=materiel, discipline=cls.tuyauterie)
+        cls.coude_45 = Element.objects.create(
+            numero='TUY-050-45', designation='Coude 45° acier DN50', prix_unitaire=10,
+            unite=cls.unite, categorie=materiel, discipline=cls.tuyauterie)
+        cls.reduction = Element.objects.create(
+            numero='TUY-080', designation='Réduction concentrique', prix_unitaire=10,
+            unite=cls.unite, categorie=materiel, discipline=cls.tuyauterie)
+        cls.cable = Element.objects.create(
+            numero='ELE-3G25', designation='Câble cuivre 3G2.5', prix_unitaire=10,
+            unite=cls.unite, categorie=materiel, discipline=cls.electricite)
+        cls.pose = Element.objects.create(
+            numero='MO-COU', designation='Pose de coude', prix_unitaire=10,
+            unite=cls.unite, categorie=cls.categories['main_oeuvre'], discipline=cls.tuyauterie)
+
+    def setUp(self):
+        invalider_catalogue()  # nouvelle génération du catalogue : l'index est reconstruit
+
+    def ids(self, texte, **kwargs):
+        return {element_id for element_id, _, _ in index_prefixes.completer(texte, **kwargs)}
+
+    def test_prefixes_numero_et_designation(self):
+        materiel = self.categories['materiel'].pk
+        self.assertEqual(self.ids('cou', categorie_id=materiel), {self.coude_90.pk, self.coude_45.pk})
+        self.assertEqual(self.ids('coude 4', categorie_id=materiel), {self.coude_45.pk})
+        self.assertEqual(self.ids('REDUC', categorie_id=materiel), {self.reduction.pk})
+        self.assertEqual(self.ids('tuy-050', categorie_id=materiel), {self.coude_90.pk, self.coude_45.pk})
+        self.assertEqual(self.ids('cou'), {self.coude_90.pk, self.coude_45.pk, self.pose.pk})
+        self.assertEqual(self.ids('vanne'), set())
+        self.assertEqual(self.ids(' ,; '), set())
+
+    def test_portee_discipline_limite_et_actifs(self):
+        materiel = self.categories['materiel'].pk
+        self.assertEqual(self.ids('cu', categorie_id=materiel, discipline_id=self.electricite.pk), {self.cable.pk})
+        self.assertEqual(len(index_prefixes.completer('c', categorie_id=materiel, limite=2)), 2)
+        Element.objects.filter(pk=self.coude_45.pk).update(actif=False)
+        invalider_catalogue()
+        self.assertEqual(self.ids('coude', categorie_id=materiel), {self.coude_90.pk})
+
+    def test_sans_requete_et_reconstruit_au_changement(self):
+        self.ids('coude')
+        with self.assertNumQueries(0):
+            self.ids('coude')
+        with self.captureOnCommitCallbacks(execute=True):
+            vanne = Element.objects.create(
+                numero='TUY-V', designation='Vanne à boisseau', prix_unitaire=1, unite=self.unite,
+                categorie=self.categories['materiel'], discipline=self.tuyauterie)
+        self.assertEqual(self.ids('vanne boi'), {vanne.pk})
+
+    def test_modification_dans_un_autre_processus(self):
+        materiel = self.categories['materiel'].pk
+        self.ids('coude')
+        # Autre processus : pas de signal ici, seule la génération en base avance
+        Element.objects.filter(pk=self.coude_45.pk).update(actif=False)
+        CompteurVersion.objects.update_or_create(nom='catalogue', defaults={'valeur': time.time_ns()})
+        with self.settings(ESTIMATION_CATALOGUE_VERIFICATION=0):
+            self.assertEqual(self.ids('coude', categorie_id=materiel), {self.coude_90.pk})
+
+        # Opération groupée sans nouvelle génération : reconstruit au bout de la durée de vie
+        Element.objects.filter(pk=self.coude_45.pk).update(actif=True)
+        with mock.patch.object(index_prefixes, 'duree_vie', 0):
+            self.assertEqual(self.ids('coude', categorie_id=materiel), {self.coude_90.pk, self.coude_45.pk})
+
+    def test_vue_json_compacte(self):
+        reponse = self.client.get(reverse('ajax_elements_suggest'),
+                                  {'q': 'coude 9', 'categorie': self.categories['materiel'].pk})
+        self.assertEqual(reponse.content.decode(),
+                         f'{{"q":"coude 9","r":[[{self.coude_90.pk},"TUY-050-90","Coude 90° inox DN50"]]}}'
+                         .replace('°', '\\u00b0'))
+        data = self.client.get(reverse('ajax_elements_suggest'), {'q': 'pose', 'categorie': 'x'}).json()
+        self.assertEqual(data['r'], [[self.pose.pk, 'MO-COU', 'Pose de coude']])
+
+
+class RechercheGlobaleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.tuyauterie, cls.categories = creer_referentiel()
+        cls.electricite = Discipline.objects.create(nom='Électricité', code='ELE', couleur='#ff0000')
+        materiel, main_oeuvre = cls.categories['materiel'], cls.categories['main_oeuvre']
+
+        def creer(designation, categorie, discipline, actif=True):
+            return Element.objects.create(designation=designation, prix_unitaire=10, unite=cls.unite,
+                                          categorie=categorie, discipline=discipline, actif=actif)
+
+        cls.coudes = [creer(f'Coude inox DN{dn}', materiel, cls.tuyauterie) for dn in (15, 25, 50, 80)]
+        cls.coude_elec = creer('Coude pour chemin de câble', materiel, cls.electricite)
+        cls.pose = creer('Pose de coude', main_oeuvre, cls.tuyauterie)
+        creer('Coude retiré', materiel, cls.tuyauterie, actif=False)
+        creer('Bride plate', materiel, cls.tuyauterie)
+
+    def setUp(self):
+        session = self.client.session
+        session['projet_id'] = creer_projet().id
+        session.save()
+
+    def facettes(self, **kwargs):
+        trouves = rechercher_elements(Element.objects.filter(actif=True), 'coude')
+        resultat = compter_facettes(trouves, **kwargs)
+        return ({f['nom']: f['nb'] for f in resultat['categories']},
+                {f['nom']: f['nb'] for f in resultat['disciplines']})
+
+    def test_facettes_en_une_requete(self):
+        materiel, main_oeuvre = self.categories['materiel'], self.categories['main_oeuvre']
+        with self.assertNumQueries(1):
+            categories, disciplines = self.facettes()
+        self.assertEqual(categories, {materiel.nom: 5, main_oeuvre.nom: 1})
+        self.assertEqual(disciplines, {'Tuyauterie': 5, 'Électricité': 1})
+        # Chaque axe ignore son propre filtre
+        categories, disciplines = self.facettes(discipline_id=self.electricite.pk)
+        self.assertEqual(categories, {materiel.nom: 1})
+        self.assertEqual(disciplines, {'Tuyauterie': 5, 'Électricité': 1})
+        categories, disciplines = self.facettes(categorie_id=main_oeuvre.pk)
+        self.assertEqual(categories, {materiel.nom: 5, main_oeuvre.nom: 1})
+        self.assertEqual(disciplines, {'Tuyauterie': 1})
+
+    def test_meilleurs_par_categorie(self):
+        trouves = rechercher_elements(Element.objects.filter(actif=True), 'coude inox')
+        with self.assertNumQueries(2):
+            groupes = meilleurs_par_categorie(trouves, 2)
+        self.assertEqual(groupes, {self.categories['materiel'].pk: list(trouves[:2])})
+        groupes = meilleurs_par_categorie(Element.objects.filter(actif=True), 3)
+        self.assertEqual([len(elements) for elements in groupes.values()], [3, 1])
+
+    def test_vue_groupee(self):
+        with self.assertNumQueries(5):  # session, projet, facettes, ids classés, éléments retenus
+            reponse = self.client.get(reverse('recherche_globale'), {'q': 'coude'})
+        self.assertEqual(reponse.context['nb_resultats'], 6)
+        groupes = reponse.context['groupes']
+        self.assertEqual([facette['id'] for facette, _ in groupes],
+                         [self.categories['materiel'].pk, self.categories['main_oeuvre'].pk])
+        self.assertEqual(len(groupes[0][1]), 5)
+        self.assertEqual(groupes[1][1], [self.pose])
+        self.assertContains(reponse, 'Pose de coude')
+        self.assertNotContains(reponse, 'Coude retiré')
+
+    def test_vue_filtree_et_paginee(self):
+        reponse = self.client.get(reverse('recherche_globale'), {
+            'q': 'coude', 'categorie': self.categories['materiel'].pk, 'discipline': self.tuyauterie.pk})
+        self.assertEqual(list(reponse.context['page']), self.coudes)
+        self.assertNotIn('groupes', reponse.context)
+        self.assertEqual(len(reponse.context['facettes_disciplines']), 2)
+
+    def test_sans_saisie(self):
+        reponse = self.client.get(reverse('recherche_globale'))
+        self.assertEqual(reponse.status_code, 200)
+        self.assertNotIn('facettes_categories', reponse.context)
+
+
+@override_settings(ESTIMATION_REFERENTIEL_VERIFICATION=60)
+class ReferentielTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        cls.metre = Unite.objects.create(code='ml', libelle='Mètre linéaire', symbole='ml')
+        cls.mo_tuyauterie = Categorie.objects.create(nom="Main d'œuvre Tuyauterie", type_categorie='main_oeuvre',
+                                                     code='MO-TUY')
+
+    def setUp(self):
+        Categorie.objects.get(pk=self.mo_tuyauterie.pk).save()  # oublie l'instantané des autres tests
+
+    def test_charge_une_fois(self):
+        with self.assertNumQueries(4):  # version + 3 tables
+            ref = referentiel()
+        with self.assertNumQueries(0):
+            self.assertIs(referentiel(), ref)
+
+    def test_acces_types(self):
+        ref = referentiel()
+        materiel = self.categories['materiel']
+        self.assertEqual(ref.categorie(materiel.pk), materiel)
+        self.assertEqual(ref.categorie(str(materiel.pk)), materiel)
+        self.assertIsNone(ref.categorie('x'))
+        self.assertEqual(ref.categorie_par_code('MATERIEL'), materiel)
+        self.assertEqual(ref.categories_de_type('main_oeuvre'), [self.categories['main_oeuvre'], self.mo_tuyauterie])
+        self.assertEqual(ref.categorie_de_type('main_oeuvre'), self.categories['main_oeuvre'])
+        self.assertEqual(ref.categorie_main_oeuvre_tuyauterie(), self.mo_tuyauterie)
+        self.assertEqual(list(ref.categories_groupees()), ['Matériel', "Main d'œuvre", 'Transport', 'Étude'])
+        self.assertEqual(ref.discipline_par_code('TUY'), self.discipline)
+        self.assertEqual(ref.unite_par_code('ml'), self.metre)
+        self.assertEqual(ref.unite_par_code('m3'), self.unite)  # repli sur 'u'
+        self.assertEqual(ref.unites, [self.metre, self.unite])  # ordre du modèle (libellé)
+
+    def test_invalide_par_signal(self):
+        ref = referentiel()
+        version = CompteurVersion.lire('referentiel')
+        self.metre.libelle = 'Mètre'
+        self.metre.save()
+        self.assertEqual(CompteurVersion.lire('referentiel'), version + 1)
+        self.assertIsNot(referentiel(), ref)
+        self.assertEqual(referentiel().unite_par_code('ml').libelle, 'Mètre')
+        self.discipline.delete()
+        self.assertIsNone(referentiel().discipline_par_code('TUY'))
+
+    def test_modification_d_un_autre_processus(self):
+        ref = referentiel()
+        # Sans signal (autre processus) : seul le compteur en base a changé
+        Categorie.objects.filter(pk=self.mo_tuyauterie.pk).update(nom='MO tuyauterie')
+        CompteurVersion.incrementer('referentiel')
+        self.assertIs(referentiel(), ref)  # pas encore vérifié
+        with self.settings(ESTIMATION_REFERENTIEL_VERIFICATION=0):
+            self.assertEqual(referentiel().categorie(self.mo_tuyauterie.pk).nom, 'MO tuyauterie')
+            with self.assertNumQueries(1):  # version inchangée : pas de rechargement
+                referentiel()
+
+    def test_vues_sans_requete_de_reference(self):
+        projet = creer_projet()
+        session = self.client.session
+        session['projet_id'] = projet.id
+        session.save()
+        referentiel()
+        with self.assertNumQueries(3):  # session, projet, client du projet (gabarit)
+            reponse = self.client.get(reverse('category_selection'))
+        self.assertContains(reponse, "Main d&#x27;œuvre Tuyauterie")
+
+        url = reverse('item_selection', args=[self.categories['materiel'].pk])
+        with CaptureQueriesContext(connection) as requetes:
+            self.client.post(url, {'nouveau_element': '1', 'confirmer_demande': '1',
+                                   'designation_personnalisee': 'Vanne', 'discipline_personnalisee': self.discipline.pk,
+                                   'unite_personnalisee': 'ml', 'quantite_personnalisee': '2'})
+        self.assertEqual(DemandeElement.objects.get(projet=projet).unite, self.metre)
+        tables = ' '.join(requete['sql'] for requete in requetes.captured_queries)
+        for table in ('estimation_categorie', 'estimation_unite', 'estimation_discipline"'):
+            self.assertNotIn(f'FROM "{table}', tables)
+        self.assertEqual(self.client.get(reverse('item_selection', args=[9999])).status_code, 404)
+
+
+
+
+class DonneesSynthetiquesTests(MediaTemporaireMixin, TestCase):
+    PARAMETRES = dict(graine=7, clients=2, projets_par_client=2, elements=300, lignes_par_projet=40,
+                      demandes_par_projet=6, sessions_par_projet=2)
+
+    def instantane(self):
+        return (
+            list(Element.objects.filter(numero__startswith='SYN-').order_by('numero')
+                 .values_list('numero', 'designation', 'prix_unitaire', 'actif', 'categorie__code')),
+            list(EstimationElement.objects.filter(projet__nom__startswith='SYN-')
+                 .order_by('projet__nom', 'element__numero')
+                 .values_list('projet__nom', 'element__numero', 'quantite', 'prix_unitaire_fixe')),
+            list(DemandeElement.objects.order_by('projet__nom', 'designation')
+                 .values_list('designation', 'statut', 'prix_unitaire_admin')),
+            list(SessionSablage.objects.order_by('projet__nom', 'cout_total').values_list('cout_total', 'valide')),
+        )
+
+    def test_generation_reproductible_et_purge(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            crees = generer(**self.PARAMETRES)
+        self.assertEqual(crees, {'clients': 2, 'projets': 4, 'elements': 300, 'lignes': 160,
+                                 'demandes': 24, 'sessions_sablage': 8})
+        premier = self.instantane()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertGreater(purger(), 300)
+        self.assertFalse(Element.objects.filter(numero__startswith='SYN-').exists())
+        self.assertFalse(Projet.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            generer(**self.PARAMETRES)
+        self.assertEqual(self.instantane(), premier)
+
+    def test_resumes_calcules(self):
+        generer(**self.PARAMETRES)
+        for projet in Projet.objects.all():
+            summary = EstimationSummary.objects.get(projet=projet)
+            self.assertEqual(summary.totaux, totaux_reference(projet))
+            self.assertTrue(summary.est_a_jour(projet))
+
+    def test_commande_benchmark(self):
+        call_command('generer_donnees', graine=3, clients=1, projets_par_client=1, elements=200, lignes=30,
+                     demandes=4, sessions=1, stdout=StringIO())
+        sortie = StringIO()
+        call_command('benchmark_vues', repetitions=1, stdout=sortie)
+        rapport = json.loads(sortie.getvalue())
+
+        self.assertEqual(rapport['projet']['lignes'], 30)
+        self.assertEqual(set(rapport['scenarios']) - set(scenarios_benchmark(Projet.objects.get(), 1)), set())
+        for nom, mesure in rapport['scenarios'].items():
+            self.assertIn(mesure['statut'], (200, None), nom)
+            self.assertGreaterEqual(mesure['duree_ms']['mediane'], 0)
+            self.assertGreater(mesure['memoire_pic_ko'], 0, nom)
+        self.assertGreater(rapport['scenarios']['rapport_projet']['requetes'], 0)
+        self.assertGreater(rapport['scenarios']['export_pdf_reportlab']['octets'], 0)
+
+
+class BudgetRequetesTests(MediaTemporaireMixin, TestCase):
+    """Chaque URL fait le même nombre de requêtes SQL quelle que soit la taille du projet.
+
+    Deux projets (petit et gros : lignes, demandes, sessions de sablage et
+    calculs de sablage en cours proportionnels) ; chaque URL est appelée sur
+    les deux et les nombres de requêtes doivent être égaux. En cas d'échec,
+    les requêtes dont le nombre grandit avec le projet sont affichées.
+    """
+    TAILLES = (3, 24)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.unite, cls.discipline, cls.categories = creer_referentiel()
+        cls.projets = {taille: cls.creer_projet(taille) for taille in cls.TAILLES}
+
+    @classmethod
+    def creer_projet(cls, taille):
+        projet = creer_projet(f'Projet {taille} lignes')
+        projet.client.set_password('secret')
+        projet.client.save()
+        cats = list(cls.categories.values())
+        with recalculs_groupes(executer=False):
+            remplir_projet(projet, taille, cls.unite, cls.discipline, cls.categories)
+            statuts = ['approuve', 'en_attente', 'approuve', 'rejete']
+            DemandeElement.objects.bulk_create([
+                DemandeElement(projet=projet, categorie=cats[i % len(cats)], discipline=cls.discipline,
+                               designation=f'Demande {i}', unite=cls.unite, quantite=2,
+                               statut=statuts[i % len(statuts)],
+                               prix_unitaire_admin=Decimal('12.00') if statuts[i % len(statuts)] == 'approuve' else None)
+                for i in range(taille)
+            ])
+            for i in range(taille // 3):
+                calcul = CalculSablage.objects.create(projet=projet, type_piece='tube', diametre_dn=50, quantite=4,
+                                                      surface_unitaire=Decimal('0.2'), surface_totale=Decimal('0.8'))
+                session = SessionSablage.objects.create(projet=projet, surface_globale=Decimal('0.8'),
+                                                        cout_total=Decimal('4000.00'), valide=True)
+                session.calculs.add(calcul)
+        recalculer_projet(projet.id)
+        return projet
+
+    def connecter(self, projet, taille):
+        session = self.client.session
+        session['client_id'] = projet.client_id
+        session['client_nom'] = projet.client.nom
+        session['projet_id'] = projet.id
+        session['elements_sablage'] = [
+            {'type_piece': 'tube', 'nom_type_piece': 'Tube', 'dn': 50, 'nom_dn': 'DN 50', 'quantite': 2.0,
+             'surface_unitaire': 0.2, 'surface_totale': 0.4}
+            for _ in range(taille // 3)
+        ]
+        session.save()
+
+    def cas(self, projet):
+        """``{nom d'URL: (méthode, args, données)}`` ; les POST ne modifient rien d'essentiel."""
+        categorie = self.categories['materiel'].id
+        ligne = EstimationElement.objects.filter(projet=projet).order_by('id').first()
+        demande = DemandeElement.objects.filter(projet=projet, statut='en_attente').first()
+        quantites = json.dumps({'changements': [{'element_id': ligne.element_id, 'quantite': '3'}]})
+        return {
+            'client_login': ('get', [], None),
+            'client_register': ('get', [], None),
+            'client_logout': ('get', [], None),
+            'client_profile': ('get', [], None),
+            'client_change_password': ('get', [], None),
+            'index': ('get', [], None),
+            'project_selection': ('get', [], None),
+            'category_selection': ('get', [], None),
+            'item_selection': ('get', [categorie], None),
+            'recherche_globale': ('get', [], {'q': 'élément'}),
+            'rapport_projet': ('get', [projet.id], None),
+            'ajax_update_quantity': ('post', [], json.dumps({'element_id': ligne.element_id, 'quantite': '3'})),
+            'ajax_update_quantities': ('post', [], quantites),
+            'ajax_elements_similaires': ('get', [], {'q': 'element'}),
+            'ajax_elements_suggest': ('get', [], {'q': 'elem'}),
+            'ajax_scenarios_tva': ('get', [projet.id], {'tva': '0,18', 'marge': '0,5'}),
+            'demandes_personnalisees': ('get', [], None),
+            'supprimer_demande': ('post', [demande.id], None),
+            'export_pdf': ('get', [projet.id], None),
+            'export_excel': ('get', [projet.id], None),
+            'export_csv': ('get', [projet.id], None),
+            'export_lancer': ('post', [projet.id, 'csv'], None),
+            'export_statut': ('get', [self.tache_export(projet)], None),
+            'export_telecharger': ('get', [self.tache_export(projet)], None),
+            'export_lignes_projet': ('get', [projet.id, 'csv'], None),
+            'export_lignes': ('get', ['ndjson'], {'projet': projet.id}),
+            'sablage_tuyauterie': ('get', [self.categories['main_oeuvre'].id], None),
+            'ajax_calculer_surface_sablage': ('post', [], json.dumps({'type_piece': 'tube', 'dn': 50, 'quantite': 2})),
+            'supprimer_projet': ('post', [projet.id], None),
+        }
+
+    def tache_export(self, projet):
+        """Export PDF terminé, lancé depuis la session du client de test."""
+        tache = enfiler_export(projet, 'pdf', self.client.session.get('elements_sablage', []))
+        reservee = reserver_tache(tache.pk)
+        if reservee is not None:
+            executer_tache(reservee)
+        session = self.client.session
+        session['taches_export'] = [tache.pk]
+        session.save()
+        return tache.pk
+
+    def requetes(self, taille, nom):
+        projet = self.projets[taille]
+        self.connecter(projet, taille)
+        methode, args, donnees = self.cas(projet)[nom]
+        url = reverse(nom, args=args)
+        # Un rapport en cache masquerait les requêtes de sa construction
+        cache.delete(cle_cache_rapport(Projet.objects.get(pk=projet.pk)))
+        with CaptureQueriesContext(connection) as capture:
+            if methode == 'post' and isinstance(donnees, str):
+                reponse = self.client.post(url, donnees, content_type='application/json')
+            else:
+                reponse = getattr(self.client, methode)(url, donnees)
+            if reponse.streaming:
+                b''.join(reponse.streaming_content)
+        self.assertLess(reponse.status_code, 500, nom)
+        return [requete['sql'] for requete in capture.captured_queries]
+
+    @staticmethod
+    def forme(sql):
+        """SQL sans valeurs littérales : deux requêtes de même forme ne diffèrent que par leurs paramètres."""
+        sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+        sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+        # Listes IN (...) et VALUES (...), (...) : même forme quelle que soit leur longueur
+        return re.sub(r'\((?:\?, )*\?\)(?:, \((?:\?, )*\?\))*', '(?)', sql)
+
+    def test_toutes_les_urls_ont_un_budget(self):
+        noms = {motif.name for motif in urlpatterns if motif.name}
+        self.assertEqual(noms, set(self.cas(self.projets[self.TAILLES[0]])))
+
+    def test_requetes_constantes(self):
+        petit, gros = self.TAILLES
+        for nom in self.cas(self.projets[petit]):
+            with self.subTest(url=nom):
+                # Chaque appel dans sa propre transaction : les POST ne se voient pas.
+                # Le premier de chaque taille chauffe les caches (référentiel, index en
+                # mémoire, sessions, exports sur disque).
+                mesures = {}
+                for taille in (petit, petit, gros, gros):
+                    with transaction.atomic():
+                        mesures[taille] = self.requetes(taille, nom)
+                        transaction.set_rollback(True)
+                avant, apres = mesures[petit], mesures[gros]
+                if len(apres) != len(avant):
+                    formes_avant = Counter(map(self.forme, avant))
+                    formes_apres = Counter(map(self.forme, apres))
+                    en_trop = '\n'.join(f'  {nb} × {forme}' for forme, nb in (formes_apres - formes_avant).items())
+                    self.fail(f"{nom} : {len(avant)} requêtes pour {petit} lignes, {len(apres)} pour {gros} ; "
+                              f"requêtes qui grandissent avec le projet :\n{en_trop}")
+
+
+class ProfilageTests(TestCase):
+    def setUp(self):
+        creer_referentiel()
+        self.projet = creer_projet()
+        self.staff = User.objects.create_user('admin', password='secret', is_staff=True, is_superuser=True)
+        journal.vider()
+        self.addCleanup(journal.vider)
+
+    def connecter_client(self):
+        session = self.client.session
+        session['client_id'] = self.projet.client_id
+        session['projet_id'] = self.projet.id
+        session.save()
+
+    def test_inactif_par_defaut(self):
+        self.connecter_client()
+        reponse = self.client.get(reverse('category_selection'), HTTP_X_PROFILAGE='1')
+        self.assertNotIn('Server-Timing', reponse)  # en-tête ignoré hors staff
+        self.assertEqual(journal.profils(), [])
+
+    @override_settings(ESTIMATION_PROFILAGE=True)
+    def test_mesures_de_la_requete(self):
+        self.connecter_client()
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.client.get(reverse('category_selection'))
+        [profil] = journal.profils()
+        self.assertEqual(profil.vue, 'category_selection')
+        self.assertEqual(profil.statut, 200)
+        self.assertEqual(profil.taille, len(reponse.content))
+        self.assertEqual(profil.nb_requetes, len(requetes.captured_queries))
+        self.assertEqual(len(profil.requetes), profil.nb_requetes)
+        self.assertIsNone(profil.cprofile)
+        self.assertEqual(reponse['X-Profilage-Id'], str(profil.id))
+        self.assertIn('db;dur=', reponse['Server-Timing'])
+
+    def test_en_tete_du_staff_et_cprofile(self):
+        self.client.force_login(self.staff)
+        self.connecter_client()
+        self.client.get(reverse('category_selection'), HTTP_X_PROFILAGE='cprofile')
+        [profil] = journal.profils()
+        self.assertIn('cumulative', profil.cprofile)
+
+    def test_doublons(self):
+        enregistreur = EnregistreurSql()
+        with connection.execute_wrapper(enregistreur):
+            for _ in range(3):
+                list(Projet.objects.filter(pk=self.projet.pk))
+            list(Projet.objects.filter(pk=self.projet.pk + 1))
+        self.assertEqual((enregistreur.nombre, enregistreur.doublons), (4, 2))
+
+    def test_journal_garde_les_plus_lents(self):
+        journal_test = JournalProfilage(taille=3)
+        for duree in (5, 50, 1, 30, 20, 2):
+            profil = mock.Mock(duree_ms=duree, id=duree)
+            journal_test.ajouter(profil)
+        self.assertEqual([profil.duree_ms for profil in journal_test.profils()], [50, 30, 20])
+
+    @override_settings(ESTIMATION_PROFILAGE=True)
+    def test_page_admin(self):
+        self.connecter_client()
+        self.client.get(reverse('category_selection'))
+        [profil] = journal.profils()
+
+        self.assertEqual(self.client.get(reverse('admin_profilage')).status_code, 302)  # pas staff
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(reverse('admin_profilage')), 'category_selection')
+        reponse = self.client.get(reverse('admin_profilage_detail', args=[profil.id]))
+        self.assertContains(reponse, 'estimation_categorie')
+
+        self.client.post(reverse('admin_profilage'), {'vider': '1'})
+        self.assertEqual(self.client.get(reverse('admin_profilage_detail', args=[profil.id])).status_code, 404)
+
+@skipUnless(connection.vendor == 'sqlite', "plans d'exécution propres à SQLite")
+class IndexRequetesTests(TestCase):
+    """Les requêtes fréquentes passent par leur index, sans tri à part."""
+
+    def setUp(self):
+        self.unite, self.discipline, self.categories = creer_referentiel()
+        self.projet = creer_projet()
+        self.categorie = self.categories['materiel']
+
+    def assertIndex(self, queryset, index, tri=False):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index}', plan)
+        if not tri:
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_catalogue_dans_l_ordre_de_l_index(self):
+        elements = Element.objects.filter(categorie=self.categorie, actif=True)
+        self.assertIndex(elements.order_by('numero', 'designation', 'id')[:21], 'element_actif_cat_ordre_idx')
+        self.assertIndex(elements.filter(discipline=self.discipline).order_by('numero', 'designation', 'id')[:21],
+                         'element_actif_cat_disc_idx')
+
+    def test_requetes_du_projet(self):
+        self.assertIndex(EstimationElement.objects.filter(projet=self.projet).values_list('element_id', flat=True),
+                         'ligne_projet_element_idx')
+        self.assertIndex(DemandeElement.objects.filter(projet=self.projet, categorie=self.categorie)
+                         .order_by('-date_demande'), 'demande_projet_cat_date_idx')
+        self.assertIndex(DemandeElement.objects.filter(projet=self.projet, statut='approuve',
+                                                       prix_unitaire_admin__isnull=False),
+                         'demande_projet_statut_prix_idx', tri=True)  # tri de Meta.ordering
+        self.assertIndex(SessionSablage.objects.filter(projet=self.projet, valide=True).order_by(),
+                         'sablage_projet_valide_idx')
+
+    def test_index_complets_sans_index_partiels(self):
+        # Comme sous MySQL : booléens comparés (« actif = 1 »), conditions des index partiels inutilisables
+        with mock.patch.object(connection.ops, 'conditional_expression_supported_in_where_clause',
+                               return_value=False):
+            elements = Element.objects.filter(categorie=self.categorie, actif=True)
+            self.assertIndex(elements.order_by('numero', 'designation', 'id')[:21], 'element_cat_actif_ordre_idx')
+            self.assertIndex(elements.filter(discipline=self.discipline).order_by('numero', 'designation', 'id')[:21],
+                             'element_cat_disc_actif_idx')
+            self.assertIndex(SessionSablage.objects.filter(projet=self.projet, valide=True).order_by(),
+                             'sablage_projet_valide_cmp_idx')
+
+@skipUnless(os.environ.get('ESTIMATION_BENCHMARK'), "benchmark : définir ESTIMATION_BENCHMARK=1")
+class RechercheCatalogueBenchmark(TestCase):
+    """Catalogue synthétique de 100 000 éléments : FTS5 contre LIKE '%...%'."""
+
+    NB_ELEMENTS = 100_000
+
+    @classmethod
+    def setUpTestData(cls):
+        unite, discipline, categories = creer_referentiel()
+        hasard = random.Random(1)
+        objets = ['Coude', 'Tube', 'Bride', 'Vanne', 'Câble', 'Té', 'Réduction', 'Manchon', 'Pompe']
+        matieres = ['inox', 'acier noir', 'galvanisé', 'PVC', 'PEHD', 'cuivre', 'fonte']
+        cats = list(categories.values())
+        Element.objects.bulk_create((
+            Element(numero=f'E{i:06d}',
+                    designation=f'{hasard.choice(objets)} {hasard.choice(["45°", "90°", ""])} '
+                                f'{hasard.choice(matieres)} DN{hasard.choice([15, 25, 50, 80, 100])}',
+                    caracteristiques=f'PN{hasard.choice([10, 16, 40])} - {hasard.choice(matieres)}',
+                    prix_unitaire=1, unite=unite, categorie=cats[i % len(cats)], discipline=discipline)
+            for i in range(cls.NB_ELEMENTS)
+        ), batch_size=5000)
+        cls.categorie = cats[0]
+
+    def mesurer(self, fonction, repetitions=20):
+        durees = []
+        for _ in range(repetitions):
+            debut = time.perf_counter()
+            fonction()
+            durees.append(time.perf_counter() - debut)
+        return sorted(durees)[len(durees) // 2] * 1000
+
+    def test_recherche_par_index(self):
+        elements = Element.objects.filter(categorie=self.categorie, actif=True)
+        for texte in ('coude 90 inox DN50', 'tube', 'electrique'):
+            fts = self.mesurer(lambda: list(rechercher_elements(elements, texte)[:20]))
+            like = self.mesurer(lambda: list(elements.filter(
+                Q(designation__icontains=texte) | Q(caracteristiques__icontains=texte))[:20]))
+            print(f"\n{texte!r} : FTS5 {fts:.1f} ms, LIKE {like:.1f} ms (médianes, 20 premiers)")
+            self.assertLess(fts, 100)
+
+    def test_recherche_approximative(self):
+        index = IndexTrigrammes()
+        debut = time.perf_counter()
+        index.rechercher('x')
+        print(f"\nIndex de trigrammes : construit en {time.perf_counter() - debut:.1f} s")
+        for texte in ('reduc conc', 'coud inoxx dn50', 'vane'):
+            duree = self.mesurer(lambda: index.rechercher(texte, k=10))
+            print(f"{texte!r} : {duree:.1f} ms (médiane, 10 meilleurs)")
+            self.assertLess(duree, 200)
+
+    def test_pagination_profonde(self):
+        from django.core.paginator import Paginator
+        elements = Element.objects.filter(categorie=self.categorie, actif=True)
+        curseurs = {1: None}
+        page = paginer_par_curseur(elements)
+        while page.number < 500:
+            curseurs[page.number + 1] = page.curseur_suivant
+            page = paginer_par_curseur(elements, page.curseur_suivant)
+        for numero in (1, 500):
+            keyset = self.mesurer(lambda: list(paginer_par_curseur(elements, curseurs[numero])))
+            offset = self.mesurer(lambda: list(Paginator(elements, 20).page(numero)))
+            print(f"\nPage {numero} : curseur {keyset:.1f} ms, OFFSET + COUNT {offset:.1f} ms (médianes)")
+            self.assertLess(keyset, 50)
+
+    def test_suggestions_p99(self):
+        url = reverse('ajax_elements_suggest')
+        hasard = random.Random(2)
+        mots = ['c', 'co', 'cou', 'coude', 'tu', 'tube 9', 'brid', 'vanne in', 'reduc', 'pe', 'dn5', 'e00', 'e0123']
+        self.client.get(url, {'q': 'x'})  # construction de l'index
+        durees = []
+        for _ in range(1000):
+            parametres = {'q': hasard.choice(mots), 'categorie': self.categorie.pk}
+            debut = time.perf_counter()
+            self.assertEqual(self.client.get(url, parametres).status_code, 200)
+            durees.append(time.perf_counter() - debut)
+        durees.sort()
+        p50, p99 = durees[500] * 1000, durees[990] * 1000
+        print(f"\nSuggestions : p50 {p50:.2f} ms, p99 {p99:.2f} ms (1000 requêtes, vue complète)")
+        self.assertLess(p99, 10)
+
+    def test_recherche_globale(self):
+        elements = Element.objects.filter(actif=True)
+        for texte in ('coude inox', 'tube'):
+            trouves = rechercher_elements(elements, texte)
+            facettes = self.mesurer(lambda: compter_facettes(trouves), repetitions=10)
+            groupes = self.mesurer(lambda: meilleurs_par_categorie(trouves, 5), repetitions=10)
+            print(f"\n{texte!r} : facettes {facettes:.1f} ms, 5 meilleurs par catégorie {groupes:.1f} ms")
+            self.assertLess(facettes + groupes, 500)
@@ -0,0 +1,202 @@
+# estimation/trigrammes.py
+"""Index de trigrammes en mémoire pour la recherche approximative du catalogue.
+
+Tolère fautes de frappe, accents et abréviations (« reduc conc » trouve
+« Réduction concentrique ») là où la recherche plein texte exige des mots
+exacts ou des préfixes.
+
+L'index est construit au premier usage dans chaque processus, tenu à jour par
+les signaux de sauvegarde/suppression d'``Element`` et reconstruit au bout de
+``DUREE_VIE`` secondes (modifications faites par d'autres processus ou par des
+opérations groupées sans signaux).
+
+Listes inversées ``trigramme -> array('I')`` d'ids : ~4 octets par occurrence.
+"""
+import math
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+DUREE_VIE = 600
+SEUIL = 0.35
+# Candidats re-classés par similarité avec la désignation, par résultat demandé
+FACTEUR_RECLASSEMENT = 5
+# Coût relatif d'une recherche par bisection face au comptage d'un id en C
+COUT_BISECTION = 8
+
+
+def normaliser(texte):
+    """Minuscules, sans accents ni ponctuation."""
+    texte = unicodedata.normalize('NFKD', (texte or '').lower())
+    texte = ''.join(c for c in texte if not unicodedata.combining(c))
+    return ' '.join(re.split(r'[\W_]+', texte)).strip()
+
+
+def trigrammes(texte):
+    """Trigrammes des mots de ``texte`` (normalisé), bordés comme pg_trgm : « ··mot· »."""
+    resultat = set()
+    for mot in normaliser(texte).split():
+        mot = f'  {mot} '
+        resultat.update(mot[i:i + 3] for i in range(len(mot) - 2))
+    return resultat
+
+
+class IndexTrigrammes:
+
+    def __init__(self, charger=None, duree_vie=DUREE_VIE):
+        self._charger = charger or _charger_elements
+        self.duree_vie = duree_vie
+        self._verrou = threading.RLock()
+        self._listes = {}    # trigramme -> array('I') d'ids, triée
+        self._elements = {}  # id -> (désignation normalisée, caractéristiques normalisées, categorie_id, actif)
+        self._construit_le = None
+
+    # --- construction / mise à jour ---
+
+    def construire(self):
+        listes, elements = {}, {}
+        for element_id, designation, caracteristiques, categorie_id, actif in self._charger():
+            entree = (normaliser(designation), normaliser(caracteristiques), categorie_id, actif)
+            elements[element_id] = entree
+            for trigramme in self._trigrammes_indexes(entree):
+                liste = listes.get(trigramme)
+                if liste is None:
+                    liste = listes[trigramme] = array('I')
+                liste.append(element_id)  # chargement par id croissant : listes triées
+        with self._verrou:
+            self._listes, self._elements = listes, elements
+            self._construit_le = time.monotonic()
+
+    @staticmethod
+    def _trigrammes_indexes(entree):
+        return trigrammes(f'{entree[0]} {entree[1]}')
+
+    def _assurer_construit(self):
+        if self._construit_le is None or time.monotonic() - self._construit_le > self.duree_vie:
+            with self._verrou:
+                if self._construit_le is None or time.monotonic() - self._construit_le > self.duree_vie:
+                    self.construire()
+
+    def mettre_a_jour(self, element):
+        """Réindexe un élément (signal post_save) ; sans effet si l'index n'est pas construit."""
+        with self._verrou:
+            if self._construit_le is None:
+                return
+            self._retirer(element.pk)
+            entree = (normaliser(element.designation), normaliser(element.caracteristiques),
+                      element.categorie_id, element.actif)
+            self._elements[element.pk] = entree
+            for trigramme in self._trigrammes_indexes(entree):
+                insort(self._listes.setdefault(trigramme, array('I')), element.pk)
+
+    def retirer(self, element_id):
+        with self._verrou:
+            if self._construit_le is not None:
+                self._retirer(element_id)
+
+    def _retirer(self, element_id):
+        ancien = self._elements.pop(element_id, None)
+        if ancien is None:
+            return
+        for trigramme in self._trigrammes_indexes(ancien):
+            liste = self._listes.get(trigramme)
+            if liste and _contient(liste, element_id):
+                del liste[bisect_left(liste, element_id)]
+
+    def invalider(self):
+        with self._verrou:
+            self._construit_le = None
+            self._listes, self._elements = {}, {}
+
+    # --- recherche ---
+
+    def rechercher(self, texte, k=10, seuil=SEUIL, categorie_id=None, actifs_seulement=True):
+        """``[(element_id, similarite)]`` des ``k`` éléments les plus proches de ``texte``.
+
+        La similarité est la part des trigrammes de la saisie présents dans
+        l'élément (désignation + caractéristiques), départagée par la
+        ressemblance avec la désignation seule.
+        """
+        requete = trigrammes(texte)
+        if not requete:
+            return []
+        self._assurer_construit()
+        minimum = max(1, math.ceil(seuil * len(requete)))
+
+        with self._verrou:
+            listes = sorted((self._listes.get(trigramme, ()) for trigramme in requete), key=len)
+            # Filtrage par préfixe : un élément qui atteint le seuil figure forcément
+            # dans l'une des listes les plus rares, qui donnent les candidats
+            nb_rares = len(listes) - minimum + 1
+            communs = Counter()
+            for liste in listes[:nb_rares]:
+                communs.update(liste)
+            retenus = set(communs)
+            # Listes fréquentes : bisection pour chaque candidat s'ils sont peu
+            # nombreux, sinon comptage complet (les non-candidats n'y atteignent
+            # jamais le seuil)
+            frequentes = listes[nb_rares:]
+            for rang, liste in enumerate(frequentes):
+                if len(retenus) * COUT_BISECTION >= len(liste):
+                    communs.update(liste)
+                    continue
+                restantes = len(frequentes) - rang
+                for element_id in list(retenus):
+                    if _contient(liste, element_id):
+                        communs[element_id] += 1
+                    elif communs[element_id] + restantes - 1 < minimum:
+                        retenus.discard(element_id)
+
+            # Par nombre de trigrammes communs décroissant, jusqu'à avoir assez
+            # de candidats à re-classer
+            paliers = defaultdict(list)
+            for element_id in retenus:
+                paliers[communs[element_id]].append(element_id)
+            voulus = k * FACTEUR_RECLASSEMENT
+            candidats = []
+            for nb in range(len(requete), minimum - 1, -1):
+                for element_id in sorted(paliers.get(nb, ())):
+                    designation, _, categorie, actif = self._elements[element_id]
+                    if (categorie_id is not None and categorie != categorie_id) or (actifs_seulement and not actif):
+                        continue
+                    candidats.append((nb, element_id, designation))
+                if len(candidats) >= voulus:
+                    break
+
+        resultats = []
+        for nb, element_id, designation in candidats[:voulus]:
+            trigrammes_designation = trigrammes(designation)
+            jaccard = len(requete & trigrammes_designation) / len(requete | trigrammes_designation)
+            resultats.append((nb / len(requete), jaccard, element_id))
+        resultats.sort(key=lambda r: (-r[0], -r[1], r[2]))
+        return [(element_id, round(similarite, 3)) for similarite, _, element_id in resultats[:k]]
+
+
+def _contient(liste, element_id):
+    i = bisect_left(liste, element_id)
+    return i < len(liste) and liste[i] == element_id
+
+
+def _charger_elements():
+    from .models import Element
+    return (Element.objects
+            .order_by('id')
+            .values_list('id', 'designation', 'caracteristiques', 'categorie_id', 'actif')
+            .iterator(chunk_size=5000))
+
+
+index_catalogue = IndexTrigrammes()
+
+
+def elements_similaires(texte, k=10, seuil=SEUIL, categorie=None):
+    """Éléments actifs du catalogue proches de ``texte`` : ``[(element, similarite)]``."""
+    from .models import Element
+
+    trouves = index_catalogue.rechercher(texte, k=k, seuil=seuil,
+                                         categorie_id=getattr(categorie, 'pk', categorie))
+    elements = Element.objects.select_related('unite', 'discipline').in_bulk([i for i, _ in trouves])
+    return [(elements[i], similarite) for i, similarite in trouves if i in elements]
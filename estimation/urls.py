@@ -15,14 +15,25 @@ urlpatterns = [
     path('projets/', views.project_selection, name='project_selection'),
     path('categories/', views.category_selection, name='category_selection'),
     path('elements/<int:categorie_id>/', views.item_selection, name='item_selection'),
+    path('recherche/', views.recherche_globale, name='recherche_globale'),
     path('rapport/<int:projet_id>/', views.rapport_projet, name='rapport_projet'),
     path('ajax/update-quantity/', views.ajax_update_quantity, name='ajax_update_quantity'),
+    path('ajax/update-quantities/', views.ajax_update_quantities, name='ajax_update_quantities'),
+    path('ajax/elements/similaires/', views.ajax_elements_similaires, name='ajax_elements_similaires'),
+    path('ajax/elements/suggest/', views.ajax_elements_suggest, name='ajax_elements_suggest'),
+    path('ajax/rapport/<int:projet_id>/scenarios/', views.ajax_scenarios_tva, name='ajax_scenarios_tva'),
 
     # Nouvelles URLs pour les éléments personnalisés
     path('demandes-personnalisees/', views.demandes_personnalisees, name='demandes_personnalisees'),
     path('supprimer-demande/<int:demande_id>/', views.supprimer_demande, name='supprimer_demande'),
     path('export-pdf/<int:projet_id>/', views.export_pdf_reportlab, name='export_pdf'),
     path('export-excel/<int:projet_id>/', views.export_excel_advanced, name='export_excel'),
+    path('export-csv/<int:projet_id>/', views.export_csv, name='export_csv'),
+    path('exports/<int:projet_id>/<str:format>/', views.export_lancer, name='export_lancer'),
+    path('exports/taches/<int:tache_id>/', views.export_statut, name='export_statut'),
+    path('exports/taches/<int:tache_id>/telecharger/', views.export_telecharger, name='export_telecharger'),
+    path('exports/<int:projet_id>/lignes.<str:format>', views.export_lignes_projet, name='export_lignes_projet'),
+    path('exports/lignes.<str:format>', views.export_lignes, name='export_lignes'),
 
     path('sablage-tuyauterie/<int:categorie_id>/', views.sablage_tuyauterie, name='sablage_tuyauterie'),
     path('ajax/calculer-surface-sablage/', views.ajax_calculer_surface_sablage, name='ajax_calculer_surface_sablage'),
@@ -1,17 +1,28 @@
 # estimation/views.py
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.contrib import messages
 from django.db.models import Q, Sum
-from django.core.paginator import Paginator
+from django.db import transaction
+from django.views.decorators.http import require_POST
 from .models import *
+from . import cache_exports
+from .pagination import paginer_par_curseur
+from .recalcul import recalculs_groupes
+from .rapport import DESIGNATION_SABLAGE, PERSONNALISE, TEMPORAIRE, rapport_en_cache
+from .recherche import compter_facettes, meilleurs_par_categorie, rechercher_elements
+from .referentiel import referentiel
+from .selection import mettre_a_jour_quantites, synchroniser_selection
+from .suggestions import index_prefixes
+from .trigrammes import elements_similaires
+from decimal import Decimal
 import json
 
 
 def index(request):
     """Page d'accueil pour les clients"""
     projets_actifs = Projet.objects.filter(actif=True).count()
-    categories = Categorie.objects.all().count()
+    categories = len(referentiel().categories)
     elements = Element.objects.filter(actif=True).count()
 
     context = {
@@ -54,19 +65,11 @@ def category_selection(request):
         return redirect('project_selection')
 
     projet = get_object_or_404(Projet, id=projet_id)
-    categories = Categorie.objects.all()
-
-    # Grouper par type
-    categories_groupees = {}
-    for cat in categories:
-        type_cat = cat.get_type_categorie_display()
-        if type_cat not in categories_groupees:
-            categories_groupees[type_cat] = []
-        categories_groupees[type_cat].append(cat)
 
     context = {
         'projet': projet,
-        'categories_groupees': categories_groupees
+        # Groupées par type, depuis le cache des données de référence
+        'categories_groupees': referentiel().categories_groupees()
     }
 
     if request.method == 'POST':
@@ -80,7 +83,6 @@ def category_selection(request):
 # imports en haut du fichier views.py (ajoute Unite)
 from .models import Projet, Categorie, Discipline, Element, EstimationElement, EstimationSummary, DemandeElement, Unite
 from django.db.models import Q
-from django.core.paginator import Paginator
 from django.contrib import messages
 from django.shortcuts import get_object_or_404, redirect, render
 
@@ -91,7 +93,9 @@ def item_selection(request, categorie_id):
         return redirect('project_selection')
 
     projet = get_object_or_404(Projet, id=projet_id)
-    categorie = get_object_or_404(Categorie, id=categorie_id)
+    categorie = referentiel().categorie(categorie_id)
+    if categorie is None:
+        raise Http404("Catégorie introuvable")
 
     # Filtres
     search_query = request.GET.get('search', '')
@@ -102,19 +106,15 @@ def item_selection(request, categorie_id):
                 .filter(categorie=categorie, actif=True)
                 .select_related('discipline', 'unite'))
 
-    if search_query:
-        elements = elements.filter(
-            Q(designation__icontains=search_query) |
-            Q(caracteristiques__icontains=search_query)
-        )
-
     if discipline_id:
         elements = elements.filter(discipline_id=discipline_id)
 
-    # Pagination
-    paginator = Paginator(elements, 20)
-    page_number = request.GET.get('page')
-    page_elements = paginator.get_page(page_number)
+    # Index plein texte (numéro, désignation, caractéristiques), trié par pertinence
+    if search_query:
+        elements = rechercher_elements(elements, search_query)
+
+    # Pagination par curseur (keyset) : coût constant quelle que soit la page
+    page_elements = paginer_par_curseur(elements, request.GET.get('curseur'), par_page=20)
 
     # Éléments déjà sélectionnés
     elements_selectionnes = EstimationElement.objects.filter(
@@ -152,11 +152,31 @@ def item_selection(request, categorie_id):
             unite_code = request.POST.get('unite_personnalisee', 'u')  # ex: 'ml', 'm2', ...
             quantite = request.POST.get('quantite_personnalisee', 1)
 
-            if designation and discipline_id:
+            # Des éléments existants ressemblent à la demande : on les propose d'abord
+            suggestions = (elements_similaires(f'{designation} {caracteristiques}', k=5, categorie=categorie)
+                           if designation and 'confirmer_demande' not in request.POST else [])
+            if suggestions:
+                messages.warning(request, 'Des éléments existants ressemblent à votre demande : '
+                                          'vérifiez-les avant de l\'envoyer.')
+                context.update({
+                    'suggestions_similaires': suggestions,
+                    'demande_en_cours': {
+                        'designation': designation,
+                        'discipline_id': discipline_id,
+                        'caracteristiques': caracteristiques,
+                        'unite': unite_code,
+                        'quantite': quantite,
+                    },
+                })
+            elif designation and discipline_id:
                 try:
-                    discipline = get_object_or_404(Discipline, id=discipline_id)
+                    discipline = referentiel().discipline(discipline_id)
+                    if discipline is None:
+                        raise Http404("Discipline introuvable")
                     quantite_float = float(quantite) if quantite else 1.0
-                    unite_obj = Unite.objects.filter(code=unite_code).first() or Unite.objects.get(code='u')
+                    unite_obj = referentiel().unite_par_code(unite_code)  # repli sur 'u'
+                    if unite_obj is None:
+                        raise Unite.DoesNotExist
 
                     DemandeElement.objects.create(
                         projet=projet,
@@ -185,31 +205,23 @@ def item_selection(request, categorie_id):
 
             if element_ids:
                 try:
-                    EstimationElement.objects.filter(
-                        projet=projet,
-                        element__categorie=categorie
-                    ).delete()
-
-                    elements_ajoutes = 0
-                    for i, element_id in enumerate(element_ids):
-                        if element_id:
-                            element = Element.objects.get(id=element_id)
-                            quantite = float(quantites[i]) if quantites[i] else 1.0
-
-                            EstimationElement.objects.create(
-                                projet=projet,
-                                element=element,
-                                quantite=quantite
-                            )
-                            elements_ajoutes += 1
-
-                    summary, _ = EstimationSummary.objects.get_or_create(projet=projet)
-                    summary.calculer_totaux()
-
-                    messages.success(request, f'{elements_ajoutes} élément(s) ajouté(s) à votre estimation!')
+                    # Diff contre les lignes existantes : opérations groupées, un seul recalcul
+                    paires = [
+                        (element_id,
+                         _lire_quantite(quantites[i]) if i < len(quantites) and quantites[i] else Decimal('1'))
+                        for i, element_id in enumerate(element_ids) if element_id
+                    ]
+                    # Une ligne ignorée serait retirée par le diff : on refuse tout l'envoi
+                    if any(quantite is None for _, quantite in paires):
+                        messages.error(request, 'Quantité invalide : entrez un nombre positif pour chaque élément.')
+                        return render(request, 'client/item_selection.html', context)
+                    ajoutes, modifies, supprimes = synchroniser_selection(projet, categorie, paires)
+
+                    messages.success(request, f'{len(paires)} élément(s) dans votre estimation '
+                                              f'({ajoutes} ajouté(s), {modifies} modifié(s), {supprimes} retiré(s))!')
                     return redirect('category_selection')
 
-                except (Element.DoesNotExist, ValueError):
+                except (Element.DoesNotExist, ValueError, ArithmeticError):
                     messages.error(request, 'Erreur lors de l\'ajout des éléments. Veuillez réessayer.')
             else:
                 messages.warning(request, 'Aucun élément sélectionné.')
@@ -226,269 +238,242 @@ def rapport_projet(request, projet_id):
     """Génération du rapport final incluant les demandes personnalisées approuvées et le sablage"""
     projet = get_object_or_404(Projet, id=projet_id)
 
-    # --- Résumé des coûts : on (re)calcule TOUJOURS avant d'afficher ---
-    summary, _ = EstimationSummary.objects.get_or_create(projet=projet)  # Correction de la syntaxe
+    # Modèle du rapport (commun aux exports), en cache tant que le projet ne change pas ;
+    # le sablage en cours est affiché sans être compté (il n'est pas validé)
+    rapport = rapport_en_cache(projet).avec_sablage_temporaire(
+        request.session.get('elements_sablage', []), compter=False)
 
-    # Si tu veux permettre d'ajuster la TVA côté URL ?tva=18.0
-    tva_param = request.GET.get('tva')
-    if tva_param:
-        try:
-            summary.tva_taux = float(tva_param)
-        except ValueError:
-            pass  # ignore, on garde le taux existant
+    # Simulation d'un autre taux de TVA côté URL ?tva=18.0 : calcul pur, rien n'est enregistré
+    tva_taux = _lire_taux(request.GET.get('tva')) if request.GET.get('tva') else None
 
-    summary.calculer_totaux()
+    context = {
+        'projet': projet,
+        'rapport': rapport,
+        'financier': rapport.financier(tva_taux=tva_taux),
+    }
+    return render(request, 'client/rapport.html', context)
 
-    # --- Données d'affichage ---
-    # Éléments standards sélectionnés
-    elements_estimation = (
-        EstimationElement.objects
-        .filter(projet=projet)
-        .select_related('element', 'element__categorie', 'element__discipline')
-    )
 
-    # Demandes personnalisées approuvées
-    demandes_approuvees = (
-        DemandeElement.objects
-        .filter(
-            projet=projet,
-            statut='approuve',
-            prix_unitaire_admin__isnull=False
-        )
-        .select_related('categorie', 'discipline')
-    )
+def _lire_taux(valeur):
+    """Taux en % depuis un paramètre d'URL ; None si invalide."""
+    try:
+        taux = Decimal(valeur.replace(',', '.'))
+    except (ArithmeticError, AttributeError):
+        return None
+    return taux if taux.is_finite() and 0 <= taux <= 100 else None
 
-    # Récupérer les éléments de sablage depuis les sessions utilisateur
-    # (Alternative 1: depuis la session Django - pour les sessions en cours)
-    elements_sablage_session = []
 
-    # On peut récupérer les sessions de tous les utilisateurs pour ce projet
-    # ou implémenter un système de stockage persistant des calculs de sablage
+def _lire_taux_liste(valeur, defaut):
+    taux = [_lire_taux(v) for v in (valeur or '').split(',') if v.strip()]
+    return [t for t in taux if t is not None] or [defaut]
 
-    # Alternative 2: Identifier les éléments de sablage dans EstimationElement
-    # (éléments avec element=None et des caractéristiques spécifiques au sablage)
-    elements_sablage_estimation = elements_estimation.filter(
-        element__isnull=True,  # Pas d'élément standard associé
-        # On peut ajouter d'autres critères pour identifier le sablage
-        # Par exemple, si on stocke un flag dans les caractéristiques
-    )
 
-    # Alternative 3: Utiliser les modèles dédiés (si implémentés)
-    sessions_sablage = SessionSablage.objects.filter(projet=projet, valide=True)
-
-    # Grouper par catégorie (éléments standards + demandes approuvées + sablage)
-    elements_par_categorie = {}
-
-    # Traiter les éléments standards (non-sablage)
-    for elem in elements_estimation:
-        if elem.element and elem.element.categorie:
-            cat_nom = elem.element.categorie.nom
-            if cat_nom not in elements_par_categorie:
-                elements_par_categorie[cat_nom] = {
-                    'elements': [],
-                    'demandes_approuvees': [],
-                    'elements_sablage': [],
-                    'total': 0,
-                    'categorie': elem.element.categorie
-                }
-            elements_par_categorie[cat_nom]['elements'].append(elem)
-            elements_par_categorie[cat_nom]['total'] += elem.cout_total
+MAX_SCENARIOS = 500
 
-    # Traiter les éléments de sablage (EstimationElement sans element standard)
-    for elem_sablage in elements_sablage_estimation:
-        # Déterminer la catégorie (probablement "Main d'œuvre Tuyauterie")
-        cat_nom = "Main d'œuvre Tuyauterie"  # ou récupérer depuis un autre champ
 
-        if cat_nom not in elements_par_categorie:
-            # Récupérer la catégorie main d'œuvre tuyauterie
-            try:
-                categorie_mo = Categorie.objects.get(
-                    nom__icontains="tuyauterie",
-                    type_categorie="main_oeuvre"
-                )
-            except Categorie.DoesNotExist:
-                # Fallback: première catégorie main d'œuvre
-                categorie_mo = Categorie.objects.filter(type_categorie="main_oeuvre").first()
-
-            elements_par_categorie[cat_nom] = {
-                'elements': [],
-                'demandes_approuvees': [],
-                'elements_sablage': [],
-                'total': 0,
-                'categorie': categorie_mo
-            }
+def ajax_scenarios_tva(request, projet_id):
+    """Table de scénarios HT/TVA/TTC en un appel (ex. curseur de TVA côté client).
 
-        elements_par_categorie[cat_nom]['elements_sablage'].append(elem_sablage)
-        elements_par_categorie[cat_nom]['total'] += elem_sablage.cout_total
-
-    # Traiter les demandes personnalisées approuvées
-    for demande in demandes_approuvees:
-        if demande.categorie:
-            cat_nom = demande.categorie.nom
-            if cat_nom not in elements_par_categorie:
-                elements_par_categorie[cat_nom] = {
-                    'elements': [],
-                    'demandes_approuvees': [],
-                    'elements_sablage': [],
-                    'total': 0,
-                    'categorie': demande.categorie
-                }
-            elements_par_categorie[cat_nom]['demandes_approuvees'].append(demande)
-            elements_par_categorie[cat_nom]['total'] += demande.cout_total
+    ?tva=0,10,18&marge=0,5&remise=0 -> produit cartésien des taux.
+    Calcul pur à partir des totaux en base : aucune écriture.
+    """
+    projet = get_object_or_404(Projet, id=projet_id)
+    summary = EstimationSummary.obtenir_a_jour(projet)
+
+    tva = _lire_taux_liste(request.GET.get('tva'), summary.tva_taux)
+    marges = _lire_taux_liste(request.GET.get('marge'), Decimal('0'))
+    remises = _lire_taux_liste(request.GET.get('remise'), Decimal('0'))
+    if len(tva) * len(marges) * len(remises) > MAX_SCENARIOS:
+        return JsonResponse({'success': False, 'message': f'Maximum {MAX_SCENARIOS} scénarios par appel'},
+                            status=400)
+
+    scenarios = [
+        {cle: float(valeur) for cle, valeur in summary.simuler(t, m, r).items()}
+        for t in tva for m in marges for r in remises
+    ]
+    return JsonResponse({
+        'success': True,
+        'version': projet.version,
+        'totaux': {type_cat: float(montant) for type_cat, montant in summary.totaux.items()},
+        'tva_taux': float(summary.tva_taux),
+        'scenarios': scenarios,
+    })
 
-    # Si on utilise les sessions de sablage dédiées (Alternative 3)
 
-    # Décommenter si vous implémentez SessionSablage
-    for session in sessions_sablage:
-        cat_nom = "Main d'œuvre Tuyauterie"
+def ajax_update_quantity(request):
+    """Mise à jour AJAX d'une quantité (voir ajax_update_quantities pour la version groupée)"""
+    if request.method == 'POST':
+        data = json.loads(request.body)
+        element_id = data.get('element_id')
+        quantite = _lire_quantite(data.get('quantite'))
+        projet = Projet.objects.filter(id=request.session.get('projet_id')).first()
 
-        if cat_nom not in elements_par_categorie:
+        if element_id and quantite and projet:
             try:
-                categorie_mo = Categorie.objects.get(
-                    nom__icontains="tuyauterie",
-                    type_categorie="main_oeuvre"
-                )
-            except Categorie.DoesNotExist:
-                categorie_mo = Categorie.objects.filter(type_categorie="main_oeuvre").first()
-
-            elements_par_categorie[cat_nom] = {
-                'elements': [],
-                'demandes_approuvees': [],
-                'elements_sablage': [],
-                'sessions_sablage': [],
-                'total': 0,
-                'categorie': categorie_mo
-            }
+                totaux, _ = mettre_a_jour_quantites(projet, [(element_id, quantite)])
+            except ValueError:
+                return JsonResponse({'success': False})
+            if totaux:
+                return JsonResponse({
+                    'success': True,
+                    'nouveau_total': float(totaux[int(element_id)])
+                })
 
-        if 'sessions_sablage' not in elements_par_categorie[cat_nom]:
-            elements_par_categorie[cat_nom]['sessions_sablage'] = []
+    return JsonResponse({'success': False})
 
-        elements_par_categorie[cat_nom]['sessions_sablage'].append(session)
-        elements_par_categorie[cat_nom]['total'] += session.cout_total
 
+def ajax_elements_similaires(request):
+    """Éléments du catalogue proches d'une saisie (tolérant aux fautes et aux accents)"""
+    texte = request.GET.get('q', '')[:200]
+    categorie_id = request.GET.get('categorie')
+    categorie = int(categorie_id) if categorie_id and categorie_id.isdigit() else None
+    resultats = elements_similaires(texte, k=8, categorie=categorie) if len(texte.strip()) >= 3 else []
+    return JsonResponse({
+        'success': True,
+        'elements': [{
+            'id': element.id,
+            'numero': element.numero,
+            'designation': element.designation,
+            'caracteristiques': element.caracteristiques,
+            'prix_unitaire': float(element.prix_unitaire),
+            'unite': element.unite.symbole or element.unite.libelle,
+            'categorie_id': element.categorie_id,
+            'similarite': similarite,
+        } for element, similarite in resultats],
+    })
 
-    # Récupérer les éléments de sablage depuis les sessions actives
-    # (pour afficher les calculs en cours même non validés)
-    if hasattr(request, 'session') and 'elements_sablage' in request.session:
-        elements_sablage_temp = request.session.get('elements_sablage', [])
 
-        if elements_sablage_temp:
-            # Calculer le total temporaire
-            PRIX_SABLAGE_M2 = 5000  # Ou récupérer depuis la configuration
-            surface_globale_temp = sum(elem['surface_totale'] for elem in elements_sablage_temp)
-            prix_total_temp = surface_globale_temp * PRIX_SABLAGE_M2
+def _identifiant(valeur):
+    return int(valeur) if valeur and valeur.isdigit() else None
 
-            cat_nom = "Main d'œuvre Tuyauterie"
 
-            if cat_nom not in elements_par_categorie:
-                try:
-                    categorie_mo = Categorie.objects.get(
-                        nom__icontains="tuyauterie",
-                        type_categorie="main_oeuvre"
-                    )
-                except Categorie.DoesNotExist:
-                    categorie_mo = Categorie.objects.filter(type_categorie="main_oeuvre").first()
-
-                elements_par_categorie[cat_nom] = {
-                    'elements': [],
-                    'demandes_approuvees': [],
-                    'elements_sablage': [],
-                    'sablage_temporaire': None,
-                    'total': 0,
-                    'categorie': categorie_mo
-                }
+NB_RESULTATS_PAR_CATEGORIE = 5
 
-            # Ajouter les informations temporaires de sablage
-            elements_par_categorie[cat_nom]['sablage_temporaire'] = {
-                'elements': elements_sablage_temp,
-                'surface_globale': surface_globale_temp,
-                'prix_unitaire': PRIX_SABLAGE_M2,
-                'prix_total': prix_total_temp,
-                'nb_elements': len(elements_sablage_temp)
-            }
-            # Note: on n'ajoute pas au total car c'est temporaire
 
-    # Nombre total d'éléments (standards + demandes approuvées + sablage)
-    total_elements = (
-            elements_estimation.count() +
-            demandes_approuvees.count()
-    )
+def recherche_globale(request):
+    """Recherche dans tout le catalogue actif, résultats groupés par catégorie avec facettes"""
+    projet_id = request.session.get('projet_id')
+    if not projet_id:
+        return redirect('project_selection')
 
-    # Ajouter les éléments de sablage au compteur s'il y en a
-    for data in elements_par_categorie.values():
-        if 'elements_sablage' in data:
-            total_elements += len(data['elements_sablage'])
-        # Si on utilise sessions_sablage:
-        if 'sessions_sablage' in data:
-            total_elements += len(data['sessions_sablage'])
-
-    # Informations supplémentaires pour le template
-    # Calculer les totaux par type pour affichage
-    totaux_par_type = {
-        'materiel': 0,
-        'main_oeuvre': 0,
-        'transport': 0,
-        'etude': 0,
-        'sablage': 0  # Nouveau : total spécifique au sablage
+    projet = get_object_or_404(Projet, id=projet_id)
+    texte = request.GET.get('q', '').strip()[:200]
+    categorie_id = _identifiant(request.GET.get('categorie'))
+    discipline_id = _identifiant(request.GET.get('discipline'))
+
+    context = {
+        'projet': projet,
+        'q': texte,
+        'categorie_selectionnee': categorie_id,
+        'discipline_selectionnee': discipline_id,
     }
 
-    for cat_nom, data in elements_par_categorie.items():
-        if data['categorie']:
-            type_cat = data['categorie'].type_categorie
-            if type_cat in totaux_par_type:
-                totaux_par_type[type_cat] += data['total']
+    if texte:
+        trouves = rechercher_elements(Element.objects.filter(actif=True), texte)
+        # Facettes sur la recherche seule : une requête groupée pour les deux axes
+        facettes = compter_facettes(trouves, categorie_id, discipline_id)
 
-            # Calculer spécifiquement les totaux de sablage
-            if 'elements_sablage' in data and data['elements_sablage']:
-                totaux_par_type['sablage'] += sum(elem.cout_total for elem in data['elements_sablage'])
+        resultats = trouves.select_related('categorie', 'discipline', 'unite')
+        if discipline_id:
+            resultats = resultats.filter(discipline_id=discipline_id)
 
-            # Si temporaire
-            if 'sablage_temporaire' in data and data['sablage_temporaire']:
-                totaux_par_type['sablage'] += data['sablage_temporaire']['prix_total']
+        if categorie_id:
+            # Une catégorie choisie : liste complète, paginée par curseur
+            context['page'] = paginer_par_curseur(resultats.filter(categorie_id=categorie_id),
+                                                  request.GET.get('curseur'), par_page=20)
+        else:
+            # Sinon : les meilleurs résultats de chaque catégorie, dans l'ordre des facettes
+            meilleurs = meilleurs_par_categorie(resultats, NB_RESULTATS_PAR_CATEGORIE)
+            context['groupes'] = [(facette, meilleurs[facette['id']])
+                                  for facette in facettes['categories'] if facette['id'] in meilleurs]
+
+        context.update({
+            'facettes_categories': facettes['categories'],
+            'facettes_disciplines': facettes['disciplines'],
+            'nb_resultats': sum(facette['nb'] for facette in facettes['categories']),
+        })
+
+    return render(request, 'client/recherche_globale.html', context)
+
+
+def ajax_elements_suggest(request):
+    """Autocomplétion (numéro, désignation) depuis l'index de préfixes en mémoire, sans requête SQL.
+
+    Réponse compacte : ``{"q": ..., "r": [[id, numero, designation], ...]}``.
+    """
+    texte = request.GET.get('q', '')[:100]
+    suggestions = index_prefixes.completer(
+        texte,
+        categorie_id=_identifiant(request.GET.get('categorie')),
+        discipline_id=_identifiant(request.GET.get('discipline')),
+    )
+    return JsonResponse({'q': texte, 'r': suggestions}, json_dumps_params={'separators': (',', ':')})
 
-    context = {
-        'projet': projet,
-        'elements_par_categorie': elements_par_categorie,
-        'summary': summary,
-        'total_elements': total_elements,
-        'totaux_par_type': totaux_par_type,  # Nouveau pour affichage détaillé
-        'has_sablage': any(
-            'elements_sablage' in data and data['elements_sablage'] or
-            'sablage_temporaire' in data and data['sablage_temporaire']
-            for data in elements_par_categorie.values()
-        ),  # Flag pour conditions dans le template
-    }
 
-    return render(request, 'client/rapport.html', context)
-def ajax_update_quantity(request):
-    """Mise à jour AJAX des quantités"""
-    if request.method == 'POST':
-        data = json.loads(request.body)
-        element_id = data.get('element_id')
-        nouvelle_quantite = data.get('quantite')
-        projet_id = request.session.get('projet_id')
+MAX_CHANGEMENTS_QUANTITE = 1000
 
-        if element_id and nouvelle_quantite and projet_id:
-            try:
-                estimation_element = EstimationElement.objects.get(
-                    element_id=element_id,
-                    projet_id=projet_id
-                )
-                estimation_element.quantite = float(nouvelle_quantite)
-                estimation_element.save()
 
-                # Recalculer le résumé
-                summary = EstimationSummary.objects.get(projet_id=projet_id)
-                summary.calculer_totaux()
+def _lire_quantite(valeur):
+    """Quantité > 0 au centime (virgule acceptée) ; None si invalide."""
+    try:
+        quantite = Decimal(str(valeur).replace(',', '.'))
+    except ArithmeticError:
+        return None
+    if not quantite.is_finite() or not 0 < quantite < 10 ** 8:
+        return None
+    return quantite.quantize(Decimal('0.01'))
+
+
+def _resume_json(summary):
+    return {
+        'version': summary.version_calculee,
+        'cout_total_materiel': float(summary.cout_total_materiel),
+        'cout_total_main_oeuvre': float(summary.cout_total_main_oeuvre),
+        'cout_total_transport': float(summary.cout_total_transport),
+        'cout_total_etude': float(summary.cout_total_etude),
+        'cout_total_ht': float(summary.cout_total_ht),
+        'tva_taux': float(summary.tva_taux),
+        'tva_montant': float(summary.tva_montant),
+        'cout_total_ttc': float(summary.cout_total_ttc),
+    }
 
-                return JsonResponse({
-                    'success': True,
-                    'nouveau_total': float(estimation_element.cout_total)
-                })
-            except (EstimationElement.DoesNotExist, ValueError):
-                return JsonResponse({'success': False})
 
-    return JsonResponse({'success': False})
+@require_POST
+def ajax_update_quantities(request):
+    """Mise à jour AJAX groupée des quantités : un bulk_update et un seul recalcul.
+
+    Corps JSON : ``{"changements": [{"element_id": 12, "quantite": "3.5"}, ...]}``.
+    Répond avec le nouveau total de chaque ligne et le résumé à jour.
+    """
+    projet = Projet.objects.filter(id=request.session.get('projet_id')).first()
+    try:
+        changements = json.loads(request.body).get('changements')
+    except (ValueError, AttributeError):
+        changements = None
+    if projet is None or not isinstance(changements, list) or len(changements) > MAX_CHANGEMENTS_QUANTITE:
+        return JsonResponse({'success': False, 'error': 'Requête invalide'}, status=400)
+
+    paires, invalides = [], []
+    for changement in changements:
+        if not isinstance(changement, dict):
+            continue
+        element_id = changement.get('element_id')
+        quantite = _lire_quantite(changement.get('quantite'))
+        if str(element_id).isdigit() and quantite is not None:
+            paires.append((element_id, quantite))
+        else:
+            invalides.append(element_id)
+
+    totaux, inconnus = mettre_a_jour_quantites(projet, paires)
+    projet.refresh_from_db(fields=['version'])
+    summary = EstimationSummary.obtenir_a_jour(projet)
+    return JsonResponse({
+        'success': True,
+        'lignes': {str(element_id): float(total) for element_id, total in totaux.items()},
+        'inconnus': inconnus,
+        'invalides': invalides,
+        'summary': _resume_json(summary),
+    })
 
 
 # Ajoutez ces vues à votre fichier estimation/views.py
@@ -552,14 +537,43 @@ from openpyxl.drawing.image import Image as ExcelImage
 from PIL import Image as PILImage
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from django.urls import reverse
+from .export_excel import ecrire_excel_flux, ecriture_seule
+from . import export_lignes as export_lignes_flux
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import StreamingHttpResponse
+from .taches import enfiler_export, executer_tache, reserver_tache, taches_asynchrones
 from io import BytesIO
 import datetime
 
 
 # estimation/views.py - Corrections pour inclure le sablage temporaire dans les exports
 
+def nom_fichier_export(projet, format):
+    nom_fichier_securise = "".join(c for c in projet.nom if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    date_export = datetime.date.today()
+    suffixe = {
+        'pdf': f"{date_export}.pdf",
+        'excel': f"{date_export.strftime('%Y%m%d')}.xlsx",
+        'csv': f"{date_export.strftime('%Y%m%d')}.csv",
+    }[format]
+    return f"rapport_{nom_fichier_securise}_{suffixe}"
+
+
 def export_pdf_reportlab(request, projet_id):
-    """Export PDF avec sablage + colonnes Caractéristiques & Unité adaptées"""
+    """Export PDF, servi depuis le cache des exports tant que l'estimation ne change pas"""
+    projet = get_object_or_404(Projet, id=projet_id)
+    elements_sablage_temp = request.session.get('elements_sablage', [])
+    return cache_exports.servir(request, projet, 'pdf', nom_fichier_export(projet, 'pdf'),
+                                lambda sortie: ecrire_pdf(projet, elements_sablage_temp, sortie),
+                                elements_sablage_temp)
+
+
+def ecrire_pdf(projet, elements_sablage_temp, sortie, progression=None):
+    """Écrit le PDF du rapport (sablage + colonnes Caractéristiques & Unité adaptées) dans ``sortie``
+
+    ``progression(fait, total)`` est appelée pendant la mise en page (en éléments de mise en page).
+    """
     # --- Imports locaux (auto-contenu) ---
     import os, re, datetime
     from io import BytesIO
@@ -578,9 +592,6 @@ def export_pdf_reportlab(request, projet_id):
         SimpleDocTemplate, Paragraph, Table, TableStyle, Image, Spacer
     )
 
-    # --- Données projet ---
-    projet = get_object_or_404(Projet, id=projet_id)
-
     def format_caracteristiques(text, max_length=80):
         if not text or len(text) <= max_length:
             return text or '-'
@@ -616,106 +627,15 @@ def export_pdf_reportlab(request, projet_id):
     def unit_paragraph(text: str) -> Paragraph:
         return Paragraph(xml_escape(text or '-'), unit_para_style)
 
-    # --- Récupération données ---
-    elements_selections = EstimationElement.objects.filter(projet=projet).select_related(
-        'element', 'element__categorie', 'element__discipline'
-    )
-    demandes_approuvees = DemandeElement.objects.filter(projet=projet, statut='approuve')
-
-    elements_sablage_temp = request.session.get('elements_sablage', [])
-    PRIX_SABLAGE_M2 = 5000
-
-    elements_par_categorie = {}
-
-    for selection in elements_selections:
-        if selection.element:
-            cat_nom = selection.element.categorie.nom
-            if cat_nom not in elements_par_categorie:
-                elements_par_categorie[cat_nom] = {
-                    'categorie': selection.element.categorie,
-                    'elements': [], 'demandes_approuvees': [],
-                    'elements_sablage': [], 'total': 0
-                }
-            elements_par_categorie[cat_nom]['elements'].append(selection)
-            elements_par_categorie[cat_nom]['total'] += selection.cout_total
-        else:
-            cat_nom = "Main d'œuvre Tuyauterie"
-            if cat_nom not in elements_par_categorie:
-                try:
-                    categorie_mo = Categorie.objects.filter(type_categorie="main_oeuvre").first()
-                except Categorie.DoesNotExist:
-                    categorie_mo = type('TempCategorie', (), {
-                        'nom': "Main d'œuvre Tuyauterie", 'type_categorie': 'main_oeuvre'
-                    })()
-                elements_par_categorie[cat_nom] = {
-                    'categorie': categorie_mo,
-                    'elements': [], 'demandes_approuvees': [],
-                    'elements_sablage': [], 'total': 0
-                }
-            elements_par_categorie[cat_nom]['elements_sablage'].append(selection)
-            elements_par_categorie[cat_nom]['total'] += selection.cout_total
-
-    if elements_sablage_temp:
-        cat_nom = "Main d'œuvre Tuyauterie"
-        if cat_nom not in elements_par_categorie:
-            try:
-                categorie_mo = Categorie.objects.filter(type_categorie="main_oeuvre").first()
-            except Categorie.DoesNotExist:
-                categorie_mo = type('TempCategorie', (), {
-                    'nom': "Main d'œuvre Tuyauterie", 'type_categorie': 'main_oeuvre'
-                })()
-            elements_par_categorie[cat_nom] = {
-                'categorie': categorie_mo,
-                'elements': [], 'demandes_approuvees': [],
-                'elements_sablage': [], 'elements_sablage_temp': [], 'total': 0
-            }
-
-        surface_globale_temp = sum(elem['surface_totale'] for elem in elements_sablage_temp)
-        prix_total_temp = Decimal(str(surface_globale_temp * PRIX_SABLAGE_M2))
-        elements_par_categorie[cat_nom]['elements_sablage_temp'] = {
-            'elements': elements_sablage_temp,
-            'surface_globale': surface_globale_temp,
-            'prix_unitaire': PRIX_SABLAGE_M2,
-            'prix_total': prix_total_temp,
-            'nb_elements': len(elements_sablage_temp)
-        }
-        elements_par_categorie[cat_nom]['total'] += prix_total_temp
-
-    for demande in demandes_approuvees:
-        cat_nom = demande.categorie.nom
-        if cat_nom not in elements_par_categorie:
-            elements_par_categorie[cat_nom] = {
-                'categorie': demande.categorie,
-                'elements': [], 'demandes_approuvees': [],
-                'elements_sablage': [], 'total': 0
-            }
-        elements_par_categorie[cat_nom]['demandes_approuvees'].append(demande)
-        elements_par_categorie[cat_nom]['total'] += demande.cout_total
-
-    try:
-        summary = EstimationSummary.objects.get(projet=projet)
-        summary.calculer_totaux()
-        if elements_sablage_temp:
-            surface_globale_temp = sum(elem['surface_totale'] for elem in elements_sablage_temp)
-            prix_sablage_temp = Decimal(str(surface_globale_temp * PRIX_SABLAGE_M2))
-            summary.cout_total_main_oeuvre += prix_sablage_temp
-            summary.cout_total_ht += prix_sablage_temp
-            summary.tva_montant = summary.cout_total_ht * (summary.tva_taux / Decimal('100'))
-            summary.cout_total_ttc = summary.cout_total_ht + summary.tva_montant
-    except EstimationSummary.DoesNotExist:
-        summary = EstimationSummary.objects.create(projet=projet)
-        summary.calculer_totaux()
+    # --- Données : modèle du rapport (commun à la page et à l'Excel), sablage en cours compté ---
+    rapport = rapport_en_cache(projet).avec_sablage_temporaire(elements_sablage_temp)
+    financier = rapport.financier()
 
     # --- PDF ---
-    response = HttpResponse(content_type='application/pdf')
-    nom_fichier_securise = "".join(c for c in projet.nom if c.isalnum() or c in (' ', '-', '_')).rstrip()
-    response['Content-Disposition'] = f'attachment; filename="rapport_{nom_fichier_securise}_{datetime.date.today()}.pdf"'
-
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
+    doc = SimpleDocTemplate(sortie, pagesize=A4, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
     story = []
 
-    logo_path = os.path.join(settings.STATIC_ROOT or settings.BASE_DIR, 'static', 'img', 'logo.jpg')
+    logo_path = cache_exports.chemin_logo()
     if os.path.exists(logo_path):
         try:
             logo_img = Image(logo_path, width=2 * inch, height=1 * inch)
@@ -734,77 +654,50 @@ def export_pdf_reportlab(request, projet_id):
     story.append(Spacer(1, 20))
 
     # --- Tableaux par catégorie ---
-    for categorie_nom, data in elements_par_categorie.items():
-        story.append(Paragraph(f"{categorie_nom} - Total: {data['total']:,.2f} CFA", heading_style))
+    for section in rapport.sections:
+        categorie_nom = section.nom
+        story.append(Paragraph(f"{categorie_nom} - Total: {section.total:,.2f} CFA", heading_style))
 
         table_data = [['Désignation', 'Caractéristiques', 'Prix Unit.', 'Qté', 'Unité', 'Total']]
 
-        # Éléments standards
-        for element in data['elements']:
-            table_data.append([
-                element.designation,
-                caracs_paragraph(element.caracteristiques),
-                f"{element.prix_unitaire_utilise:,.2f}",
-                f"{element.quantite:,.2f}",
-                unit_paragraph(element.unite_display),    # <<< Paragraph + wrap
-                f"{element.cout_total:,.2f}"
-            ])
-
-        # Sablage validé
-        for element_sablage in data['elements_sablage']:
-            sablage_para = Paragraph(xml_escape(f"Surface: {element_sablage.quantite:.3f} m²"), carac_para_style)
-            table_data.append([
-                "Sablage Tuyauterie",
-                sablage_para,
-                f"{element_sablage.prix_unitaire_utilise:,.2f}",
-                f"{element_sablage.quantite:,.3f}",
-                unit_paragraph("m²"),
-                f"{element_sablage.cout_total:,.2f}"
-            ])
-
-        # Sablage temporaire
-        if data.get('elements_sablage_temp'):
-            sablage_temp = data['elements_sablage_temp']
-            elements_resume = [f"{e['nom_type_piece']} {e['nom_dn']} ({e['quantite']:g})" for e in sablage_temp['elements']]
-            resume_text = ", ".join(elements_resume)
-            if len(resume_text) > 80:
-                words = resume_text.split(', ')
-                lines, cur = [], ""
-                for w in words:
-                    if len(cur + w) <= 80: cur += ("" if not cur else ", ") + w
-                    else: lines.append(cur); cur = w
-                if cur: lines.append(cur)
-                resume_final = "<br/>".join(xml_escape(l) for l in lines)
+        for ligne in section.lignes:
+            if ligne.type == TEMPORAIRE:
+                sablage_temp = section.sablage_temporaire
+                elements_resume = [f"{e['nom_type_piece']} {e['nom_dn']} ({e['quantite']:g})" for e in sablage_temp['elements']]
+                resume_text = ", ".join(elements_resume)
+                if len(resume_text) > 80:
+                    words = resume_text.split(', ')
+                    lines, cur = [], ""
+                    for w in words:
+                        if len(cur + w) <= 80: cur += ("" if not cur else ", ") + w
+                        else: lines.append(cur); cur = w
+                    if cur: lines.append(cur)
+                    resume_final = "<br/>".join(xml_escape(l) for l in lines)
+                else:
+                    resume_final = xml_escape(resume_text)
+                caracteristiques = Paragraph(
+                    f"Surface: {sablage_temp['surface_globale']:.3f} m²<br/>Détail: {resume_final}",
+                    carac_para_style
+                )
+            elif ligne.est_sablage:
+                caracteristiques = Paragraph(xml_escape(f"Surface: {ligne.quantite:.3f} m²"), carac_para_style)
             else:
-                resume_final = xml_escape(resume_text)
+                caracteristiques = caracs_paragraph(ligne.caracteristiques)
 
-            sablage_temp_para = Paragraph(
-                f"Surface: {sablage_temp['surface_globale']:.3f} m²<br/>Détail: {resume_final}",
-                carac_para_style
-            )
             table_data.append([
-                "Sablage Tuyauterie",
-                sablage_temp_para,
-                f"{sablage_temp['prix_unitaire']:,.2f}",
-                f"{sablage_temp['surface_globale']:,.3f}",
-                unit_paragraph("m²"),
-                f"{sablage_temp['prix_total']:,.2f}"
-            ])
-
-        # Demandes perso
-        for demande in data['demandes_approuvees']:
-            table_data.append([
-                f"{demande.designation} (Personnalisé)",
-                caracs_paragraph(demande.caracteristiques),
-                f"{demande.prix_unitaire_admin:,.2f}",
-                f"{demande.quantite:,.2f}",
-                unit_paragraph(demande.get_unite_display()),
-                f"{demande.cout_total:,.2f}"
+                DESIGNATION_SABLAGE if ligne.est_sablage
+                else f"{ligne.designation} (Personnalisé)" if ligne.type == PERSONNALISE
+                else ligne.designation,
+                caracteristiques,
+                f"{ligne.prix_unitaire:,.2f}",
+                f"{ligne.quantite:,.3f}" if ligne.est_sablage else f"{ligne.quantite:,.2f}",
+                unit_paragraph(ligne.unite),    # <<< Paragraph + wrap
+                f"{ligne.total:,.2f}"
             ])
 
         # Largeurs : Unité plus large (évite le débordement)
         is_materiel = (
-            getattr(data['categorie'], 'type_categorie', '') == 'materiel' or
+            section.type_categorie == 'materiel' or
             'Matériel' in categorie_nom or 'Materiel' in categorie_nom
         )
         has_sablage = any('Sablage' in str(r[0]) for r in table_data[1:])
@@ -871,9 +764,9 @@ def export_pdf_reportlab(request, projet_id):
     # --- Résumé financier ---
     story.append(Paragraph("RÉSUMÉ FINANCIER", heading_style))
     financial_data = [
-        ['Sous-total HT', f"{summary.cout_total_ht:,.2f} CFA"],
-        [f"TVA ({summary.tva_taux}%)", f"{summary.tva_montant:,.2f} CFA"],
-        ['TOTAL TTC', f"{summary.cout_total_ttc:,.2f} CFA"],
+        ['Sous-total HT', f"{financier['cout_total_ht']:,.2f} CFA"],
+        [f"TVA ({financier['tva_taux']}%)", f"{financier['tva_montant']:,.2f} CFA"],
+        ['TOTAL TTC', f"{financier['cout_total_ttc']:,.2f} CFA"],
     ]
     financial_table = Table(financial_data, colWidths=[3 * inch, 2 * inch])
     financial_table.setStyle(TableStyle([
@@ -904,27 +797,47 @@ def export_pdf_reportlab(request, projet_id):
         f"{datetime.date.today().strftime('%d/%m/%Y')}</i>", styles['Normal']
     ))
 
-    # Build & réponse
+    if progression is not None:
+        etat = {'total': len(story)}
+
+        def suivre(type_evenement, valeur):
+            if type_evenement == 'SIZE_EST':
+                etat['total'] = valeur
+            elif type_evenement == 'PROGRESS':
+                progression(valeur, etat['total'])
+
+        doc.setProgressCallBack(suivre)
     doc.build(story)
-    pdf = buffer.getvalue()
-    buffer.close()
-    response.write(pdf)
-    return response
 
 
 def export_excel_advanced(request, projet_id):
-    """Export Excel avec sablage temporaire inclus"""
+    """Export Excel, servi depuis le cache des exports tant que l'estimation ne change pas"""
     projet = get_object_or_404(Projet, id=projet_id)
+    elements_sablage_temp = request.session.get('elements_sablage', [])
+    return cache_exports.servir(request, projet, 'excel', nom_fichier_export(projet, 'excel'),
+                                lambda sortie: ecrire_excel(projet, elements_sablage_temp, sortie),
+                                elements_sablage_temp)
 
-    # Récupérer les données
-    elements_selections = EstimationElement.objects.filter(projet=projet).select_related(
-        'element', 'element__categorie', 'element__discipline'
-    )
-    demandes_approuvees = DemandeElement.objects.filter(projet=projet, statut='approuve')
 
-    # NOUVEAU : Récupérer le sablage temporaire
-    elements_sablage_temp = request.session.get('elements_sablage', [])
-    PRIX_SABLAGE_M2 = 5000
+def ecrire_excel(projet, elements_sablage_temp, sortie, progression=None):
+    """Écrit le classeur Excel du rapport (sablage temporaire inclus) dans ``sortie``
+
+    Écriture seule, en flux (``export_excel``), à partir de ``ESTIMATION_EXCEL_SEUIL_FLUX``
+    lignes ; en dessous, classeur construit en mémoire.
+    ``progression(fait, total)`` est appelée à chaque ligne écrite.
+    """
+    # Modèle du rapport (commun à la page et au PDF), sablage en cours compté
+    rapport = rapport_en_cache(projet).avec_sablage_temporaire(elements_sablage_temp)
+    nb_lignes = sum(len(section.lignes) for section in rapport.sections)
+    ecrire = ecrire_excel_flux if ecriture_seule(nb_lignes) else ecrire_excel_classeur
+    ecrire(projet, rapport, elements_sablage_temp, sortie, progression)
+
+
+def ecrire_excel_classeur(projet, rapport, elements_sablage_temp, sortie, progression=None):
+    """Classeur Excel construit en mémoire (chaque cellule stylée), écrit dans ``sortie``"""
+    financier = rapport.financier()
+    nb_lignes = sum(len(section.lignes) for section in rapport.sections)
+    faites = 0
 
     wb = openpyxl.Workbook()
     ws = wb.active
@@ -944,7 +857,7 @@ def export_excel_advanced(request, projet_id):
     row = 1
 
     # Logo
-    logo_path = os.path.join(settings.STATIC_ROOT or settings.BASE_DIR, 'static', 'img', 'logo.jpg')
+    logo_path = cache_exports.chemin_logo()
     if os.path.exists(logo_path):
         try:
             with PILImage.open(logo_path) as pil_img:
@@ -997,65 +910,15 @@ def export_excel_advanced(request, projet_id):
     ws[f'A{row}'].font = Font(bold=True)
     row += 2
 
-    # Organiser par catégorie (même logique que PDF)
-    elements_par_categorie = {}
-
-    # Traiter éléments standards et sablage validé
-    for selection in elements_selections:
-        if selection.element:
-            cat_nom = selection.element.categorie.nom
-            if cat_nom not in elements_par_categorie:
-                elements_par_categorie[cat_nom] = {
-                    'elements': [], 'demandes_approuvees': [], 'elements_sablage': [], 'total': 0
-                }
-            elements_par_categorie[cat_nom]['elements'].append(selection)
-            elements_par_categorie[cat_nom]['total'] += selection.cout_total
-        else:
-            cat_nom = "Main d'œuvre Tuyauterie"
-            if cat_nom not in elements_par_categorie:
-                elements_par_categorie[cat_nom] = {
-                    'elements': [], 'demandes_approuvees': [], 'elements_sablage': [], 'total': 0
-                }
-            elements_par_categorie[cat_nom]['elements_sablage'].append(selection)
-            elements_par_categorie[cat_nom]['total'] += selection.cout_total
-
-    # NOUVEAU : Ajouter sablage temporaire
-    if elements_sablage_temp:
-        from decimal import Decimal
-        cat_nom = "Main d'œuvre Tuyauterie"
-        if cat_nom not in elements_par_categorie:
-            elements_par_categorie[cat_nom] = {
-                'elements': [], 'demandes_approuvees': [], 'elements_sablage': [],
-                'elements_sablage_temp': [], 'total': Decimal('0')
-            }
-
-        surface_globale_temp = sum(elem['surface_totale'] for elem in elements_sablage_temp)
-        prix_total_temp = Decimal(str(surface_globale_temp * PRIX_SABLAGE_M2))
-
-        elements_par_categorie[cat_nom]['elements_sablage_temp'] = {
-            'elements': elements_sablage_temp,
-            'surface_globale': surface_globale_temp,
-            'prix_unitaire': PRIX_SABLAGE_M2,
-            'prix_total': prix_total_temp,
-            'nb_elements': len(elements_sablage_temp)
-        }
-        elements_par_categorie[cat_nom]['total'] += prix_total_temp
-
-    # Ajouter demandes personnalisées
-    for demande in demandes_approuvees:
-        cat_nom = demande.categorie.nom
-        if cat_nom not in elements_par_categorie:
-            elements_par_categorie[cat_nom] = {
-                'elements': [], 'demandes_approuvees': [], 'elements_sablage': [], 'total': 0
-            }
-        elements_par_categorie[cat_nom]['demandes_approuvees'].append(demande)
-        elements_par_categorie[cat_nom]['total'] += demande.cout_total
+    sablage_fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
+    sablage_temp_fill = PatternFill(start_color="FFFACD", end_color="FFFACD", fill_type="solid")
+    perso_fill = PatternFill(start_color="D4EDDA", end_color="D4EDDA", fill_type="solid")
 
     # Données par catégorie
-    for categorie_nom, data in elements_par_categorie.items():
+    for section in rapport.sections:
         # Titre catégorie
         ws.merge_cells(f'A{row}:F{row}')
-        ws[f'A{row}'] = f"{categorie_nom} - Total: {data['total']:,.2f} CFA"
+        ws[f'A{row}'] = f"{section.nom} - Total: {section.total:,.2f} CFA"
         ws[f'A{row}'].font = category_font
         ws[f'A{row}'].alignment = center_alignment
         row += 1
@@ -1070,170 +933,55 @@ def export_excel_advanced(request, projet_id):
             cell.border = border
         row += 1
 
-        # Éléments standards
-        for element in data['elements']:
-            ws.cell(row=row, column=1, value=element.designation).border = border
-            ws.cell(row=row, column=2, value=element.caracteristiques or '-').border = border
-
-            prix_cell = ws.cell(row=row, column=3, value=float(element.prix_unitaire_utilise))
-            prix_cell.number_format = '#,##0.00'
-            prix_cell.alignment = right_alignment
-            prix_cell.border = border
-
-            qte_cell = ws.cell(row=row, column=4, value=float(element.quantite))
-            qte_cell.number_format = '#,##0.00'
-            qte_cell.alignment = right_alignment
-            qte_cell.border = border
-
-            ws.cell(row=row, column=5, value=element.unite_display).border = border
-
-            total_cell = ws.cell(row=row, column=6, value=float(element.cout_total))
-            total_cell.number_format = '#,##0.00'
-            total_cell.alignment = right_alignment
-            total_cell.border = border
-            total_cell.font = Font(bold=True)
-
-            row += 1
-
-        # Éléments sablage validés
-        for element_sablage in data['elements_sablage']:
-            sablage_fill = PatternFill(start_color="FFF3CD", end_color="FFF3CD", fill_type="solid")
-
-            designation_cell = ws.cell(row=row, column=1, value="Sablage Tuyauterie")
-            designation_cell.border = border
-            designation_cell.fill = sablage_fill
-
-            carac_cell = ws.cell(row=row, column=2, value=f"Surface: {element_sablage.quantite:.3f} m²")
-            carac_cell.border = border
-            carac_cell.fill = sablage_fill
-
-            prix_cell = ws.cell(row=row, column=3, value=float(element_sablage.prix_unitaire_utilise))
-            prix_cell.number_format = '#,##0.00'
-            prix_cell.alignment = right_alignment
-            prix_cell.border = border
-            prix_cell.fill = sablage_fill
-
-            qte_cell = ws.cell(row=row, column=4, value=float(element_sablage.quantite))
-            qte_cell.number_format = '#,##0.000'
-            qte_cell.alignment = right_alignment
-            qte_cell.border = border
-            qte_cell.fill = sablage_fill
-
-            unite_cell = ws.cell(row=row, column=5, value="m²")
-            unite_cell.border = border
-            unite_cell.fill = sablage_fill
-
-            total_cell = ws.cell(row=row, column=6, value=float(element_sablage.cout_total))
-            total_cell.number_format = '#,##0.00'
-            total_cell.alignment = right_alignment
-            total_cell.border = border
-            total_cell.font = Font(bold=True)
-            total_cell.fill = sablage_fill
-
-            row += 1
-
-        # NOUVEAU : Sablage temporaire
-        if 'elements_sablage_temp' in data and data['elements_sablage_temp']:
-            sablage_temp = data['elements_sablage_temp']
-            sablage_temp_fill = PatternFill(start_color="FFFACD", end_color="FFFACD", fill_type="solid")
-
-            # Créer résumé
-            elements_resume = []
-            for elem in sablage_temp['elements']:
-                elements_resume.append(f"{elem['nom_type_piece']} {elem['nom_dn']} ({elem['quantite']:g})")
-            resume_text = ", ".join(elements_resume)
-
-            designation_cell = ws.cell(row=row, column=1, value="Sablage Tuyauterie (Temporaire)")
-            designation_cell.border = border
-            designation_cell.fill = sablage_temp_fill
+        for ligne in section.lignes:
+            # Éléments standards, sablage validé, sablage en cours, éléments personnalisés
+            if ligne.type == TEMPORAIRE:
+                sablage_temp = section.sablage_temporaire
+                resume_text = ", ".join(f"{elem['nom_type_piece']} {elem['nom_dn']} ({elem['quantite']:g})"
+                                        for elem in sablage_temp['elements'])
+                valeurs = ["Sablage Tuyauterie (Temporaire)",
+                           f"Surface: {sablage_temp['surface_globale']:.3f} m² - {resume_text}"]
+                fill = sablage_temp_fill
+            elif ligne.est_sablage:
+                valeurs = [DESIGNATION_SABLAGE, f"Surface: {ligne.quantite:.3f} m²"]
+                fill = sablage_fill
+            elif ligne.type == PERSONNALISE:
+                valeurs = [f"{ligne.designation} (Personnalisé)", ligne.caracteristiques or '-']
+                fill = perso_fill
+            else:
+                valeurs = [ligne.designation, ligne.caracteristiques or '-']
+                fill = None
 
-            carac_cell = ws.cell(row=row, column=2,
-                                 value=f"Surface: {sablage_temp['surface_globale']:.3f} m² - {resume_text}")
-            carac_cell.border = border
-            carac_cell.fill = sablage_temp_fill
+            designation_cell = ws.cell(row=row, column=1, value=valeurs[0])
+            carac_cell = ws.cell(row=row, column=2, value=valeurs[1])
 
-            prix_cell = ws.cell(row=row, column=3, value=float(sablage_temp['prix_unitaire']))
+            prix_cell = ws.cell(row=row, column=3, value=float(ligne.prix_unitaire))
             prix_cell.number_format = '#,##0.00'
             prix_cell.alignment = right_alignment
-            prix_cell.border = border
-            prix_cell.fill = sablage_temp_fill
 
-            qte_cell = ws.cell(row=row, column=4, value=float(sablage_temp['surface_globale']))
-            qte_cell.number_format = '#,##0.000'
+            qte_cell = ws.cell(row=row, column=4, value=float(ligne.quantite))
+            qte_cell.number_format = '#,##0.000' if ligne.est_sablage else '#,##0.00'
             qte_cell.alignment = right_alignment
-            qte_cell.border = border
-            qte_cell.fill = sablage_temp_fill
 
-            unite_cell = ws.cell(row=row, column=5, value="m²")
-            unite_cell.border = border
-            unite_cell.fill = sablage_temp_fill
+            unite_cell = ws.cell(row=row, column=5, value=ligne.unite)
 
-            total_cell = ws.cell(row=row, column=6, value=float(sablage_temp['prix_total']))
+            total_cell = ws.cell(row=row, column=6, value=float(ligne.total))
             total_cell.number_format = '#,##0.00'
             total_cell.alignment = right_alignment
-            total_cell.border = border
             total_cell.font = Font(bold=True)
-            total_cell.fill = sablage_temp_fill
-
-            row += 1
-
-        # Éléments personnalisés
-        for demande in data['demandes_approuvees']:
-            perso_fill = PatternFill(start_color="D4EDDA", end_color="D4EDDA", fill_type="solid")
-
-            designation_cell = ws.cell(row=row, column=1, value=f"{demande.designation} (Personnalisé)")
-            designation_cell.border = border
-            designation_cell.fill = perso_fill
 
-            carac_cell = ws.cell(row=row, column=2, value=demande.caracteristiques or '-')
-            carac_cell.border = border
-            carac_cell.fill = perso_fill
-
-            prix_cell = ws.cell(row=row, column=3, value=float(demande.prix_unitaire_admin))
-            prix_cell.number_format = '#,##0.00'
-            prix_cell.alignment = right_alignment
-            prix_cell.border = border
-            prix_cell.fill = perso_fill
-
-            qte_cell = ws.cell(row=row, column=4, value=float(demande.quantite))
-            qte_cell.number_format = '#,##0.00'
-            qte_cell.alignment = right_alignment
-            qte_cell.border = border
-            qte_cell.fill = perso_fill
-
-            unite_cell = ws.cell(row=row, column=5, value=demande.get_unite_display())
-            unite_cell.border = border
-            unite_cell.fill = perso_fill
-
-            total_cell = ws.cell(row=row, column=6, value=float(demande.cout_total))
-            total_cell.number_format = '#,##0.00'
-            total_cell.alignment = right_alignment
-            total_cell.border = border
-            total_cell.font = Font(bold=True)
-            total_cell.fill = perso_fill
+            for cell in (designation_cell, carac_cell, prix_cell, qte_cell, unite_cell, total_cell):
+                cell.border = border
+                if fill is not None:
+                    cell.fill = fill
 
             row += 1
+            faites += 1
+            if progression is not None:
+                progression(faites, nb_lignes)
 
         row += 1
 
-    # Calcul du résumé incluant sablage temporaire
-    try:
-        summary = EstimationSummary.objects.get(projet=projet)
-        summary.calculer_totaux()
-
-        if elements_sablage_temp:
-            from decimal import Decimal
-            surface_globale_temp = sum(elem['surface_totale'] for elem in elements_sablage_temp)
-            prix_sablage_temp = Decimal(str(surface_globale_temp * PRIX_SABLAGE_M2))
-            summary.cout_total_main_oeuvre += prix_sablage_temp
-            summary.cout_total_ht += prix_sablage_temp
-            summary.tva_montant = summary.cout_total_ht * (summary.tva_taux / Decimal('100'))
-            summary.cout_total_ttc = summary.cout_total_ht + summary.tva_montant
-
-    except EstimationSummary.DoesNotExist:
-        summary = EstimationSummary.objects.create(projet=projet)
-        summary.calculer_totaux()
-
     # Résumé financier
     row += 1
     ws.merge_cells(f'A{row}:F{row}')
@@ -1245,16 +993,16 @@ def export_excel_advanced(request, projet_id):
     # Sous-total HT
     ws.cell(row=row, column=4, value="Sous-total HT:").font = Font(bold=True)
     ws.cell(row=row, column=4).alignment = right_alignment
-    total_ht_cell = ws.cell(row=row, column=6, value=float(summary.cout_total_ht))
+    total_ht_cell = ws.cell(row=row, column=6, value=float(financier['cout_total_ht']))
     total_ht_cell.number_format = '#,##0.00 "CFA"'
     total_ht_cell.alignment = right_alignment
     total_ht_cell.font = Font(bold=True)
     row += 1
 
     # TVA
-    ws.cell(row=row, column=4, value=f"TVA ({summary.tva_taux}%):").font = Font(bold=True)
+    ws.cell(row=row, column=4, value=f"TVA ({financier['tva_taux']}%):").font = Font(bold=True)
     ws.cell(row=row, column=4).alignment = right_alignment
-    tva_cell = ws.cell(row=row, column=6, value=float(summary.tva_montant))
+    tva_cell = ws.cell(row=row, column=6, value=float(financier['tva_montant']))
     tva_cell.number_format = '#,##0.00 "CFA"'
     tva_cell.alignment = right_alignment
     tva_cell.font = Font(bold=True)
@@ -1265,7 +1013,7 @@ def export_excel_advanced(request, projet_id):
     ws.cell(row=row, column=4).fill = PatternFill(start_color="667EEA", end_color="667EEA", fill_type="solid")
     ws.cell(row=row, column=4).alignment = right_alignment
 
-    total_ttc_cell = ws.cell(row=row, column=6, value=float(summary.cout_total_ttc))
+    total_ttc_cell = ws.cell(row=row, column=6, value=float(financier['cout_total_ttc']))
     total_ttc_cell.number_format = '#,##0.00 "CFA"'
     total_ttc_cell.alignment = right_alignment
     total_ttc_cell.font = Font(bold=True, color="FFFFFF")
@@ -1295,16 +1043,138 @@ def export_excel_advanced(request, projet_id):
     ws[f'A{row}'].font = Font(italic=True, size=10)
     ws[f'A{row}'].alignment = center_alignment
 
-    # Réponse
-    response = HttpResponse(
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-    )
-    nom_fichier_securise = "".join(c for c in projet.nom if c.isalnum() or c in (' ', '-', '_')).rstrip()
-    response[
-        'Content-Disposition'] = f'attachment; filename="rapport_{nom_fichier_securise}_{datetime.date.today().strftime("%Y%m%d")}.xlsx"'
+    wb.save(sortie)
+
+
+def export_csv(request, projet_id):
+    """Export CSV des lignes du rapport, servi depuis le cache des exports"""
+    projet = get_object_or_404(Projet, id=projet_id)
+    elements_sablage_temp = request.session.get('elements_sablage', [])
+    return cache_exports.servir(request, projet, 'csv', nom_fichier_export(projet, 'csv'),
+                                lambda sortie: ecrire_csv(projet, elements_sablage_temp, sortie),
+                                elements_sablage_temp)
+
+
+def ecrire_csv(projet, elements_sablage_temp, sortie, progression=None):
+    """Écrit les lignes du rapport dans ``sortie``, au format CSV de ``export_lignes`` (``;``, UTF-8 avec BOM)"""
+    rapport = rapport_en_cache(projet).avec_sablage_temporaire(elements_sablage_temp)
+    lignes = export_lignes_flux.lignes_du_rapport(projet, rapport, progression)
+    for morceau in export_lignes_flux.flux_csv(lignes):
+        sortie.write(morceau.encode('utf-8'))
+
+
+def export_lignes_projet(request, projet_id, format):
+    """Lignes chiffrées d'un projet, en flux (CSV ou NDJSON)"""
+    projet = get_object_or_404(Projet, id=projet_id)
+    nom = "".join(c for c in projet.nom if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return _reponse_lignes(Projet.objects.filter(pk=projet.pk), format, f"lignes_{nom}")
+
+
+@staff_member_required
+def export_lignes(request, format):
+    """Lignes chiffrées d'un ensemble de projets, en flux (CSV ou NDJSON)
+
+    Filtres (GET, combinables) : ``projet`` (id, répétable), ``client`` (id),
+    ``actif`` (1 ou 0), ``q`` (nom du projet), ``depuis`` (création, AAAA-MM-JJ).
+    """
+    projets = Projet.objects.all()
+    ids = [i for i in map(_identifiant, request.GET.getlist('projet')) if i is not None]
+    if ids:
+        projets = projets.filter(pk__in=ids)
+    client_id = _identifiant(request.GET.get('client'))
+    if client_id is not None:
+        projets = projets.filter(client_id=client_id)
+    if request.GET.get('actif') in ('0', '1'):
+        projets = projets.filter(actif=request.GET['actif'] == '1')
+    if request.GET.get('q', '').strip():
+        projets = projets.filter(nom__icontains=request.GET['q'].strip())
+    if request.GET.get('depuis'):
+        try:
+            depuis = datetime.date.fromisoformat(request.GET['depuis'])
+        except ValueError:
+            return JsonResponse({'success': False, 'error': "Date 'depuis' invalide (AAAA-MM-JJ)"}, status=400)
+        projets = projets.filter(date_creation__date__gte=depuis)
+    return _reponse_lignes(projets, format, f"lignes_{datetime.date.today().strftime('%Y%m%d')}")
+
+
+def _reponse_lignes(projets, format, nom_fichier):
+    if format not in export_lignes_flux.FORMATS:
+        raise Http404("Format d'export inconnu")
+    type_mime, flux = export_lignes_flux.FORMATS[format]
+    reponse = StreamingHttpResponse(flux(export_lignes_flux.lignes(projets)), content_type=type_mime)
+    reponse['Content-Disposition'] = f'attachment; filename="{nom_fichier}.{format}"'
+    return reponse
+
+
+# Rendu de chaque format d'export : (projet, éléments de sablage en cours, fichier binaire, progression)
+ECRIVAINS = {
+    'pdf': ecrire_pdf,
+    'excel': ecrire_excel,
+    'csv': ecrire_csv,
+}
+
+
+CLE_SESSION_TACHES_EXPORT = 'taches_export'
+MAX_TACHES_EXPORT_SESSION = 50
+
+
+def _tache_export_de_session(request, tache_id):
+    """Tâche d'export lancée depuis cette session (404 sinon : pas d'accès aux exports des autres)."""
+    if tache_id not in request.session.get(CLE_SESSION_TACHES_EXPORT, []):
+        raise Http404("Tâche d'export inconnue")
+    return get_object_or_404(Tache, pk=tache_id, type_tache='export')
+
+
+@require_POST
+def export_lancer(request, projet_id, format):
+    """Met l'export en file (202) ; suivre ``url_statut`` puis télécharger ``url_telechargement``"""
+    if format not in ECRIVAINS:
+        raise Http404("Format d'export inconnu")
+    projet = get_object_or_404(Projet, id=projet_id)
+    tache = enfiler_export(projet, format, request.session.get('elements_sablage', []))
+    if not taches_asynchrones():
+        reservee = reserver_tache(tache.pk)
+        if reservee is not None:
+            tache = executer_tache(reservee)
+
+    taches = [t for t in request.session.get(CLE_SESSION_TACHES_EXPORT, []) if t != tache.pk]
+    request.session[CLE_SESSION_TACHES_EXPORT] = (taches + [tache.pk])[-MAX_TACHES_EXPORT_SESSION:]
+    reponse = _statut_export_json(tache)
+    reponse['url_statut'] = reverse('export_statut', args=[tache.pk])
+    return JsonResponse(reponse, status=202)
+
+
+def export_statut(request, tache_id):
+    """Progression d'une tâche d'export (JSON)"""
+    return JsonResponse(_statut_export_json(_tache_export_de_session(request, tache_id)))
+
+
+def _statut_export_json(tache):
+    return {
+        'success': True,
+        'tache': tache.pk,
+        'statut': tache.statut,
+        'statut_display': tache.get_statut_display(),
+        'progression': tache.progression,
+        'total': tache.total,
+        'pourcentage': tache.pourcentage,
+        'message': tache.message,
+        'url_telechargement': reverse('export_telecharger', args=[tache.pk]) if tache.statut == 'termine' else None,
+    }
+
 
-    wb.save(response)
-    return response
+def export_telecharger(request, tache_id):
+    """Document d'une tâche d'export terminée, servi depuis le cache des exports"""
+    tache = _tache_export_de_session(request, tache_id)
+    if tache.statut != 'termine':
+        return JsonResponse({'success': False, 'error': "Export pas encore terminé"}, status=409)
+    parametres = tache.parametres
+    projet = get_object_or_404(Projet, id=parametres['projet_id'])
+    reponse = cache_exports.servir_cle(request, parametres['cle'], parametres['format'],
+                                       nom_fichier_export(projet, parametres['format']))
+    if reponse is None:
+        return JsonResponse({'success': False, 'error': "Document expiré : relancer l'export"}, status=410)
+    return reponse
 
 ##################
 # estimation/views.py - Ajouter cette nouvelle vue
@@ -1316,7 +1186,9 @@ def sablage_tuyauterie(request, categorie_id):
         return redirect('project_selection')
 
     projet = get_object_or_404(Projet, id=projet_id)
-    categorie = get_object_or_404(Categorie, id=categorie_id)
+    categorie = referentiel().categorie(categorie_id)
+    if categorie is None:
+        raise Http404("Catégorie introuvable")
 
     # Données des surfaces unitaires par DN et type de pièce (selon votre tableau Excel)
     SURFACES_SABLAGE = {
@@ -2038,7 +1910,7 @@ def index(request):
     # Statistiques personnalisées pour le client
     projets_client = Projet.objects.filter(client=client, actif=True)
     projets_actifs = projets_client.count()
-    categories = Categorie.objects.all().count()
+    categories = len(referentiel().categories)
     elements = Element.objects.filter(actif=True).count()
 
     context = {
@@ -2131,7 +2003,8 @@ def supprimer_projet(request, projet_id):
     projet = get_object_or_404(Projet, id=projet_id, client_id=client_id)
 
     nom = projet.nom
-    with transaction.atomic():
+    # Les suppressions en cascade ne doivent pas recalculer un résumé voué à disparaître
+    with transaction.atomic(), recalculs_groupes(executer=False):
         # OPTION A — suppression définitive (cascade sur EstimationElement, DemandeElement, EstimationSummary, etc.)
         projet.delete()
 
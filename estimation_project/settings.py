@@ -56,6 +56,8 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Profilage à la demande (en-tête X-Profilage du staff ou ESTIMATION_PROFILAGE)
+    'estimation.middleware.ProfilageMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,6 +90,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Écritures concurrentes (recalculs) : verrou pris dès BEGIN, attente au lieu d'échec
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Base de test sur fichier : la base en mémoire (cache partagé) ne sait pas attendre un verrou
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -166,3 +175,33 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Recalculs après changement de prix d'un élément : en tâche de fond
+# (python manage.py traiter_taches --boucle). False = recalcul immédiat.
+ESTIMATION_TACHES_ASYNCHRONES = True
+# Minutes au-delà desquelles une tâche encore « en cours » est tenue pour
+# abandonnée (worker arrêté) : passée en échec, plus réutilisée par un export.
+ESTIMATION_TACHES_DUREE_MAX = 30
+
+# Cache des catégories/disciplines/unités : version en base relue au plus
+# toutes les N secondes (délai de propagation entre processus). 0 = à chaque accès.
+ESTIMATION_REFERENTIEL_VERIFICATION = 5
+# Génération du catalogue (estimation/pagination.py), partagée en base : même
+# délai de propagation entre processus. 0 = relue à chaque accès.
+ESTIMATION_CATALOGUE_VERIFICATION = 5
+
+# Profilage des requêtes (estimation/profilage.py, page /admin/profilage/) :
+# True = toutes les requêtes ; sinon seulement celles du staff avec l'en-tête
+# « X-Profilage: 1 » (ou « cprofile »). Les N plus lentes sont gardées en mémoire.
+ESTIMATION_PROFILAGE = False
+ESTIMATION_PROFILAGE_CPROFILE = False
+ESTIMATION_PROFILAGE_TAILLE = 50
+
+# Cache des exports PDF/Excel (MEDIA_ROOT/exports, estimation/cache_exports.py) :
+# au-delà de ces limites, les fichiers les moins récemment servis sont supprimés.
+ESTIMATION_EXPORTS_TAILLE_MAX = 200 * 1024 * 1024  # octets
+ESTIMATION_EXPORTS_NOMBRE_MAX = 1000
+
+# Export Excel en écriture seule (estimation/export_excel.py) à partir de ce
+# nombre de lignes ; en dessous, classeur construit en mémoire. 0 = toujours.
+ESTIMATION_EXCEL_SEUIL_FLUX = 0
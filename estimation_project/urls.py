@@ -4,7 +4,12 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from estimation.admin import profilage_detail, profilage_liste
+
 urlpatterns = [
+    path('admin/profilage/', admin.site.admin_view(profilage_liste), name='admin_profilage'),
+    path('admin/profilage/<int:profil_id>/', admin.site.admin_view(profilage_detail),
+         name='admin_profilage_detail'),
     path('admin/', admin.site.urls),
     path('', include('estimation.urls')),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
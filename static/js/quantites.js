@@ -0,0 +1,83 @@
+// static/js/quantites.js
+// Envoi groupé et différé (debounce) des changements de quantité vers
+// ajax/update-quantities/ : une seule requête, et un seul recalcul du résumé,
+// pour toute une rafale de saisies dans une grille.
+//
+//   const quantites = new QuantitesGroupees({
+//       url: "{% url 'ajax_update_quantities' %}",
+//       delai: 400,
+//       onSucces: data => { /* data.lignes, data.summary */ },
+//   });
+//   input.addEventListener('input', () => quantites.modifier(id, input.value));
+(function (window) {
+    'use strict';
+
+    function lireCookie(nom) {
+        const prefixe = nom + '=';
+        for (const morceau of document.cookie.split(';')) {
+            const cookie = morceau.trim();
+            if (cookie.startsWith(prefixe)) {
+                return decodeURIComponent(cookie.slice(prefixe.length));
+            }
+        }
+        return null;
+    }
+
+    class QuantitesGroupees {
+        constructor(options) {
+            this.url = options.url;
+            this.delai = options.delai || 400;
+            this.onEnvoi = options.onEnvoi || function () {};
+            this.onSucces = options.onSucces || function () {};
+            this.onErreur = options.onErreur || function () {};
+            this.enAttente = new Map();
+            this.minuterie = null;
+            this.enCours = null;
+        }
+
+        // Enregistre un changement ; l'envoi part après `delai` ms sans saisie
+        modifier(elementId, quantite) {
+            this.enAttente.set(String(elementId), quantite);
+            clearTimeout(this.minuterie);
+            this.minuterie = setTimeout(() => this.envoyer(), this.delai);
+        }
+
+        // Envoie tout de suite ce qui est en attente (ex. avant de quitter la page)
+        envoyer() {
+            clearTimeout(this.minuterie);
+            if (this.enCours) {
+                // Une requête à la fois : les changements suivants partent ensuite
+                return this.enCours.then(() => this.envoyer());
+            }
+            if (!this.enAttente.size) {
+                return Promise.resolve(null);
+            }
+
+            const changements = Array.from(this.enAttente, ([element_id, quantite]) => ({element_id, quantite}));
+            this.enAttente.clear();
+            this.onEnvoi(changements);
+
+            this.enCours = fetch(this.url, {
+                method: 'POST',
+                credentials: 'same-origin',
+                keepalive: true,
+                headers: {'Content-Type': 'application/json', 'X-CSRFToken': lireCookie('csrftoken')},
+                body: JSON.stringify({changements}),
+            })
+                .then(reponse => reponse.json())
+                .then(data => {
+                    if (data.success) {
+                        this.onSucces(data, changements);
+                    } else {
+                        this.onErreur(data, changements);
+                    }
+                    return data;
+                })
+                .catch(erreur => this.onErreur(erreur, changements))
+                .finally(() => { this.enCours = null; });
+            return this.enCours;
+        }
+    }
+
+    window.QuantitesGroupees = QuantitesGroupees;
+})(window);